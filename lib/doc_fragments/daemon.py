@@ -0,0 +1,22 @@
+class ModuleDocFragment(object):
+    DOCUMENTATION = r'''
+    options:
+        daemon:
+            description:
+                - Run the scan jobs in a local daemon that keeps scapy loaded and the ISOTP sockets open between tasks.
+                - The daemon is started by the first task that uses it and stops after I(daemon_idle_timeout) seconds without jobs.
+                - The sockets are cached by their serialized form, so following tasks on the same sockets skip loading scapy and creating the sockets.
+                - The daemon reports the progress of a scan while it runs, e.g. to write the I(checkpoint_file). If the task is interrupted, the scan in the daemon stops with its next progress report and frees the socket.
+            type: bool
+            default: no
+        daemon_socket:
+            description:
+                - Path of the Unix socket of the daemon.
+                - Defaults to daemon.sock in the scable cache directory (~/.cache/scable).
+            type: path
+        daemon_idle_timeout:
+            description:
+                - Seconds without jobs until the daemon stops and closes its sockets.
+            type: int
+            default: 600
+    '''
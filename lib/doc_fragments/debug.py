@@ -7,5 +7,12 @@ class ModuleDocFragment(object):
                 - Enable debug output to the system journal (if available)
             type: bool
             default: no
+
+        log_file:
+            description:
+                - Append the last 2000 debug messages to this file when the module exits, also without I(debug).
+                - The messages are written to the file at once when the module exits, so this is cheaper than I(debug) during a scan.
+            type: path
+            required: false
     '''
 
@@ -31,7 +31,20 @@ class ModuleDocFragment(object):
                 listen_only:
                     description: listen_only
                     type: bool
+                extended_can_id:
+                    description:
+                      - Use 29 bit CAN identifiers for sid and did.
+                      - If it is missing, identifiers above 0x7ff are 29 bit.
+                      - 29 bit identifiers up to 0x7ff need I(multiplexed_transport).
+                    type: bool
                 basecls:
                     description: base class
                     type: str
+
+        multiplexed_transport:
+            description:
+                - Without the can_isotp kernel module, all ISOTP sockets of an interface share one CANSocket and one receiver thread instead of scapy's ISOTPSoftSocket, which opens a CANSocket and starts three threads per socket.
+                - Has no effect if can_isotp is loaded, the kernel sockets are used then.
+            type: bool
+            default: no
     '''
\ No newline at end of file
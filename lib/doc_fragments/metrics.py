@@ -0,0 +1,11 @@
+class ModuleDocFragment(object):
+    DOCUMENTATION = r'''
+    options:
+        metrics:
+            description:
+                - Return the I(metrics) of the run, e.g. to find out which phase of a scan to tune on a bench.
+                - Contains the time spent in each phase, latency histograms of the probes and requests, counters of the sent and received frames, the thread count and the peak RSS.
+                - With I(daemon), the work done in the daemon only shows up in the phases of the module, not in the counters and histograms.
+            type: bool
+            default: no
+    '''
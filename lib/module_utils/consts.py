@@ -1,4 +1,10 @@
 from sys import platform
 
 LINUX = platform.startswith("linux")
-WINDOWS = platform.startswith("win32")
\ No newline at end of file
+WINDOWS = platform.startswith("win32")
+
+#sysfs directory with one entry per network interface
+SYSFS_NET = "/sys/class/net"
+
+#interface type of CAN interfaces in linux (see linux/if_arp.h)
+ARPHRD_CAN = 280
\ No newline at end of file
@@ -13,4 +13,144 @@ from .core import *
     usage: import ansible.module_utils.scapy as scapy_utils
     scapy_utils.isotp.dump_socks(isotp_socks)
 '''
-from . import isotp
\ No newline at end of file
+from . import isotp
+
+
+'''
+    make the worker helpers available via the parallel namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.parallel.run_processes(scan, interfaces)
+'''
+from . import parallel
+
+
+'''
+    make the ISOTP scan engine available via the scan namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.scan.scan('can0', range(0x800))
+'''
+from . import scan
+
+
+'''
+    make the passive ISOTP endpoint discovery available via the passive namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.passive.discover('can0', listen_time=10)
+'''
+from . import passive
+
+
+'''
+    make the round trip time estimator available via the rtt namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.rtt.RttEstimator().timeout(default=1)
+'''
+from . import rtt
+
+
+'''
+    make the multiplexed ISOTP transport available via the isotpmux namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.isotpmux.ISOTPMuxSocket('can0', sid=0x601, did=0x701, basecls=UDS)
+'''
+from . import isotpmux
+
+
+'''
+    make the reset handlers and the session graph explorer available via the reset namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.reset.SessionExplorer(sock, scapy_utils.reset.make_reset_handler({'type': 'uds'}), range(0x10)).explore()
+'''
+from . import reset
+
+
+'''
+    make the SQLite result store available via the resultdb namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.resultdb.ResultDb('/tmp/uds.db', 'uds_scanner').add(rows)
+'''
+from . import resultdb
+
+
+'''
+    make the checkpoints available via the checkpoint namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.checkpoint.UdsCheckpoint('/tmp/uds_scan.checkpoint', {'session_range': 0x100}).state(ecu, 'services')
+'''
+from . import checkpoint
+
+
+'''
+    make the resumable UDS enumerators available via the uds namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.uds.enumerate_services(sock, skip=set(), progress=None)
+'''
+from . import uds
+
+
+'''
+    make the batched ReadDataByIdentifier scanner available via the did namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.did.DidScanner(sock).scan(range(0x10000))
+'''
+from . import did
+
+
+'''
+    make the memory readers available via the memory namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.memory.dump_memory(scapy_utils.memory.RmbaReader(sock), '/tmp/dump.bin', 0x1000, 0x100)
+'''
+from . import memory
+
+
+'''
+    make the CAN capability probe available via the caps namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.caps.cached_probe()['isotp_transport']
+'''
+from . import caps
+
+
+'''
+    make the scan daemon available via the daemon namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.daemon.start(scapy_utils.daemon.default_socket())
+    scapy_utils.daemon.request(scapy_utils.daemon.default_socket(), 'ping')
+'''
+from . import daemon
+
+
+'''
+    make the leveled logging available via the log namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    if scapy_utils.log.enabled(scapy_utils.log.DEBUG):
+        scapy_utils.debug("state: {}", expensive_state())
+'''
+from . import log
+
+
+'''
+    make the instrumentation available via the metrics namespace
+
+    usage: import ansible.module_utils.scapy as scapy_utils
+    scapy_utils.metrics.enable()
+    with scapy_utils.metrics.phase('probe'):
+        ...
+    result['metrics'] = scapy_utils.metrics.report()
+'''
+from . import metrics
\ No newline at end of file
@@ -0,0 +1,214 @@
+import os
+import socket
+import struct
+
+import ansible.module_utils.scapy.core as c
+import ansible.module_utils.scapy.store as store
+from ansible.module_utils.consts import LINUX, SYSFS_NET
+
+#changes with every boot of the host, the cached capabilities are only valid until the next boot
+BOOT_ID = '/proc/sys/kernel/random/boot_id'
+PROC_MODULES = '/proc/modules'
+
+#kernel modules of SocketCAN that are reported
+CAN_MODULES = ('can', 'can_raw', 'can_dev', 'vcan', 'can_isotp')
+
+#mtu of CAN FD interfaces (see linux/can.h), classic CAN interfaces have 16
+CANFD_MTU = 72
+
+#rtnetlink constants (see linux/netlink.h, linux/rtnetlink.h, linux/if_link.h and linux/can/netlink.h)
+NETLINK_ROUTE = 0
+NLM_F_REQUEST = 0x1
+NLMSG_ERROR = 0x2
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+IFLA_INFO_DATA = 2
+IFLA_CAN_BITTIMING = 1
+IFLA_CAN_CTRLMODE = 5
+IFLA_CAN_DATA_BITTIMING = 9
+CAN_CTRLMODE_FD = 0x20
+
+#struct nlmsghdr, struct ifinfomsg and struct rtattr
+NLMSGHDR = struct.Struct('=IHHII')
+IFINFOMSG = struct.Struct('=BxHiII')
+RTATTR = struct.Struct('=HH')
+
+CACHE_NAME = 'can_caps.json'
+
+
+def read_file(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return default
+
+
+def loaded_modules():
+    '''Returns the names of the loaded kernel modules from /proc/modules, None if it can not be read.'''
+    content = read_file(PROC_MODULES)
+    if content is None:
+        return None
+
+    return set(line.split(' ', 1)[0] for line in content.splitlines())
+
+
+def attributes(data):
+    '''Splits rtnetlink attributes into a dict type -> payload.'''
+    result = {}
+    pos = 0
+
+    while pos + RTATTR.size <= len(data):
+        length, attr_type = RTATTR.unpack_from(data, pos)
+        if length < RTATTR.size:
+            break
+        #the type has flags in the upper bits, e.g. NLA_F_NESTED
+        result[attr_type & 0x3fff] = data[pos + RTATTR.size:pos + length]
+        #attributes are aligned to 4 bytes
+        pos += (length + 3) & ~3
+
+    return result
+
+
+def link_info(iface):
+    '''
+        Queries the link info of an interface with one rtnetlink RTM_GETLINK request.
+        Returns a dict with the kind (e.g. can, vcan), the bitrates and whether CAN FD is enabled,
+        an empty dict if the query fails.
+    '''
+    result = {}
+
+    try:
+        index = socket.if_nametoindex(iface)
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    except (OSError, AttributeError):
+        return result
+
+    try:
+        sock.settimeout(1)
+        msg = IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, 0, 0)
+        sock.send(NLMSGHDR.pack(NLMSGHDR.size + len(msg), RTM_GETLINK, NLM_F_REQUEST, 1, 0) + msg)
+        data = sock.recv(65536)
+    except (OSError, socket.timeout):
+        return result
+    finally:
+        sock.close()
+
+    if len(data) < NLMSGHDR.size + IFINFOMSG.size:
+        return result
+
+    length, msg_type, _, _, _ = NLMSGHDR.unpack_from(data)
+    if msg_type != RTM_NEWLINK:
+        return result
+
+    link = attributes(data[NLMSGHDR.size + IFINFOMSG.size:length]).get(IFLA_LINKINFO)
+    if link is None:
+        return result
+
+    info = attributes(link)
+    if IFLA_INFO_KIND in info:
+        result['kind'] = info[IFLA_INFO_KIND].rstrip(b'\0').decode()
+
+    can = attributes(info.get(IFLA_INFO_DATA, b''))
+    #struct can_bittiming starts with the bitrate
+    if len(can.get(IFLA_CAN_BITTIMING, b'')) >= 4:
+        result['bitrate'] = struct.unpack_from('=I', can[IFLA_CAN_BITTIMING])[0]
+    if len(can.get(IFLA_CAN_DATA_BITTIMING, b'')) >= 4:
+        result['data_bitrate'] = struct.unpack_from('=I', can[IFLA_CAN_DATA_BITTIMING])[0]
+    #struct can_ctrlmode is mask, flags
+    if len(can.get(IFLA_CAN_CTRLMODE, b'')) >= 8:
+        result['fd'] = bool(struct.unpack_from('=II', can[IFLA_CAN_CTRLMODE])[1] & CAN_CTRLMODE_FD)
+
+    return result
+
+
+def interface_caps(iface, link=None):
+    '''
+        Returns the state, mtu, txqueuelen, CAN FD support and bitrates of a CAN interface.
+        link: the link_info() of iface, e.g. from the cache, it is queried if not set.
+    '''
+    path = os.path.join(SYSFS_NET, iface)
+
+    def number(name):
+        value = read_file(os.path.join(path, name))
+        return int(value, 0) if value else None
+
+    mtu = number('mtu')
+    flags = number('flags')
+    caps = {
+        'state': read_file(os.path.join(path, 'operstate')),
+        #IFF_UP, virtual interfaces report the operstate unknown
+        'up': bool(flags & 0x1) if flags is not None else None,
+        'mtu': mtu,
+        'fd': mtu == CANFD_MTU,
+        'txqueuelen': number('tx_queue_len'),
+        'kind': None,
+        'bitrate': None,
+        'data_bitrate': None
+    }
+    caps.update(link_info(iface) if link is None else link)
+
+    return caps
+
+
+def probe(links=None):
+    '''
+        Probes the CAN capabilities of this host without starting any process.
+        links: dict of interface -> link_info(), the link info of other interfaces is queried.
+        Returns a dict with the loaded CAN kernel modules, the CAN interfaces with their capabilities
+        and the ISOTP transport that load_scapy() uses.
+    '''
+    modules = loaded_modules()
+    interfaces = c.can_interfaces()
+    links = links or {}
+
+    caps = {
+        'boot_id': read_file(BOOT_ID),
+        'modules': {name: name in modules for name in CAN_MODULES} if modules is not None else None,
+        'interfaces': {iface: interface_caps(iface, links.get(iface)) for iface in interfaces}
+    }
+    caps['isotp_transport'] = 'native' if modules is not None and 'can_isotp' in modules else 'soft'
+
+    return caps
+
+
+def cached_probe(cache_dir=None):
+    '''
+        Returns the CAN capabilities of this host, the link info of the interfaces is taken from the cache.
+
+        The state, flags, mtu and txqueuelen are read from sysfs on every call, only the rtnetlink queries are cached.
+        The cache is valid until the next boot, until a kernel module is loaded, an interface is added or removed
+        or until an interface was down, the bitrates and the CAN FD mode can only be changed while it is down.
+        Returns None on hosts without /proc and sysfs.
+    '''
+    if not LINUX:
+        return None
+
+    #the loaded modules are compared by a hash, so a modprobe or rmmod invalidates the cache
+    #the carrier changes of an interface are counted up when it goes down or up
+    interfaces = c.can_interfaces()
+    key = {
+        'boot_id': read_file(BOOT_ID),
+        'modules': store.digest(sorted(loaded_modules() or ())),
+        'interfaces': interfaces,
+        'carrier_changes': [read_file(os.path.join(SYSFS_NET, iface, 'carrier_changes')) for iface in interfaces]
+    }
+    path = store.cache_path(cache_dir, CACHE_NAME)
+
+    cached = store.load_json(path)
+    if cached is not None and cached.get('key') == key:
+        c.debug("CAN link info from cache '{}'", path)
+        links = cached['links']
+    else:
+        links = {iface: link_info(iface) for iface in interfaces}
+        try:
+            store.save_json(path, {'key': key, 'links': links})
+        except (IOError, OSError) as e:
+            c.debug("could not cache CAN link info: {}", e)
+
+    caps = probe(links)
+    c.debug("CAN capabilities: {}", caps)
+
+    return caps
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import threading
+
+import ansible.module_utils.scapy.core as c
+import ansible.module_utils.scapy.store as store
+from ansible.module_utils.scapy.idset import IdSet
+
+
+class ScanCheckpoint(object):
+    '''
+        Records the progress of an ISOTP scan in a json file, so an interrupted scan can be resumed.
+
+        The file contains the parameters of the scan, the noise profile, the already probed ids and the found answers.
+        A checkpoint is only resumed if the parameters match, otherwise the scan starts over.
+        To keep the overhead low the file is written at most every save_interval seconds.
+    '''
+
+    def __init__(self, path, params, save_interval=5):
+        self.path = path
+        self.params = params
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.last_save = 0
+
+        self.noise = None
+        self.done = IdSet()
+        self.found = {}
+
+        data = store.load_json(path)
+        if data is None:
+            return
+
+        if data.get('params') != params:
+            c.warn("checkpoint '{}' belongs to a scan with other parameters, starting over", path)
+            return
+
+        #json stores the keys as strings
+        self.noise = data['noise']
+        if self.noise is not None:
+            self.noise['ids'] = {int(i): period for i, period in self.noise['ids'].items()}
+        self.done = IdSet(data['done'])
+        self.found = {int(answer_id): tuple(value) for answer_id, value in data['found'].items()}
+
+        c.debug("resuming from checkpoint '{}': {} ids done, {} found", path, len(self.done), len(self.found))
+
+    @property
+    def resumed(self):
+        return bool(self.done)
+
+    def set_noise(self, noise):
+        '''Record the noise profile, so a resumed scan does not need to listen again.'''
+        with self.lock:
+            self.noise = noise
+            self.__save()
+
+    def update(self, probe_id, answers):
+        '''
+            Record that probe_id was probed and got answers {answer_id: (probe_id, padding)}.
+            Called by the probe workers, so it must be thread safe.
+        '''
+        with self.lock:
+            self.done.add(probe_id)
+            self.found.update(answers)
+
+            if answers or time.time() - self.last_save >= self.save_interval:
+                self.__save()
+
+    def __save(self):
+        store.save_json(self.path, {
+            'params': self.params,
+            'noise': self.noise,
+            'done': self.done.intervals(),
+            'found': self.found
+        })
+        self.last_save = time.time()
+
+    def remove(self):
+        '''Remove the checkpoint file after the scan has completed.'''
+        with self.lock:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+class UdsCheckpoint(object):
+    '''
+        Records the progress of a UDS scan per socket and phase in a json file, so an interrupted scan can be resumed.
+
+        Every phase of a socket (e.g. 'services', 'sessions') has a json serializable state dict, e.g. the probed
+        service ids and the raw responses. A finished phase is skipped on resume, the others continue from their state.
+        The states are changed by concurrent workers, so they are only modified by the methods of this class.
+    '''
+
+    def __init__(self, path, params, resume=True, save_interval=5):
+        self.path = path
+        self.params = params
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.last_save = 0
+
+        #socket -> phase -> state
+        self.sockets = {}
+
+        if not resume:
+            return
+
+        data = store.load_json(path)
+        if data is None:
+            return
+
+        if data.get('params') != params:
+            c.warn("checkpoint '{}' belongs to a scan with other parameters, starting over", path)
+            return
+
+        self.sockets = data['sockets']
+
+        if c.log.enabled(c.log.DEBUG):
+            c.debug("resuming from checkpoint '{}': {}", path, {
+                sock: [phase for phase, state in phases.items() if state.get('done')]
+                for sock, phases in self.sockets.items()
+            })
+
+    def __state(self, sock, phase):
+        return self.sockets.setdefault(sock, {}).setdefault(phase, {'done': False})
+
+    def state(self, sock, phase):
+        '''Returns a copy of the state of a phase, an empty state if the phase was not started.'''
+        with self.lock:
+            return json.loads(json.dumps(self.__state(sock, phase)))
+
+    def append(self, sock, phase, **items):
+        '''Append each value to the list with its key in the state of a phase.'''
+        with self.lock:
+            state = self.__state(sock, phase)
+            for key, value in items.items():
+                state.setdefault(key, []).append(value)
+            self.__save()
+
+    def set(self, sock, phase, **values):
+        '''Set values in the state of a phase.'''
+        with self.lock:
+            self.__state(sock, phase).update(values)
+            self.__save()
+
+    def finish(self, sock, phase):
+        '''Mark a phase as done, it is skipped on resume.'''
+        with self.lock:
+            self.__state(sock, phase)['done'] = True
+            self.__save(force=True)
+
+    def __save(self, force=False):
+        if not force and time.time() - self.last_save < self.save_interval:
+            return
+
+        store.save_json(self.path, {
+            'params': self.params,
+            'sockets': self.sockets
+        })
+        self.last_save = time.time()
+
+    def remove(self):
+        '''Remove the checkpoint file after the scan has completed.'''
+        with self.lock:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
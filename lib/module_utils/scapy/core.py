@@ -1,14 +1,26 @@
 import sys, os
+import json
+import time
 import contextlib
-from scapy.all import conf, load_contrib, load_layer
-from scapy.main import _load
-from ansible.module_utils.consts import LINUX, WINDOWS
+
+#scapy.all imports every layer and the routing tables of the host, which takes seconds on every task
+#only the loader of scapy is imported here, load_scapy() imports the layers a module needs
+__started = time.time()
+from scapy.config import conf
+from scapy.main import load_contrib, load_layer, _load
+from ansible.module_utils.consts import LINUX, WINDOWS, SYSFS_NET, ARPHRD_CAN
 from ansible.module_utils.six import PY3
+import ansible.module_utils.scapy.log as log
 
 ANSIBLE_MODULE = None
 ISOTPSOCKET_IS_NATIVE = False
 
-__DEBUG = False
+#seconds spent importing the parts of scapy, reported in the debug output of load_scapy()
+IMPORT_TIMES = {'scapy.main': time.time() - __started}
+
+#CAN capabilities of the host, probed by load_scapy() or can_facts()
+CAN_CAPS = None
+
 __INIT = False
 
 def __linux_kernel_module_loaded(kernel_module_name):
@@ -20,13 +32,16 @@ def __linux_kernel_module_loaded(kernel_module_name):
     return rc == 0
 
 
-def init(ansible_module=None, debug=False):
+def init(ansible_module=None, debug=False, log_file=None):
     '''
         Initialize scapy_utils with the ansible module and additional flags.
         This function must be called prior to using any other features.
+
+        debug: Write debug messages to the journal.
+        log_file: Append the last debug messages to this file when the module exits.
     '''
 
-    global ANSIBLE_MODULE, __DEBUG, __INIT
+    global ANSIBLE_MODULE, __INIT
 
     if not PY3:
         sys.exit("python version is not 3")
@@ -36,38 +51,34 @@ def init(ansible_module=None, debug=False):
     else:
         raise TypeError("ansible_module must not be None")
 
-    if isinstance(debug, bool):
-        __DEBUG = debug
+    log.configure(ansible_module, level=log.DEBUG if debug is True else log.WARNING, log_file=log_file)
 
     __INIT = True
 
 
-def debug(msg):
-    '''
-        Used for printing out debugging messages via the journal.
-        Can be enabled with flags passed to the init() function.
-    '''
-    if __DEBUG:
-        ANSIBLE_MODULE.log("DEBUG '{}' in '{}': {}".format(
-            sys._getframe(1).f_code.co_name, 
-            os.path.basename(sys._getframe(1).f_code.co_filename),
-            msg)
-        )
+#debug(msg, *args) is used for printing out debugging messages via the journal, it can be enabled with init()
+#msg is formatted with msg.format(*args) only if debug output is enabled, so pass the arguments instead of formatting them
+debug = log.debug
+
+#warn(msg, *args) is used for printing out warnings via the journal, it can not be disabled
+warn = log.warn
 
-def warn(msg):
-    '''
-        Used for printing out warnings via the journal.
-        Can not be disabled.
-    '''
-    ANSIBLE_MODULE.log("WARNING: " + msg)
 
+def __timed_load(name, load, *args):
+    started = time.time()
+    load(*args)
+    IMPORT_TIMES[name] = time.time() - started
 
-def load_scapy(isotp=True, uds=False):
+
+def load_scapy(isotp=True, uds=False, utils=False):
     '''
         Initializes scapy for the use within the custom ansible module.
         Loads needed scapy modules and makes them directly available in the global namespace.
+        Only the CAN layers and the requested contribs are imported, not scapy.all.
+
+        utils: also make the helpers of scapy.utils available, e.g. make_lined_table
     '''
-    global ISOTPSOCKET_IS_NATIVE
+    global ISOTPSOCKET_IS_NATIVE, CAN_CAPS
     
     if not __INIT:
         raise RuntimeError("init() was not called")
@@ -82,25 +93,95 @@ def load_scapy(isotp=True, uds=False):
         debug("Platform is Linux -> CANSocket is native")
         conf.contribs['CANSocket'] = {'use-python-can': False}
 
-        if(__linux_kernel_module_loaded('can_isotp')):
+        #imported here, caps uses the functions of this module
+        import ansible.module_utils.scapy.caps as caps
+        CAN_CAPS = caps.cached_probe()
+
+        #the probe reads /proc/modules, lsmod is only needed if it is not readable
+        if CAN_CAPS['modules'] is not None:
+            isotp_native = CAN_CAPS['modules']['can_isotp']
+        else:
+            isotp_native = __linux_kernel_module_loaded('can_isotp')
+
+        if(isotp_native):
             debug("using can_isotp kernel module")
             conf.contribs['ISOTP'] = {'use-can-isotp-kernel-module': True}
             ISOTPSOCKET_IS_NATIVE = True
         else:
-            debug("can_isotp kernel module not loaded")
+            warn("can_isotp kernel module not loaded, falling back to the slower ISOTPSoftSocket")
             conf.contribs['ISOTP'] = {'use-can-isotp-kernel-module': False}
             ISOTPSOCKET_IS_NATIVE = False
 
-        load_contrib("cansocket")
-        load_layer("can")
+        __timed_load("cansocket", load_contrib, "cansocket")
+        __timed_load("can", load_layer, "can")
 
     if(isotp):
-        load_contrib("isotp")
+        __timed_load("isotp", load_contrib, "isotp")
 
     if(uds):
-        load_contrib("automotive.uds")
+        __timed_load("automotive.uds", load_contrib, "automotive.uds")
+
+    if(utils):
+        __timed_load("scapy.utils", _load, "scapy.utils")
+
+    if log.enabled(log.DEBUG):
+        debug("scapy import times: {}, total {:.3f}s",
+              ", ".join("{} {:.3f}s".format(name, seconds) for name, seconds in IMPORT_TIMES.items()),
+              sum(IMPORT_TIMES.values()))
+
+def can_facts():
+    '''
+        Returns the CAN capabilities probed by load_scapy() as ansible facts, e.g. for result['ansible_facts'].
+        Contains the CAN kernel modules, the CAN interfaces (state, mtu, fd, txqueuelen, kind, bitrates)
+        and the isotp_transport (native or soft).
+        A client of a daemon does not call load_scapy(), the capabilities are probed here then.
+    '''
+    global CAN_CAPS
+
+    if CAN_CAPS is None and LINUX:
+        #imported here, caps uses the functions of this module
+        import ansible.module_utils.scapy.caps as caps
+        CAN_CAPS = caps.cached_probe()
+
+    if CAN_CAPS is None:
+        return {}
 
-    _load("scapy.utils")
+    return {'scable_can': CAN_CAPS}
+
+def wait_readable(sock, timeout):
+    '''
+        Waits until the scapy socket has data to read or the timeout expires.
+        Returns True if data is available.
+        Supports both select() flavours of scapy sockets (list or tuple of list and recv function).
+    '''
+    ready = sock.select([sock], max(timeout, 0))
+
+    if isinstance(ready, tuple):
+        ready = ready[0]
+
+    return bool(ready)
+
+def can_interfaces():
+    '''
+        Returns a sorted list with the names of all CAN interfaces on this host.
+        Reads the interface type from sysfs, CAN interfaces have the type ARPHRD_CAN.
+    '''
+    result = []
+
+    if not LINUX:
+        return result
+
+    for iface in os.listdir(SYSFS_NET):
+        try:
+            with open(os.path.join(SYSFS_NET, iface, 'type')) as f:
+                if int(f.read().strip()) == ARPHRD_CAN:
+                    result.append(iface)
+        except (IOError, ValueError):
+            continue
+
+    debug("found CAN interfaces: {}", result)
+
+    return sorted(result)
 
 def is_basic_type(object):
     return isinstance(object, (str, int, float, bool))
@@ -132,7 +213,7 @@ def std_redirected(filename):
     with std_redirected('testfile.txt'):
         print('hi')
     '''
-    debug("redirecting stdout/stderr to '{}'".format(filename))
+    debug("redirecting stdout/stderr to '{}'", filename)
 
     try:
         old_stdout = os.dup(sys.stdout.fileno())
@@ -153,4 +234,27 @@ def std_redirected(filename):
         if old_stderr is not None:
             os.dup2(old_stderr, sys.stderr.fileno())
         if f is not None:
-            f.close()
\ No newline at end of file
+            f.close()
+
+
+class JsonlWriter(object):
+    '''
+        Appends records as json lines to a file, e.g. to stream results while a scan is still running.
+
+        Every record is written with a single write() to a file that is opened with O_APPEND,
+        so records of threads and forked worker processes do not interleave.
+    '''
+
+    def __init__(self, filename):
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        debug("streaming json lines to '{}'", filename)
+        self.fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def write(self, record):
+        os.write(self.fd, (json.dumps(record, sort_keys=True) + "\n").encode())
+
+    def close(self):
+        os.close(self.fd)
\ No newline at end of file
@@ -0,0 +1,365 @@
+import os
+import json
+import time
+import socket
+import threading
+import traceback
+import contextlib
+
+import ansible.module_utils.scapy.core as c
+import ansible.module_utils.scapy.store as store
+import ansible.module_utils.scapy.isotp as isotp
+import ansible.module_utils.scapy.uds as uds
+import ansible.module_utils.scapy.rtt as rtt
+import ansible.module_utils.scapy.did as did
+import ansible.module_utils.scapy.scan as scan
+import ansible.module_utils.scapy.passive as passive
+from ansible.module_utils.scapy.errors import DaemonError
+
+#file name of the Unix socket in the cache directory
+SOCKET_NAME = 'daemon.sock'
+
+#seconds without jobs until the daemon stops
+IDLE_TIMEOUT = 600
+
+#seconds a started daemon has to accept connections
+START_TIMEOUT = 10
+
+
+def default_socket(cache_dir=None):
+    return store.cache_path(cache_dir, SOCKET_NAME)
+
+
+def send_json(conn, data):
+    conn.sendall((json.dumps(data) + "\n").encode())
+
+
+def recv_json(reader):
+    '''Reads one json line from reader, the file of a connection, returns None if the connection was closed.'''
+    line = reader.readline()
+    return json.loads(line.decode()) if line else None
+
+
+def connect(path, timeout=None):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.settimeout(timeout)
+        conn.connect(path)
+    except (IOError, OSError):
+        conn.close()
+        raise
+    return conn
+
+
+def request(path, job, progress=None, **args):
+    '''
+        Runs a job in the daemon at path and returns its result.
+        The job must be one of JOBS, args must be json serializable.
+        progress: Optional callback progress(data) that is called with the progress the job reports while it runs.
+
+        throws DaemonError if the daemon is not reachable or the job failed.
+    '''
+    try:
+        conn = connect(path)
+    except (IOError, OSError) as e:
+        raise DaemonError("daemon at '{}' is not reachable: {}".format(path, e))
+
+    with contextlib.closing(conn), conn.makefile('rb') as reader:
+        send_json(conn, {'job': job, 'args': args})
+        resp = recv_json(reader)
+        while resp is not None and resp['status'] == 'progress':
+            if progress:
+                progress(resp['progress'])
+            resp = recv_json(reader)
+
+    if resp is None:
+        raise DaemonError("daemon closed the connection during job '{}'".format(job))
+    if resp['status'] != 'ok':
+        raise DaemonError("job '{}' failed in the daemon:\n{}".format(job, resp['error']))
+
+    return resp['result']
+
+
+class Daemon(object):
+    '''
+        Runs jobs for the modules on a Unix socket, one json request and one json response per connection.
+        A job can report its progress with json lines before the response. If the client is gone, reporting the
+        progress fails and the job is aborted, so it does not hold its socket for a task that was interrupted.
+
+        The daemon keeps scapy loaded and caches an ISOTP socket per serialized socket dict, so the jobs of following
+        tasks skip loading scapy and creating the sockets. Socket dicts that only differ in their basecls share
+        a socket. Jobs on the same socket run one after another, jobs on different sockets concurrently.
+        Only the jobs in JOBS can be run.
+    '''
+
+    def __init__(self, path, idle_timeout=IDLE_TIMEOUT):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.started = time.time()
+        self.last_job = time.time()
+        self.running = 0
+        self.stopped = False
+        self.lock = threading.Lock()
+
+        #json of the socket dict without basecls -> (scapy socket, lock)
+        self.sockets = {}
+
+    @contextlib.contextmanager
+    def socket(self, socket_dict):
+        '''Returns the cached socket of socket_dict with its basecls and holds its lock while it is used.'''
+        options = dict(socket_dict)
+        basecls = UDS if options.pop('basecls', 'ISOTP') == 'UDS' else ISOTP
+        key = json.dumps(options, sort_keys=True)
+
+        with self.lock:
+            if key not in self.sockets:
+                #load_socks() modifies the dicts
+                self.sockets[key] = (isotp.load_socks([dict(socket_dict)], throw=True)[0], threading.Lock())
+                c.debug("daemon opened socket {}", key)
+            sock, lock = self.sockets[key]
+
+        with lock:
+            sock.basecls = basecls
+            yield sock
+
+    def release(self):
+        with self.lock:
+            for sock, lock in self.sockets.values():
+                with lock:
+                    sock.close()
+            released = len(self.sockets)
+            self.sockets = {}
+        return released
+
+    def handle(self, conn):
+        def progress(data):
+            send_json(conn, {'status': 'progress', 'progress': data})
+
+        with contextlib.closing(conn):
+            try:
+                with conn.makefile('rb') as reader:
+                    req = recv_json(reader)
+                if req is None:
+                    return
+                if req.get('job') not in JOBS:
+                    raise ValueError("unknown job '{}'".format(req.get('job')))
+
+                resp = {'status': 'ok', 'result': JOBS[req['job']](self, progress, **req.get('args', {}))}
+            except Exception:
+                resp = {'status': 'error', 'error': traceback.format_exc()}
+
+            try:
+                send_json(conn, resp)
+            except (IOError, OSError):
+                #the client is gone, e.g. the task was interrupted
+                pass
+
+            with self.lock:
+                self.running -= 1
+                self.last_job = time.time()
+
+    def serve(self):
+        '''Accepts connections until the daemon is stopped or idle for idle_timeout seconds.'''
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(16)
+        listener.settimeout(1)
+
+        c.debug("daemon {} listening on '{}'", os.getpid(), self.path)
+
+        try:
+            while not self.stopped:
+                with self.lock:
+                    if not self.running and time.time() - self.last_job > self.idle_timeout:
+                        break
+
+                try:
+                    conn, _ = listener.accept()
+                except socket.timeout:
+                    continue
+
+                with self.lock:
+                    self.running += 1
+                worker = threading.Thread(target=self.handle, args=(conn,))
+                worker.daemon = True
+                worker.start()
+        finally:
+            listener.close()
+            os.unlink(self.path)
+            self.release()
+
+
+def job_ping(daemon, progress):
+    return {
+        'pid': os.getpid(),
+        'uptime': time.time() - daemon.started,
+        'sockets': len(daemon.sockets)
+    }
+
+
+def job_release(daemon, progress):
+    '''Close all cached sockets, e.g. after the interfaces were reconfigured.'''
+    return {'released': daemon.release()}
+
+
+def job_shutdown(daemon, progress):
+    daemon.stopped = True
+    return {'pid': os.getpid()}
+
+
+def job_uds_rtt(daemon, progress, socket_dict):
+    '''Runs uds.measure_rtt(), returns the measured round trip times (samples) and the unanswered requests (timeouts).'''
+    estimator = rtt.RttEstimator()
+    with daemon.socket(socket_dict) as sock:
+        uds.measure_rtt(sock, estimator)
+
+    return {'samples': list(estimator.samples), 'timeouts': estimator.timeouts}
+
+
+def job_uds_services(daemon, progress, socket_dict, skip=(), window=1, burst=False, timeout=uds.SERVICE_TIMEOUT):
+    '''
+        Runs uds.enumerate_services() and reports [service id, raw response as hex or None] of every request,
+        returns the amount of requests.
+        With burst, all services are requested at once with scapy's UDS_ServiceEnumerator and only the available
+        services are reported.
+    '''
+    probed = []
+
+    def report(sid, resp):
+        probed.append(sid)
+        progress([sid, bytes(resp).hex() if resp is not None else None])
+
+    with daemon.socket(socket_dict) as sock:
+        if burst:
+            for _, resp in UDS_ServiceEnumerator(sock):
+                report(uds.request_service_id(resp), resp)
+        else:
+            uds.enumerate_services(sock, timeout=timeout, skip=set(skip), progress=report, window=window)
+
+    return len(probed)
+
+
+def job_uds_sessions(daemon, progress, socket_dict, session_range, reset_wait, skip=(), timeout=None):
+    '''
+        Runs uds.enumerate_sessions() and reports [session, [found sessions as hex]] of every session,
+        returns the amount of requested sessions.
+    '''
+    probed = []
+
+    def report(session, found):
+        probed.append(session)
+        progress([session, [bytes(pkt).hex() for pkt in found]])
+
+    with daemon.socket(socket_dict) as sock:
+        uds.enumerate_sessions(sock, range(0, session_range), reset_wait, skip=set(skip), progress=report,
+                               timeout=timeout)
+
+    return len(probed)
+
+
+def job_uds_detect(daemon, progress, socket_dict, probes, reset_type, adaptive_timeout):
+    '''
+        Runs uds.detect(), returns is_uds, the round trip times (rtt) and the serialized UDS socket
+        if the ECU answered (socket).
+    '''
+    with daemon.socket(socket_dict) as sock:
+        is_uds, rtt = uds.detect(sock, probes, reset_type=reset_type, adaptive_timeout=adaptive_timeout)
+        #uds.detect() sets the UDS basecls
+        return {
+            'is_uds': is_uds,
+            'rtt': rtt,
+            'socket': isotp.dump_socks([sock], throw=True)[0] if is_uds else None
+        }
+
+
+def job_did_scan(daemon, progress, socket_dict, did_start, did_end, **options):
+    '''Runs did.DidScanner(**options).scan() on the DIDs from did_start to did_end.'''
+    with daemon.socket(socket_dict) as sock:
+        return did.DidScanner(sock, **options).scan(range(did_start, did_end + 1))
+
+
+def job_isotp_scan(daemon, progress, interface, ids, **options):
+    '''
+        Runs scan.scan() on the ranges [start, stop, step] of ids and reports every serialized socket as soon as it is
+        confirmed, returns the serialized sockets. The scan uses its own sockets on interface.
+    '''
+    return scan.scan(interface, [range(*r) for r in ids], on_found=progress, **options)
+
+
+def job_passive_discover(daemon, progress, interface, **options):
+    '''Runs passive.discover() and reports every serialized socket, returns the serialized sockets.'''
+    return passive.discover(interface, on_found=progress, **options)
+
+
+#the jobs a client can run, every job gets the daemon, a function progress(data) that reports json serializable data
+#to the client and the json arguments of the request
+JOBS = {
+    'ping': job_ping,
+    'release': job_release,
+    'shutdown': job_shutdown,
+    'uds_rtt': job_uds_rtt,
+    'uds_services': job_uds_services,
+    'uds_sessions': job_uds_sessions,
+    'uds_detect': job_uds_detect,
+    'did_scan': job_did_scan,
+    'isotp_scan': job_isotp_scan,
+    'passive_discover': job_passive_discover
+}
+
+
+def start(path, idle_timeout=IDLE_TIMEOUT):
+    '''
+        Starts the daemon on path unless it is already running and returns the result of a ping.
+        Must be called after init() and before any thread is started. Scapy is only loaded to start a new daemon,
+        which is forked from this process and keeps the loaded layers.
+
+        throws DaemonError if the daemon does not start.
+    '''
+    try:
+        return request(path, 'ping')
+    except DaemonError:
+        pass
+
+    c.load_scapy(isotp=True, uds=True)
+
+    #the socket of a killed daemon is left over
+    if os.path.exists(path):
+        os.unlink(path)
+
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    pid = os.fork()
+    if pid == 0:
+        #detach twice from the module process, so the daemon is neither its child nor in its session
+        try:
+            os.setsid()
+            if os.fork() != 0:
+                os._exit(0)
+
+            #Ansible waits until stdout of the module is closed
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            os.chdir('/')
+            os.umask(0o077)
+
+            Daemon(path, idle_timeout).serve()
+        except BaseException:
+            c.warn("daemon failed: {}", traceback.format_exc())
+        finally:
+            os._exit(0)
+
+    os.waitpid(pid, 0)
+
+    deadline = time.time() + START_TIMEOUT
+    while True:
+        try:
+            info = request(path, 'ping')
+            c.debug("started daemon {} on '{}'", info['pid'], path)
+            return info
+        except DaemonError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
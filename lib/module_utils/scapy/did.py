@@ -0,0 +1,238 @@
+import time
+import collections
+
+import ansible.module_utils.scapy.core as c
+import ansible.module_utils.scapy.metrics as metrics
+
+#service id of ReadDataByIdentifier and of its positive response
+RDBI = 0x22
+RDBI_RESPONSE = 0x62
+
+#negative response codes that change how a batch of data identifiers is requested
+INCORRECT_MESSAGE_LENGTH = 0x13
+RESPONSE_TOO_LONG = 0x14
+REQUEST_OUT_OF_RANGE = 0x31
+RESPONSE_PENDING = 0x78
+
+#P2*server max in seconds, the time an ECU may take for the final response after a responsePending
+PENDING_TIMEOUT = 5
+
+#a positive response is only checked for the first two ways to parse it, more are not needed to tell it is ambiguous
+MAX_PARSES = 2
+
+
+def parse_response(payload, dids, lengths=None):
+    '''
+        Splits the payload of a multi DID response (without the service id 0x62) into (did, data) tuples.
+
+        The response contains the supported DIDs in the order of the request, each followed by its data.
+        The length of the data is not part of the response, so the data of a DID ends where the next requested DID starts.
+        Unless the length of every DID but the last is known, the data can be split in several ways, at least the
+        first DID can always own all remaining bytes.
+
+        lengths: dict of DID -> known length of its data, e.g. from an earlier response
+        Returns a list with up to MAX_PARSES possible results, more than one result means the response is ambiguous.
+    '''
+    results = []
+    lengths = lengths or {}
+    index = {did: i for i, did in enumerate(dids)}
+    #positions of DIDs that can not be parsed up to the end of the payload, e.g. of a truncated response
+    #without them every split of the bytes before such a DID would parse the rest of the payload again
+    dead = set()
+
+    def did_at(pos):
+        return (payload[pos] << 8) | payload[pos + 1] if pos + 1 < len(payload) else None
+
+    def parse(pos, after, parsed):
+        #the DID at pos must be a requested one that comes after the previous DID
+        did = did_at(pos)
+        if index.get(did, -1) <= after or pos in dead:
+            return
+
+        found = len(results)
+
+        #every DID has at least one byte of data
+        if did in lengths:
+            ends = [pos + 2 + lengths[did]] if pos + 2 + lengths[did] <= len(payload) else []
+        else:
+            ends = range(pos + 3, len(payload) + 1)
+
+        for end in ends:
+            if len(results) >= MAX_PARSES:
+                return
+
+            entry = parsed + [(did, payload[pos + 2:end])]
+            if end == len(payload):
+                results.append(entry)
+            elif index.get(did_at(end), -1) > index[did]:
+                parse(end, index[did], entry)
+
+        if len(results) == found:
+            dead.add(pos)
+
+    parse(0, -1, [])
+
+    return results
+
+
+class DidScanner(object):
+    '''
+        Reads data identifiers with ReadDataByIdentifier (0x22) requests that contain up to batch_size DIDs each.
+
+        The length of the data of a DID is learned from the first response that contains it. A response with several
+        DIDs is ambiguous until the lengths of all but its last DID are known, so its leading DID with an unknown length
+        is read on its own and the response is parsed again, until one parse is left.
+
+        The batch size adapts to the ECU: it is doubled after every complete response up to max_batch_size
+        and a batch is split in halves if the ECU can not answer it or the response can not be parsed:
+            - responseTooLong (0x14): the data of the DIDs does not fit into one response,
+            - a response that stays ambiguous or does not match the known lengths,
+            - requestOutOfRange (0x31): none of the DIDs is supported, the batch is only split if split_out_of_range
+              is set, for ECUs that answer it if any DID is not supported,
+            - any other negative response, to find the DIDs it belongs to.
+        incorrectMessageLengthOrInvalidFormat (0x13) or no response to a batch means the ECU does not accept
+        several DIDs in one request, all further DIDs are requested one at a time.
+    '''
+
+    def __init__(self, sock, batch_size=8, max_batch_size=32, timeout=0.5, split_out_of_range=False):
+        self.sock = sock
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.split_out_of_range = split_out_of_range
+
+        self.requests = 0
+        self.found = []
+        self.negative = []
+        #DID -> length of its data
+        self.lengths = {}
+
+    def request(self, dids):
+        '''
+            Requests dids and waits for the final response, a responsePending extends the timeout.
+            Returns the response or None.
+        '''
+        self.requests += 1
+        self.sock.send(UDS()/UDS_RDBI(identifiers=dids))
+        metrics.count('uds.sent')
+
+        sent = time.time()
+        deadline = sent + self.timeout
+        while c.wait_readable(self.sock, deadline - time.time()):
+            resp = self.sock.recv()
+            if resp is None:
+                continue
+            metrics.count('uds.received')
+
+            if resp.service == 0x7f and resp.requestServiceId == RDBI:
+                if resp.negativeResponseCode != RESPONSE_PENDING:
+                    metrics.observe('uds.rdbi', time.time() - sent)
+                    return resp
+                deadline = time.time() + PENDING_TIMEOUT
+            elif resp.service == RDBI_RESPONSE:
+                metrics.observe('uds.rdbi', time.time() - sent)
+                return resp
+
+        metrics.count('uds.timeouts')
+        return None
+
+    def single(self):
+        '''Request all further DIDs one at a time.'''
+        if self.max_batch_size > 1:
+            c.debug("ECU does not accept several DIDs in one request, requesting single DIDs")
+        self.batch_size = self.max_batch_size = 1
+
+    def scan(self, dids):
+        '''
+            Requests all dids, e.g. range(0x10000).
+            Returns a dict with the found DIDs and their data, the DIDs with negative responses and the amount of requests.
+        '''
+        queue = collections.deque([did] for did in dids)
+        started = time.time()
+
+        while queue:
+            #take up to batch_size DIDs from the front, split batches stay in front
+            batch = queue.popleft()
+            while queue and len(batch) + len(queue[0]) <= self.batch_size:
+                batch += queue.popleft()
+
+            for half in reversed(self.__request_batch(batch)):
+                queue.appendleft(half)
+
+        c.debug("{} DIDs found with {} requests in {:.1f}s",
+                len(self.found), self.requests, time.time() - started)
+
+        return {
+            'dids': [{'did': did, 'data': data.hex()} for did, data in self.found],
+            'negative': [{'did': did, 'nrc': nrc} for did, nrc in self.negative],
+            'requests': self.requests
+        }
+
+    def __learn_length(self, did):
+        '''Reads did on its own to learn the length of its data, returns whether it is known now.'''
+        resp = self.request([did])
+        if resp is None or resp.service == 0x7f:
+            return False
+
+        parses = parse_response(bytes(resp)[1:], [did])
+        if len(parses) != 1:
+            return False
+
+        self.lengths[did] = len(parses[0][0][1])
+        return True
+
+    def __split(self, batch):
+        self.batch_size = max(1, min(self.batch_size, len(batch) // 2))
+        middle = len(batch) // 2
+        return [batch[:middle], batch[middle:]]
+
+    def __request_batch(self, batch):
+        '''Requests a batch and records the result, returns the batches that have to be requested again.'''
+        resp = self.request(batch)
+
+        if resp is None:
+            if len(batch) > 1:
+                self.single()
+                return [[did] for did in batch]
+            return []
+
+        if resp.service == 0x7f:
+            nrc = resp.negativeResponseCode
+
+            if len(batch) > 1 and nrc == INCORRECT_MESSAGE_LENGTH:
+                self.single()
+                return [[did] for did in batch]
+
+            if nrc == REQUEST_OUT_OF_RANGE and (len(batch) == 1 or not self.split_out_of_range):
+                return []
+
+            if len(batch) > 1:
+                return self.__split(batch)
+
+            self.negative.append((batch[0], nrc))
+            return []
+
+        payload = bytes(resp)[1:]
+        parses = parse_response(payload, batch, self.lengths)
+
+        #all parses agree up to the first DID with an unknown length, once its length is known the next DID is fixed
+        while len(parses) > 1:
+            did = next(did for did, _ in parses[0] if did not in self.lengths)
+            if not self.__learn_length(did):
+                break
+            parses = parse_response(payload, batch, self.lengths)
+
+        if len(parses) != 1:
+            if len(batch) > 1:
+                c.debug("{} response to DIDs {:#06x}-{:#06x}, splitting",
+                        "ambiguous" if parses else "invalid", batch[0], batch[-1])
+                return self.__split(batch)
+
+            c.warn("invalid response to DID {:#06x}: {}", batch[0], bytes(resp).hex())
+            return []
+
+        self.found.extend(parses[0])
+        for did, data in parses[0]:
+            self.lengths[did] = len(data)
+        self.batch_size = min(self.batch_size * 2, self.max_batch_size)
+        return []
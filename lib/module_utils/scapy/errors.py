@@ -4,4 +4,19 @@ class SerializationError(RuntimeError):
 
 '''Raised when a deserialization operation fails.'''
 class DeserializationError(RuntimeError):
+    pass
+
+'''Raised when an ISOTP message can not be transmitted.'''
+class TransmissionError(RuntimeError):
+    pass
+
+'''Raised when an ECU answers a request with a negative response, nrc is the negative response code.'''
+class NegativeResponseError(RuntimeError):
+    def __init__(self, service, nrc):
+        super(NegativeResponseError, self).__init__("service {:#04x}: negative response {:#04x}".format(service, nrc))
+        self.service = service
+        self.nrc = nrc
+
+'''Raised when the scan daemon can not be started or a job in the daemon fails.'''
+class DaemonError(RuntimeError):
     pass
\ No newline at end of file
@@ -0,0 +1,63 @@
+import bisect
+
+
+class IdSet(object):
+    '''
+        Set of CAN identifiers stored as sorted, disjoint, closed intervals.
+
+        The memory usage depends on the amount of intervals and not on the amount of ids,
+        so ranges of the 29 bit identifier space (2^29 ids) can be tracked.
+        Ids that are added in ascending order are merged into a single interval.
+    '''
+
+    def __init__(self, intervals=()):
+        self.__starts = []
+        self.__ends = []
+
+        for start, end in intervals:
+            self.add_range(start, end)
+
+    @classmethod
+    def from_ids(cls, ids):
+        result = cls()
+        for i in ids:
+            result.add(i)
+        return result
+
+    def add(self, i):
+        self.add_range(i, i)
+
+    def add_range(self, start, end):
+        '''Add all ids from start to end (inclusive).'''
+        #intervals that overlap or touch [start, end] are merged
+        lo = bisect.bisect_left(self.__ends, start - 1)
+        hi = bisect.bisect_right(self.__starts, end + 1)
+
+        if lo < hi:
+            start = min(start, self.__starts[lo])
+            end = max(end, self.__ends[hi - 1])
+
+        self.__starts[lo:hi] = [start]
+        self.__ends[lo:hi] = [end]
+
+    def __contains__(self, i):
+        k = bisect.bisect_right(self.__starts, i) - 1
+        return k >= 0 and i <= self.__ends[k]
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in zip(self.__starts, self.__ends))
+
+    def __bool__(self):
+        return bool(self.__starts)
+
+    def __iter__(self):
+        for start, end in zip(self.__starts, self.__ends):
+            for i in range(start, end + 1):
+                yield i
+
+    def __repr__(self):
+        return "IdSet({})".format(", ".join("{:#x}-{:#x}".format(s, e) for s, e in self.intervals()))
+
+    def intervals(self):
+        '''Returns the ids as a json serializable list of closed intervals [[start, end], ...].'''
+        return [[start, end] for start, end in zip(self.__starts, self.__ends)]
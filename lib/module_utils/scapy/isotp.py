@@ -1,5 +1,6 @@
 import ansible.module_utils.scapy.core as c
 from ansible.module_utils.scapy.errors import SerializationError, DeserializationError
+from ansible.module_utils.scapy.isotpmux import ISOTPMuxSocket, MAX_STANDARD_ID
 __is_init = False
 
 # ISOTPSoftSocket
@@ -177,6 +178,40 @@ def __get_nested_value(socket, args):
  
 
 
+def make_sock(iface, sid, did, extended_addr=None, extended_rx_addr=None, padding=True, basecls='ISOTP',
+              extended_can_id=False):
+    '''
+        Serialize an ISOTPSocket directly from its parameters without creating the scapy object.
+        The result has the same layout as the dicts returned by dump_socks().
+        extended_can_id adds the key 'extended_can_id' for sockets with 29 bit CAN identifiers.
+    '''
+
+    __init()
+
+    if basecls not in __BASECLS_OPTIONS:
+        raise SerializationError("unknown basecls: {}".format(basecls))
+
+    options = {
+        'sid': sid,
+        'did': did,
+        'extended_addr': extended_addr,
+        'extended_rx_addr': extended_rx_addr,
+        'padding': padding,
+        'listen_only': False,
+        'basecls': basecls
+    }
+
+    if c.ISOTPSOCKET_IS_NATIVE:
+        options['iface'] = iface
+    else:
+        options['can_socket'] = iface
+
+    if extended_can_id:
+        options['extended_can_id'] = True
+
+    return options
+
+
 def dump_socks(socks, throw=False):
     '''
         Serialize list of ISOTPSocket objects into a list of dicts.
@@ -189,16 +224,17 @@ def dump_socks(socks, throw=False):
 
     result = []
     c.debug("dump_socks")
-    c.debug("socks:{}".format(socks))
+    c.debug("socks:{}", socks)
     
 
     for sock in socks:
         
         #check for right types
-        assert(isinstance(sock, (ISOTPNativeSocket, ISOTPSoftSocket)))
+        #ISOTPMuxSocket has the same layout as ISOTPSoftSocket
+        assert(isinstance(sock, (ISOTPNativeSocket, ISOTPSoftSocket, ISOTPMuxSocket)))
         if isinstance(sock, ISOTPNativeSocket):
             assert(c.ISOTPSOCKET_IS_NATIVE)
-        elif isinstance(sock, ISOTPSoftSocket):
+        elif isinstance(sock, (ISOTPSoftSocket, ISOTPMuxSocket)):
             assert(not c.ISOTPSOCKET_IS_NATIVE)
 
         #options dict
@@ -214,7 +250,7 @@ def dump_socks(socks, throw=False):
                 raise SerializationError(error_str)
             else:
                 c.warn(error_str)
-                c.debug("object vars: {}".format(vars(sock)))
+                c.debug("object vars: {}", vars(sock))
                 continue
 
         # TODO get somehow:
@@ -230,18 +266,22 @@ def dump_socks(socks, throw=False):
                 raise SerializationError(error_str)
             else:
                 c.warn(error_str)
-                c.debug("object vars: {}".format(vars(sock)))
+                c.debug("object vars: {}", vars(sock))
                 continue
         
         options['basecls'] = basecls
+
+        #only ISOTPMuxSocket stores the flag, the other sockets use 29 bit identifiers above MAX_STANDARD_ID
+        if getattr(sock, 'extended_can_id', False):
+            options['extended_can_id'] = True
         
         result.append(options)
 
-    c.debug("serialized ISOTPSockets:{}".format(result))
+    c.debug("serialized ISOTPSockets:{}", result)
 
     return result
 
-def load_socks(socks, throw=False):
+def load_socks(socks, throw=False, multiplexed=False):
     '''
         Deserialize list of dicts into list of ISOTPSocket objects.
         Each key:value pair of the dict is directly passed to the constructor of the ISOTPSocket object.
@@ -249,26 +289,31 @@ def load_socks(socks, throw=False):
 
         socks: List of dicts (ISOTPSocket objects that were serialized earlier) to be deserialized into scapy objects.
         throw: If this is set to True this function will throw a DeserializationError on a failed deserialization.
+        multiplexed: Without the can_isotp kernel module, create ISOTPMuxSockets that share one CANSocket and one
+                     receiver thread per interface instead of an ISOTPSoftSocket with its own CANSocket and threads per socket.
+
+        The optional key 'extended_can_id' selects 29 bit CAN identifiers. Only ISOTPMuxSockets can use them for
+        identifiers up to MAX_STANDARD_ID, for the other sockets it must match their identifiers.
     '''
 
     __init()
 
     result = []
 
-    c.debug("socks:{}".format(socks))
+    c.debug("socks:{}", socks)
 
     for sock in socks:
 
         #check format of sock
         #if key is not found in the default layout raise an error
         for key in sock:
-            if key not in ISOTPSOCKET_OPTIONS_MAP:
+            if key not in ISOTPSOCKET_OPTIONS_MAP and key != 'extended_can_id':
                 error_str = "Wrong key '{}' in socket '{}'".format(key, sock)
                 if(throw):
                     raise DeserializationError(error_str)
                 else:
                     c.warn(error_str)
-                    c.debug("object vars: {}".format(vars(sock)))
+                    c.debug("object vars: {}", vars(sock))
                     continue
 
         basecls_string = sock.pop('basecls')
@@ -280,7 +325,19 @@ def load_socks(socks, throw=False):
                 raise DeserializationError(error_str)
             else:
                 c.warn(error_str)
-                c.debug("object vars: {}".format(vars(sock)))
+                c.debug("object vars: {}", vars(sock))
+                continue
+
+        extended_can_id = sock.pop('extended_can_id', None)
+        if multiplexed and not c.ISOTPSOCKET_IS_NATIVE:
+            sock['extended_can_id'] = extended_can_id
+        elif extended_can_id is not None and \
+                bool(extended_can_id) != (sock.get('sid', 0) > MAX_STANDARD_ID or sock.get('did', 0) > MAX_STANDARD_ID):
+            error_str = "extended_can_id={} in socket '{}' needs the multiplexed transport".format(extended_can_id, sock)
+            if(throw):
+                raise DeserializationError(error_str)
+            else:
+                c.warn(error_str)
                 continue
 
         if basecls_string == 'UDS':
@@ -294,6 +351,11 @@ def load_socks(socks, throw=False):
                         **sock,
                         basecls=basecls
                 )
+            elif multiplexed:
+                s = ISOTPMuxSocket(
+                        **sock,
+                        basecls=basecls
+                )
             else:
                 s = ISOTPSoftSocket(
                         **sock,
@@ -305,9 +367,19 @@ def load_socks(socks, throw=False):
                 raise DeserializationError(error_str)
             else:
                 c.warn(error_str)
-                c.debug("object vars: {}".format(vars(sock)))
+                c.debug("object vars: {}", vars(sock))
                 continue
 
         result.append(s)
     
-    return result
\ No newline at end of file
+    return result
+
+
+def close_socks(socks):
+    '''
+        Close the sockets of load_socks(), None entries are skipped.
+        The multiplexer of an interface stops its receiver thread and closes its CANSocket with the last socket.
+    '''
+    for sock in socks:
+        if sock is not None:
+            sock.close()
@@ -0,0 +1,431 @@
+import time
+import queue
+import threading
+
+from scapy.supersocket import SuperSocket
+
+import ansible.module_utils.scapy.core as c
+from ansible.module_utils.scapy.errors import TransmissionError
+
+#ISOTP protocol control information
+PCI_SINGLE_FRAME = 0x0
+PCI_FIRST_FRAME = 0x1
+PCI_CONSECUTIVE_FRAME = 0x2
+PCI_FLOW_CONTROL = 0x3
+
+#flow status of a flow control frame
+FLOW_STATUS_CTS = 0x0
+FLOW_STATUS_WAIT = 0x1
+
+CAN_MAX_DLEN = 8
+MAX_STANDARD_ID = 0x7ff
+#the length of a first frame has 12 bits
+MAX_MESSAGE_LENGTH = 0xfff
+
+#the can-isotp kernel module pads with the same byte
+PADDING_BYTE = 0xcc
+
+#timeouts in seconds, the same values as the ones of scapy's ISOTPSoftSocket
+FC_TIMEOUT = 1
+CF_TIMEOUT = 1
+#maximum amount of flow control frames with the status WAIT in a row
+MAX_FC_WAIT = 10
+
+#the receiver thread checks this often whether the multiplexer was closed
+RECEIVE_POLL = 0.1
+
+
+def stmin_to_seconds(stmin):
+    '''Decode the separation time of a flow control frame.'''
+    if stmin <= 0x7f:
+        return stmin / 1000.0
+    if 0xf1 <= stmin <= 0xf9:
+        return (stmin - 0xf0) / 10000.0
+
+    #reserved values are treated as the maximum
+    return 0.127
+
+
+class Endpoint(object):
+    '''
+        ISOTP state machine of a single (sid, did) pair.
+
+        The receive state is only touched by the receiver thread of the multiplexer.
+        send() runs in the thread of the caller and is woken up by the receiver thread when a flow control frame arrives.
+        There are no timer threads, the consecutive frame timeout is checked when the next frame arrives
+        and the flow control timeout is the timeout of a condition wait in send().
+    '''
+
+    def __init__(self, mux, sid, did, extended_can_id=False, extended_addr=None, extended_rx_addr=None,
+                 rx_block_size=0, rx_separation_time_min=0, padding=False, listen_only=False):
+        self.mux = mux
+        #the nested attributes can_socket.iface are used by isotp.dump_socks()
+        self.can_socket = mux.can_socket
+        self.sid = sid
+        self.did = did
+        self.extended_can_id = extended_can_id
+        self.extended_addr = extended_addr
+        self.extended_rx_addr = extended_rx_addr
+        self.rx_block_size = rx_block_size
+        self.rx_separation_time_min = rx_separation_time_min
+        self.padding = padding
+        self.listen_only = listen_only
+
+        self.tx_prefix = bytes([extended_addr]) if extended_addr is not None else b''
+        #payload bytes of a single or consecutive frame
+        self.capacity = CAN_MAX_DLEN - len(self.tx_prefix) - 1
+
+        self.rx_queue = queue.Queue()
+        self.rx_callbacks = []
+        self.rx_buf = None
+        self.rx_len = 0
+        self.rx_sn = 0
+        self.rx_bs = 0
+        self.rx_deadline = 0
+
+        #only one message is sent at a time
+        self.tx_lock = threading.Lock()
+        self.fc_cond = threading.Condition()
+        self.tx_waiting = False
+        self.tx_fc = None
+
+    def on_frame(self, data, now):
+        '''Handle the data of a CAN frame that was sent to did. Called by the receiver thread.'''
+        if self.extended_rx_addr is not None:
+            if not data or data[0] != self.extended_rx_addr:
+                return
+            data = data[1:]
+
+        if not data:
+            return
+
+        pci = data[0] >> 4
+
+        if pci == PCI_FLOW_CONTROL:
+            if len(data) < 3:
+                return
+            with self.fc_cond:
+                if self.tx_waiting:
+                    self.tx_fc = (data[0] & 0x0f, data[1], data[2])
+                    self.fc_cond.notify()
+            return
+
+        if self.rx_buf is not None and now > self.rx_deadline:
+            c.debug("consecutive frame timeout on {:#x}, dropping {} of {} bytes",
+                    self.did, len(self.rx_buf), self.rx_len)
+            self.rx_buf = None
+
+        if pci == PCI_SINGLE_FRAME:
+            length = data[0] & 0x0f
+            #a new message aborts a reception in progress
+            self.rx_buf = None
+            if 0 < length < len(data):
+                self.__deliver(bytes(data[1:1 + length]), now)
+
+        elif pci == PCI_FIRST_FRAME:
+            if len(data) < 2:
+                return
+            self.rx_len = ((data[0] & 0x0f) << 8) | data[1]
+            self.rx_buf = bytearray(data[2:])
+            self.rx_sn = 1
+            self.rx_bs = 0
+            self.rx_deadline = now + CF_TIMEOUT
+            self.__send_flow_control()
+
+        elif pci == PCI_CONSECUTIVE_FRAME:
+            if self.rx_buf is None:
+                return
+            if data[0] & 0x0f != self.rx_sn:
+                c.debug("wrong sequence number on {:#x}, dropping message", self.did)
+                self.rx_buf = None
+                return
+
+            self.rx_buf.extend(data[1:])
+            self.rx_sn = (self.rx_sn + 1) & 0x0f
+            self.rx_deadline = now + CF_TIMEOUT
+
+            if len(self.rx_buf) >= self.rx_len:
+                self.__deliver(bytes(self.rx_buf[:self.rx_len]), now)
+                self.rx_buf = None
+                return
+
+            self.rx_bs += 1
+            if self.rx_block_size and self.rx_bs >= self.rx_block_size:
+                self.rx_bs = 0
+                self.__send_flow_control()
+
+    def __deliver(self, msg, now):
+        self.rx_queue.put((msg, now))
+        for callback in list(self.rx_callbacks):
+            callback()
+
+    def __send_flow_control(self):
+        if not self.listen_only:
+            self.__send_frame(bytes([PCI_FLOW_CONTROL << 4 | FLOW_STATUS_CTS, self.rx_block_size,
+                                     self.rx_separation_time_min]))
+
+    def __send_frame(self, payload):
+        payload = self.tx_prefix + payload
+        if self.padding:
+            payload += bytes([PADDING_BYTE]) * (CAN_MAX_DLEN - len(payload))
+        self.mux.send(self.sid, payload, self.extended_can_id)
+
+    def __wait_flow_control(self):
+        '''Returns (block_size, separation_time) of the next flow control frame.'''
+        waits = 0
+
+        with self.fc_cond:
+            while True:
+                deadline = time.time() + FC_TIMEOUT
+                while self.tx_fc is None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TransmissionError("no flow control frame on {:#x}".format(self.did))
+                    self.fc_cond.wait(remaining)
+
+                status, block_size, stmin = self.tx_fc
+                self.tx_fc = None
+
+                if status == FLOW_STATUS_CTS:
+                    return block_size, stmin_to_seconds(stmin)
+                if status != FLOW_STATUS_WAIT:
+                    raise TransmissionError("receiver {:#x} aborted with flow status {}".format(self.did, status))
+
+                waits += 1
+                if waits > MAX_FC_WAIT:
+                    raise TransmissionError("receiver {:#x} sent too many wait frames".format(self.did))
+
+    def send(self, data):
+        '''
+            Send a message and block until all frames are sent.
+            Returns the length of the message.
+
+            throws TransmissionError if the receiver does not send flow control frames in time.
+        '''
+        data = bytes(data)
+        length = len(data)
+
+        if length > MAX_MESSAGE_LENGTH:
+            raise TransmissionError("message of {} bytes is too long".format(length))
+
+        with self.tx_lock:
+            if length <= self.capacity:
+                self.__send_frame(bytes([length]) + data)
+                return length
+
+            with self.fc_cond:
+                self.tx_fc = None
+                self.tx_waiting = True
+
+            try:
+                self.__send_frame(bytes([PCI_FIRST_FRAME << 4 | length >> 8, length & 0xff]) + data[:self.capacity - 1])
+                index = self.capacity - 1
+                sn = 1
+
+                while index < length:
+                    block_size, stmin = self.__wait_flow_control()
+                    block = 0
+                    while index < length and (block_size == 0 or block < block_size):
+                        if block:
+                            time.sleep(stmin)
+                        self.__send_frame(bytes([PCI_CONSECUTIVE_FRAME << 4 | sn]) + data[index:index + self.capacity])
+                        index += self.capacity
+                        sn = (sn + 1) & 0x0f
+                        block += 1
+            finally:
+                with self.fc_cond:
+                    self.tx_waiting = False
+
+        return length
+
+    def recv(self):
+        '''Returns the next received message as tuple (data, timestamp) or (None, None) if there is none.'''
+        try:
+            return self.rx_queue.get_nowait()
+        except queue.Empty:
+            return None, None
+
+    def close(self):
+        self.mux.unregister(self)
+
+
+class IsotpMux(object):
+    '''
+        Shares a single CANSocket and a single receiver thread between all ISOTP endpoints of an interface.
+        Received frames are dispatched by their CAN identifier and its format (11 or 29 bit) to the endpoints.
+    '''
+
+    def __init__(self, iface):
+        self.iface = iface
+        self.can_socket = CANSocket(iface)
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        #(did, extended_can_id) -> list of endpoints, the lists are replaced and never modified, so the receiver can read them without lock
+        self.endpoints = {}
+        self.count = 0
+        self.running = True
+
+        self.thread = threading.Thread(target=self.__receive, name="ISOTPMux-{}".format(iface))
+        self.thread.daemon = True
+        self.thread.start()
+
+        c.debug("started ISOTP multiplexer on '{}'", iface)
+
+    def register(self, endpoint):
+        with self.lock:
+            key = (endpoint.did, endpoint.extended_can_id)
+            self.endpoints[key] = self.endpoints.get(key, []) + [endpoint]
+            self.count += 1
+
+    def unregister(self, endpoint):
+        with self.lock:
+            key = (endpoint.did, endpoint.extended_can_id)
+            remaining = [e for e in self.endpoints.get(key, []) if e is not endpoint]
+            if remaining:
+                self.endpoints[key] = remaining
+            else:
+                self.endpoints.pop(key, None)
+            self.count -= 1
+
+        release(self)
+
+    def send(self, identifier, payload, extended_can_id=False):
+        pkt = CAN(identifier=identifier, data=payload)
+        if extended_can_id:
+            pkt.flags = 'extended'
+
+        with self.send_lock:
+            self.can_socket.send(pkt)
+
+    def __receive(self):
+        while self.running:
+            try:
+                if not c.wait_readable(self.can_socket, RECEIVE_POLL):
+                    continue
+                pkt = self.can_socket.recv()
+            except Exception as e:
+                if self.running:
+                    c.warn("ISOTP multiplexer on '{}' stopped: {!r}", self.iface, e)
+                return
+
+            if pkt is None:
+                continue
+
+            endpoints = self.endpoints.get((pkt.identifier, bool(pkt.flags.extended)))
+            if not endpoints:
+                continue
+
+            data = bytes(pkt.data)
+            now = time.time()
+            for endpoint in endpoints:
+                endpoint.on_frame(data, now)
+
+    def close(self):
+        self.running = False
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.can_socket.close()
+
+        c.debug("stopped ISOTP multiplexer on '{}'", self.iface)
+
+
+#interface -> IsotpMux
+__muxes = {}
+__muxes_lock = threading.Lock()
+
+
+def open_endpoint(iface, sid, did, **kwargs):
+    '''Returns a new Endpoint on the multiplexer of iface, the multiplexer is started with the first endpoint.'''
+    with __muxes_lock:
+        mux = __muxes.get(iface)
+        if mux is None:
+            mux = __muxes[iface] = IsotpMux(iface)
+
+        endpoint = Endpoint(mux, sid, did, **kwargs)
+        mux.register(endpoint)
+
+    return endpoint
+
+
+def release(mux):
+    '''Stops the multiplexer after its last endpoint was closed.'''
+    with __muxes_lock:
+        if mux.count > 0 or __muxes.get(mux.iface) is not mux:
+            return
+        del __muxes[mux.iface]
+
+    mux.close()
+
+
+class ISOTPMuxSocket(SuperSocket):
+    '''
+        Drop-in replacement of scapy's ISOTPSoftSocket that uses a multiplexed transport.
+
+        ISOTPSoftSocket opens a CANSocket and starts a receiver thread and two timer threads per socket,
+        so every socket reads every frame of the bus. All ISOTPMuxSockets of an interface share one CANSocket and
+        one receiver thread instead, so the costs do not grow with the amount of sockets.
+
+        The constructor accepts the same arguments as ISOTPSoftSocket, can_socket must be the name of the interface.
+        extended_can_id selects 29 bit CAN identifiers for sid and did. If it is None, they are used for identifiers
+        above 0x7ff like in ISOTPSoftSocket.
+    '''
+    nonblocking_socket = True
+
+    def __init__(self, can_socket=None, sid=0, did=0, extended_addr=None, extended_rx_addr=None,
+                 rx_block_size=0, rx_separation_time_min=0, padding=False, listen_only=False, basecls=None,
+                 extended_can_id=None):
+
+        if not isinstance(can_socket, str):
+            raise TypeError("can_socket must be the name of a CAN interface, got {}".format(repr(can_socket)))
+
+        #same attribute names as ISOTPSoftSocket, so dump_socks() can serialize both
+        self.src = sid
+        self.dst = did
+        self.exsrc = extended_addr
+        self.exdst = extended_rx_addr
+        self.basecls = basecls or ISOTP
+        if extended_can_id is None:
+            extended_can_id = sid > MAX_STANDARD_ID or did > MAX_STANDARD_ID
+        self.extended_can_id = bool(extended_can_id)
+
+        self.impl = open_endpoint(can_socket, sid, did, extended_can_id=self.extended_can_id,
+                                  extended_addr=extended_addr, extended_rx_addr=extended_rx_addr,
+                                  rx_block_size=rx_block_size,
+                                  rx_separation_time_min=rx_separation_time_min, padding=padding,
+                                  listen_only=listen_only)
+        self.ins = self.impl
+        self.outs = self.impl
+
+    def recv_raw(self, x=0xffff):
+        msg, ts = self.ins.recv()
+        return self.basecls, msg, ts
+
+    def close(self):
+        if not self.closed:
+            self.impl.close()
+            self.ins = None
+            self.outs = None
+            SuperSocket.close(self)
+
+    @staticmethod
+    def select(sockets, remain=None):
+        '''Returns the sockets with received messages, waits at most remain seconds (forever if None).'''
+        def ready_sockets():
+            return [s for s in sockets if not s.impl.rx_queue.empty()]
+
+        ready = ready_sockets()
+        if ready or (remain is not None and remain <= 0):
+            return ready, None
+
+        received = threading.Event()
+        for s in sockets:
+            s.impl.rx_callbacks.append(received.set)
+        try:
+            #a message that arrived before the callbacks were added is found by the check below
+            if not ready_sockets():
+                received.wait(remain)
+        finally:
+            for s in sockets:
+                s.impl.rx_callbacks.remove(received.set)
+
+        return ready_sockets(), None
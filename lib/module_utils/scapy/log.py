@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import atexit
+import collections
+
+#levels of the records, the same values as in the logging module
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+#disables a target
+OFF = 100
+
+LEVEL_NAMES = {
+    DEBUG: 'DEBUG',
+    INFO: 'INFO',
+    WARNING: 'WARNING',
+    ERROR: 'ERROR'
+}
+
+#amount of records that are kept for the log file
+RING_SIZE = 2000
+
+ANSIBLE_MODULE = None
+
+#records from this level on are written to the journal as soon as they are logged
+__journal_level = WARNING
+#records from this level on are kept in the ring buffer, which is written to __log_file at exit
+__buffer_level = OFF
+#the lower of both levels, records below are dropped before anything else is done
+__min_level = WARNING
+
+__log_file = None
+__ring = collections.deque(maxlen=RING_SIZE)
+
+
+def configure(ansible_module, level=WARNING, log_file=None, buffer_level=DEBUG, ring_size=RING_SIZE):
+    '''
+        Sets the targets of the records.
+
+        level: Records from this level on are written to the journal immediately.
+        log_file: If set, the last ring_size records from buffer_level on are appended to this file when the module exits,
+                  e.g. to see what happened before a failure without enabling debug output in the journal.
+    '''
+    global ANSIBLE_MODULE, __journal_level, __buffer_level, __min_level, __log_file, __ring
+
+    ANSIBLE_MODULE = ansible_module
+    __journal_level = level
+    __buffer_level = buffer_level if log_file else OFF
+    __min_level = min(__journal_level, __buffer_level)
+
+    if log_file and __log_file is None:
+        atexit.register(flush)
+    __log_file = log_file
+    if ring_size != __ring.maxlen:
+        __ring = collections.deque(__ring, maxlen=ring_size)
+
+
+def enabled(level):
+    '''Checks whether records of level are logged, e.g. to skip the computation of expensive arguments.'''
+    return level >= __min_level
+
+
+def format_record(record):
+    created, level, code, msg = record
+    return "{} '{}' in '{}': {}".format(LEVEL_NAMES.get(level, level), code.co_name,
+                                       os.path.basename(code.co_filename), msg)
+
+
+def __emit(level, code, msg, args):
+    '''
+        Formats the message once for both targets.
+        The ring buffer keeps the formatted message and no references to the arguments,
+        so they show their state at the time of the record and are not kept alive until the flush.
+    '''
+    if args:
+        try:
+            msg = msg.format(*args)
+        except Exception as e:
+            #a broken __str__ must not break the caller
+            msg = "{} (formatting failed: {})".format(msg, e)
+    record = (time.time(), level, code, msg)
+
+    if level >= __journal_level and ANSIBLE_MODULE is not None:
+        ANSIBLE_MODULE.log(format_record(record))
+
+    if level >= __buffer_level:
+        __ring.append(record)
+
+
+def log(level, msg, *args):
+    '''
+        Logs msg with the level, msg is formatted with msg.format(*args) only if the record is written to a target.
+        The caller is taken from the frame of the calling function, which is cheaper than inspecting the stack.
+    '''
+    if level < __min_level:
+        return
+    __emit(level, sys._getframe(1).f_code, msg, args)
+
+
+def debug(msg, *args):
+    if DEBUG < __min_level:
+        return
+    __emit(DEBUG, sys._getframe(1).f_code, msg, args)
+
+
+def info(msg, *args):
+    if INFO < __min_level:
+        return
+    __emit(INFO, sys._getframe(1).f_code, msg, args)
+
+
+def warn(msg, *args):
+    if WARNING < __min_level:
+        return
+    __emit(WARNING, sys._getframe(1).f_code, msg, args)
+
+
+def error(msg, *args):
+    if ERROR < __min_level:
+        return
+    __emit(ERROR, sys._getframe(1).f_code, msg, args)
+
+
+def flush():
+    '''Appends the records of the ring buffer to the log file and empties the buffer.'''
+    if not __log_file or not __ring:
+        return
+
+    records = []
+    while __ring:
+        records.append(__ring.popleft())
+
+    lines = [
+        "{} {}\n".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record[0])), format_record(record))
+        for record in records
+    ]
+
+    try:
+        with open(__log_file, 'a') as f:
+            f.writelines(lines)
+    except (IOError, OSError):
+        if ANSIBLE_MODULE is not None:
+            ANSIBLE_MODULE.log("WARNING: could not write log file '{}'".format(__log_file))
@@ -0,0 +1,231 @@
+import os
+import time
+
+import ansible.module_utils.scapy.core as c
+import ansible.module_utils.scapy.store as store
+import ansible.module_utils.scapy.metrics as metrics
+from ansible.module_utils.scapy.errors import TransmissionError, NegativeResponseError
+
+#service ids of the memory services, the positive response of a service is its id + 0x40
+READ_MEMORY_BY_ADDRESS = 0x23
+REQUEST_UPLOAD = 0x35
+TRANSFER_DATA = 0x36
+REQUEST_TRANSFER_EXIT = 0x37
+
+RESPONSE_PENDING = 0x78
+
+#P2*server max in seconds, the time an ECU may take for the final response after a responsePending
+PENDING_TIMEOUT = 5
+
+#an ISOTP message carries at most 4095 bytes, the positive response of ReadMemoryByAddress needs one for its service id
+MAX_RMBA_BLOCK = 4094
+
+#negative responses to ReadMemoryByAddress that may mean the block is too large while the block size is negotiated
+BLOCK_TOO_LARGE = (0x13, 0x14, 0x22, 0x31)
+
+#suffix of the file next to the dump that stores the parameters of an unfinished dump
+PROGRESS_SUFFIX = '.progress'
+
+
+def encode(value, length):
+    '''Encodes value as big endian number with length bytes, throws ValueError if it does not fit.'''
+    try:
+        return value.to_bytes(length, 'big')
+    except OverflowError:
+        raise ValueError("{:#x} does not fit into {} bytes".format(value, length))
+
+
+class MemoryReader(object):
+    '''
+        Reads a memory range of an ECU block by block and writes the blocks to a file as soon as they are received.
+        Subclasses implement dump() with a UDS service.
+
+        address_length, size_length: bytes of the memory address and size in the requests (addressAndLengthFormatIdentifier)
+    '''
+
+    def __init__(self, sock, address_length=4, size_length=4, timeout=1):
+        self.sock = sock
+        self.address_length = address_length
+        self.size_length = size_length
+        self.timeout = timeout
+
+        self.requests = 0
+        self.block_size = None
+
+    def address_and_size(self, address, size):
+        '''Returns the addressAndLengthFormatIdentifier followed by address and size.'''
+        return (bytes([(self.size_length << 4) | self.address_length]) +
+                encode(address, self.address_length) + encode(size, self.size_length))
+
+    def request(self, payload):
+        '''
+            Sends the raw request payload and returns the raw positive response.
+            A responsePending extends the timeout, responses to other services are dropped.
+
+            throws NegativeResponseError on a negative response and TransmissionError without a response.
+        '''
+        service = payload[0]
+        self.requests += 1
+        self.sock.send(UDS(payload))
+        metrics.count('uds.sent')
+
+        sent = time.time()
+        deadline = sent + self.timeout
+        while c.wait_readable(self.sock, deadline - time.time()):
+            resp = self.sock.recv()
+            if resp is None:
+                continue
+            metrics.count('uds.received')
+
+            raw = bytes(resp)
+            if len(raw) >= 3 and raw[0] == 0x7f and raw[1] == service:
+                if raw[2] != RESPONSE_PENDING:
+                    metrics.observe('uds.memory', time.time() - sent)
+                    raise NegativeResponseError(service, raw[2])
+                deadline = time.time() + PENDING_TIMEOUT
+            elif raw and raw[0] == service + 0x40:
+                metrics.observe('uds.memory', time.time() - sent)
+                return raw
+
+        metrics.count('uds.timeouts')
+        raise TransmissionError("no response to service {:#04x}".format(service))
+
+    def dump(self, f, address, end, progress=None):
+        '''
+            Reads the memory from address to end (exclusive) and writes it to the file object f.
+            progress(address) is called with the next address after every written block.
+        '''
+        raise TypeError("{} does not implement dump()".format(type(self).__name__))
+
+
+class RmbaReader(MemoryReader):
+    '''
+        Reads memory with ReadMemoryByAddress (0x23).
+
+        The ECU does not tell how many bytes it returns at once, so the block size is negotiated:
+        starting at block_size, the block is halved on negative responses until the ECU answers.
+        After the first answered block, the block size is fixed and negative responses are errors.
+    '''
+
+    def __init__(self, sock, block_size=None, **kwargs):
+        super(RmbaReader, self).__init__(sock, **kwargs)
+        self.max_block_size = min(block_size or MAX_RMBA_BLOCK, MAX_RMBA_BLOCK)
+
+    def dump(self, f, address, end, progress=None):
+        negotiating = self.block_size is None
+        block_size = self.block_size or self.max_block_size
+
+        while address < end:
+            length = min(block_size, end - address)
+
+            try:
+                resp = self.request(bytes([READ_MEMORY_BY_ADDRESS]) + self.address_and_size(address, length))
+            except NegativeResponseError as e:
+                if not negotiating or e.nrc not in BLOCK_TOO_LARGE or block_size == 1:
+                    raise
+                block_size //= 2
+                c.debug("block of {} bytes refused ({:#04x}), trying {}", length, e.nrc, block_size)
+                continue
+
+            data = resp[1:]
+            if len(data) != length:
+                raise TransmissionError("requested {} bytes at {:#x}, got {}".format(length, address, len(data)))
+
+            if negotiating:
+                negotiating = False
+                self.block_size = block_size
+                c.debug("ReadMemoryByAddress block size {}", block_size)
+
+            f.write(data)
+            f.flush()
+            address += length
+            if progress:
+                progress(address)
+
+
+class UploadReader(MemoryReader):
+    '''
+        Reads memory with RequestUpload (0x35), TransferData (0x36) and RequestTransferExit (0x37).
+        The ECU chooses the block size and returns it in maxNumberOfBlockLength.
+    '''
+
+    def __init__(self, sock, data_format=0x00, **kwargs):
+        super(UploadReader, self).__init__(sock, **kwargs)
+        self.data_format = data_format
+
+    def dump(self, f, address, end, progress=None):
+        resp = self.request(bytes([REQUEST_UPLOAD, self.data_format]) + self.address_and_size(address, end - address))
+
+        #lengthFormatIdentifier: the high nibble is the length of maxNumberOfBlockLength
+        length = resp[1] >> 4
+        if length == 0 or len(resp) < 2 + length:
+            raise TransmissionError("invalid response to RequestUpload: {}".format(resp.hex()))
+
+        #maxNumberOfBlockLength includes the service id and the block sequence counter of TransferData
+        self.block_size = int.from_bytes(resp[2:2 + length], 'big') - 2
+        c.debug("RequestUpload accepted, block size {}", self.block_size)
+
+        counter = 1
+        try:
+            while address < end:
+                resp = self.request(bytes([TRANSFER_DATA, counter]))
+                if len(resp) < 3 or resp[1] != counter:
+                    raise TransmissionError("invalid response to TransferData block {}: {}".format(counter, resp.hex()))
+
+                data = resp[2:2 + end - address]
+                f.write(data)
+                f.flush()
+                address += len(data)
+                if progress:
+                    progress(address)
+
+                #the block sequence counter wraps around to 0 after 0xff
+                counter = (counter + 1) & 0xff
+        finally:
+            #the upload has to be ended, even if it failed, so the ECU accepts the next one
+            try:
+                self.request(bytes([REQUEST_TRANSFER_EXIT]))
+            except (TransmissionError, NegativeResponseError) as e:
+                c.warn("RequestTransferExit failed: {}", e)
+
+
+def dump_memory(reader, path, address, size, resume=True):
+    '''
+        Dumps size bytes of memory at address with reader into the file path.
+
+        An unfinished dump stores its address and size in path + PROGRESS_SUFFIX.
+        With resume, a dump of the same range continues at the first address that is not in the file yet,
+        every other dump starts over. The progress file is removed when the dump is complete.
+
+        Returns a dict with the address the dump was resumed at, the bytes read in this call and the duration.
+    '''
+    progress_path = path + PROGRESS_SUFFIX
+    params = {'address': address, 'size': size}
+    offset = 0
+
+    if resume and os.path.exists(path) and store.load_json(progress_path) == params:
+        #the blocks are written in order, so the file ends at the last complete block
+        offset = min(os.path.getsize(path), size)
+        c.debug("resuming dump at {:#x}", address + offset)
+    else:
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        open(path, 'wb').close()
+        store.save_json(progress_path, params)
+
+    started = time.time()
+
+    with open(path, 'r+b') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        if offset < size:
+            reader.dump(f, address + offset, address + size)
+
+    os.unlink(progress_path)
+
+    return {
+        'resumed_at': address + offset if offset else None,
+        'bytes_read': size - offset,
+        'duration': time.time() - started
+    }
@@ -0,0 +1,179 @@
+import time
+import bisect
+import threading
+import contextlib
+import collections
+
+try:
+    import resource
+except ImportError:
+    #Windows, the peak RSS is not reported
+    resource = None
+
+#upper bounds in milliseconds of the buckets of the latency histograms, the last bucket is unbounded
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+#collecting is disabled until enable() is called, so the instrumented functions cost a single check
+ENABLED = False
+
+__lock = threading.Lock()
+__started = None
+#name -> [seconds, calls], in the order the phases were entered first
+__phases = collections.OrderedDict()
+__counters = collections.Counter()
+#name -> Histogram
+__histograms = {}
+__peak_threads = 0
+
+
+class Histogram(object):
+    '''Latencies in buckets of BUCKETS_MS, with count, sum, min and max.'''
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def merge(self, data):
+        '''Adds the histogram data of to_dict(), e.g. from a worker process.'''
+        for i, n in enumerate(data['buckets'].values()):
+            self.buckets[i] += n
+        self.count += data['count']
+        self.total += data['sum']
+        for attr, pick in (('min', min), ('max', max)):
+            if data[attr] is not None:
+                value = getattr(self, attr)
+                setattr(self, attr, data[attr] if value is None else pick(value, data[attr]))
+
+    def to_dict(self):
+        labels = ['le_{}ms'.format(bound) for bound in BUCKETS_MS] + ['gt_{}ms'.format(BUCKETS_MS[-1])]
+
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'buckets': collections.OrderedDict(zip(labels, self.buckets))
+        }
+
+
+def enable():
+    '''Starts collecting, previously collected metrics are dropped.'''
+    global ENABLED, __started, __peak_threads
+
+    with __lock:
+        __phases.clear()
+        __counters.clear()
+        __histograms.clear()
+        __started = time.time()
+        __peak_threads = threading.active_count()
+        ENABLED = True
+
+
+def __sample_threads():
+    global __peak_threads
+    __peak_threads = max(__peak_threads, threading.active_count())
+
+
+def add(name, seconds):
+    '''
+        Adds seconds to the phase name, for phases that do not fit into a with block of phase().
+        Phases of concurrent workers with the same name are summed up, so they can take longer than the module.
+    '''
+    if not ENABLED:
+        return
+
+    with __lock:
+        entry = __phases.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+        __sample_threads()
+
+
+@contextlib.contextmanager
+def phase(name):
+    '''Adds the time spent in the with block to the phase name, see add().'''
+    if not ENABLED:
+        yield
+        return
+
+    started = time.time()
+    try:
+        yield
+    finally:
+        add(name, time.time() - started)
+
+
+def count(name, n=1):
+    '''Adds n to the counter name, e.g. can.sent for sent CAN frames.'''
+    if not ENABLED:
+        return
+
+    with __lock:
+        __counters[name] += n
+
+
+def observe(name, seconds):
+    '''Adds a latency in seconds to the histogram name.'''
+    if not ENABLED:
+        return
+
+    with __lock:
+        if name not in __histograms:
+            __histograms[name] = Histogram()
+        __histograms[name].add(seconds)
+        __sample_threads()
+
+
+def merge(data):
+    '''Adds the report() of a worker process to the metrics of this process.'''
+    global __peak_threads
+
+    if not ENABLED or not data:
+        return
+
+    with __lock:
+        for name, entry in data['phases'].items():
+            own = __phases.setdefault(name, [0.0, 0])
+            own[0] += entry['seconds']
+            own[1] += entry['calls']
+        __counters.update(data['counters'])
+        for name, histogram in data['histograms'].items():
+            __histograms.setdefault(name, Histogram()).merge(histogram)
+        __peak_threads = max(__peak_threads, data['peak_threads'])
+
+
+def report():
+    '''
+        Returns the collected metrics as json serializable dict, None if collecting is disabled.
+        The peak RSS is reported by the kernel in KiB for this process and separately for its terminated children,
+        e.g. the worker processes of parallel.run_processes().
+    '''
+    if not ENABLED:
+        return None
+
+    with __lock:
+        __sample_threads()
+
+        return {
+            'duration': time.time() - __started,
+            'phases': collections.OrderedDict(
+                (name, {'seconds': seconds, 'calls': calls}) for name, (seconds, calls) in __phases.items()
+            ),
+            'counters': dict(__counters),
+            'histograms': {name: histogram.to_dict() for name, histogram in __histograms.items()},
+            'threads': threading.active_count(),
+            'peak_threads': __peak_threads,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+            'children_peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss if resource else None
+        }
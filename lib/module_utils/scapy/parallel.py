@@ -0,0 +1,115 @@
+import traceback
+import collections
+import multiprocessing
+import multiprocessing.connection
+from concurrent.futures import ThreadPoolExecutor
+
+import ansible.module_utils.scapy.core as c
+
+
+def __process_worker(func, job, conn):
+    '''
+        Entry point of a forked worker process.
+        Sends ('ok', result) or ('error', traceback) back through the pipe.
+    '''
+    try:
+        conn.send(('ok', func(job)))
+    except BaseException:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def run_processes(func, jobs, max_processes=None):
+    '''
+        Run func(job) for every job in a separate forked worker process.
+        Returns the results in the order of jobs.
+
+        The processes are forked and not spawned, so the worker function does not need to be picklable
+        (Ansible executes modules as __main__ from a zip file, which breaks pickling by reference).
+        The results are sent back through a pipe and therefore must be picklable.
+
+        func: Function that is called with a single job as argument.
+        jobs: List of jobs.
+        max_processes: Maximum amount of concurrently running processes. Defaults to the amount of jobs.
+
+        throws RuntimeError if one of the workers failed.
+    '''
+    jobs = list(jobs)
+    ctx = multiprocessing.get_context('fork')
+
+    if not max_processes or max_processes < 1:
+        max_processes = len(jobs)
+
+    results = [None] * len(jobs)
+    errors = []
+    pending = list(enumerate(jobs))
+    running = {}
+
+    while pending or running:
+        #start new workers until the limit is reached
+        while pending and len(running) < max_processes:
+            index, job = pending.pop(0)
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            p = ctx.Process(target=__process_worker, args=(func, job, child_conn))
+            p.start()
+            child_conn.close()
+            running[parent_conn] = (index, p)
+            c.debug("started worker process {} for job {}", p.pid, index)
+
+        #wait until at least one worker has finished
+        for conn in multiprocessing.connection.wait(list(running.keys())):
+            index, p = running.pop(conn)
+            try:
+                status, value = conn.recv()
+            except EOFError:
+                status, value = 'error', "worker process {} died with exit code {}".format(p.pid, p.exitcode)
+            conn.close()
+            p.join()
+
+            if status == 'ok':
+                results[index] = value
+            else:
+                errors.append("job {}: {}".format(index, value))
+
+    if errors:
+        raise RuntimeError("{} worker process(es) failed:\n{}".format(len(errors), "\n".join(errors)))
+
+    return results
+
+
+def run_threads(func, jobs, max_threads=None):
+    '''
+        Run func(job) for every job in a bounded pool of threads.
+        Returns the results in the order of jobs.
+
+        Use this for I/O bound work on sockets that must stay in the current process.
+
+        func: Function that is called with a single job as argument.
+        jobs: Iterable of jobs.
+        max_threads: Maximum amount of concurrently running threads. Defaults to the amount of jobs.
+
+        Exceptions raised by func are passed through to the caller.
+    '''
+    return list(imap_threads(func, jobs, max_threads))
+
+
+def imap_threads(func, jobs, max_threads=None):
+    '''
+        Generator version of run_threads() that yields the results in the order of jobs.
+        jobs may be a generator, it is consumed lazily, so only about max_threads jobs and results exist at a time.
+    '''
+    if not max_threads or max_threads < 1:
+        jobs = list(jobs)
+        max_threads = max(len(jobs), 1)
+
+    running = collections.deque()
+
+    with ThreadPoolExecutor(max_workers=max_threads) as executor:
+        for job in jobs:
+            if len(running) >= max_threads:
+                yield running.popleft().result()
+            running.append(executor.submit(func, job))
+
+        while running:
+            yield running.popleft().result()
@@ -0,0 +1,188 @@
+import time
+
+import ansible.module_utils.scapy.core as c
+import ansible.module_utils.scapy.isotp as isotp
+import ansible.module_utils.scapy.metrics as metrics
+from ansible.module_utils.scapy.scan import recv_frames
+
+#ISOTP protocol control information
+PCI_SINGLE_FRAME = 0x0
+PCI_FIRST_FRAME = 0x1
+PCI_CONSECUTIVE_FRAME = 0x2
+PCI_FLOW_CONTROL = 0x3
+
+#maximum time between a first frame and the flow control frame of the receiver
+FLOW_CONTROL_TIME = 1.0
+
+#maximum time between the end of a request and the start of the response (UDS P2 server max is 50ms)
+RESPONSE_TIME = 0.05
+
+#an id pair must be seen this many times, unless it was confirmed by a flow control frame
+MIN_EXCHANGES = 2
+
+#at least this fraction of the frames of both ids must be valid ISOTP frames
+#about 15% of random payloads look like ISOTP frames, so this filters cyclic signal frames
+MIN_ISOTP_RATIO = 0.9
+
+
+def classify(pkt):
+    '''
+        Returns the ISOTP frame type (PCI_*) of a CAN frame with normal addressing
+        or None if the frame can not be an ISOTP frame.
+    '''
+    data = bytes(pkt.data)
+
+    if not data:
+        return None
+
+    pci = data[0] >> 4
+
+    if pci == PCI_SINGLE_FRAME:
+        length = data[0] & 0x0f
+        return pci if 0 < length < len(data) else None
+    if pci == PCI_FIRST_FRAME:
+        length = ((data[0] & 0x0f) << 8) | data[1] if len(data) > 1 else 0
+        return pci if len(data) == 8 and length > 7 else None
+    if pci == PCI_CONSECUTIVE_FRAME:
+        return pci if len(data) > 1 else None
+    if pci == PCI_FLOW_CONTROL:
+        return pci if len(data) >= 3 and data[0] & 0x0f <= 2 else None
+
+    return None
+
+
+class Exchanges(object):
+    '''
+        Collects evidence for ISOTP request/response id pairs from a stream of CAN frames.
+
+        A pair (request_id, response_id) is recorded if
+            - a first frame on one id is answered by a flow control frame on another id, or
+            - a message (single or first frame) on response_id starts shortly after a message on request_id.
+    '''
+
+    def __init__(self):
+        #id -> timestamp of the last message start
+        self.last_start = {}
+        #id -> amount of message starts
+        self.starts = {}
+        #id -> amount of frames with 8 data bytes / valid ISOTP frames / all frames
+        self.padded = {}
+        self.isotp_frames = {}
+        self.frames = {}
+        #(request_id, response_id) -> amount of exchanges
+        self.pairs = {}
+        #(sender_id, flow_control_id) confirmed by a flow control frame
+        self.flow_controlled = set()
+
+        self.last_message = None
+
+    def add(self, pkt):
+        frame_type = classify(pkt)
+        ident = pkt.identifier
+
+        self.frames[ident] = self.frames.get(ident, 0) + 1
+        self.padded[ident] = self.padded.get(ident, 0) + (len(pkt.data) == 8)
+
+        if frame_type is None:
+            return
+
+        self.isotp_frames[ident] = self.isotp_frames.get(ident, 0) + 1
+
+        if frame_type == PCI_FLOW_CONTROL:
+            #the flow control answers the most recent first frame of another id
+            candidates = [(t, i) for i, t in self.last_start.items()
+                          if i != ident and pkt.time - t <= FLOW_CONTROL_TIME]
+            if candidates:
+                _, sender = max(candidates)
+                self.flow_controlled.add((sender, ident))
+            return
+
+        if frame_type in (PCI_SINGLE_FRAME, PCI_FIRST_FRAME):
+            self.starts[ident] = self.starts.get(ident, 0) + 1
+
+            #a message that starts right after the last message of another id is a response
+            if self.last_message is not None:
+                last_id, last_time = self.last_message
+                if last_id != ident and pkt.time - last_time <= RESPONSE_TIME:
+                    self.pairs[(last_id, ident)] = self.pairs.get((last_id, ident), 0) + 1
+
+            self.last_start[ident] = pkt.time
+
+        #consecutive frames continue the message, the response time starts at its last frame
+        self.last_message = (ident, pkt.time)
+
+    def endpoints(self):
+        '''
+            Returns a dict {(request_id, response_id): padding} of the inferred endpoints.
+            request_id is the sid and response_id the did of an ISOTPSocket of the tester.
+        '''
+        result = {}
+
+        for (request_id, response_id), count in self.pairs.items():
+            confirmed = (request_id, response_id) in self.flow_controlled \
+                or (response_id, request_id) in self.flow_controlled
+            if not (self.__is_isotp(request_id) and self.__is_isotp(response_id)):
+                continue
+            if count < MIN_EXCHANGES and not confirmed:
+                continue
+
+            #both directions look like responses, keep the one that was seen more often
+            reverse = self.pairs.get((response_id, request_id), 0)
+            if reverse > count or (reverse == count and request_id > response_id):
+                continue
+
+            result[(request_id, response_id)] = self.padded[request_id] == self.frames[request_id]
+
+        #pairs that were only seen with flow control frames, the first frame sender is the requester
+        for sender, receiver in self.flow_controlled:
+            if not (self.__is_isotp(sender) and self.__is_isotp(receiver)):
+                continue
+            if (sender, receiver) not in result and (receiver, sender) not in result:
+                result[(sender, receiver)] = self.padded[sender] == self.frames[sender]
+
+        return result
+
+    def __is_isotp(self, ident):
+        return self.isotp_frames.get(ident, 0) >= MIN_ISOTP_RATIO * self.frames.get(ident, 0)
+
+
+def discover(interface, listen_time=10, max_frames=0, on_found=None):
+    '''
+        Infers ISOTP endpoints from the traffic on interface without sending a single frame.
+
+        interface: CAN interface to sniff on.
+        listen_time: Maximum time in seconds to sniff.
+        max_frames: Stop after this many frames. 0 means no limit.
+        on_found: Optional callback on_found(sock) that is called with each serialized socket.
+
+        Returns a list of serialized ISOTPSockets in the format of isotp.dump_socks().
+    '''
+    exchanges = Exchanges()
+    frames = 0
+    start = time.time()
+    sock = CANSocket(interface)
+
+    try:
+        with metrics.phase('passive'):
+            for pkt in recv_frames(sock, listen_time):
+                exchanges.add(pkt)
+                frames += 1
+                if max_frames and frames >= max_frames:
+                    break
+    finally:
+        sock.close()
+
+    endpoints = exchanges.endpoints()
+    c.debug("passive: {} endpoints in {} frames within {:.2f}s", len(endpoints), frames, time.time() - start)
+
+    with metrics.phase('serialize'):
+        result = [
+            isotp.make_sock(interface, sid=request_id, did=response_id, padding=padding)
+            for (request_id, response_id), padding in sorted(endpoints.items())
+        ]
+
+    if on_found:
+        for sock in result:
+            on_found(sock)
+
+    return result
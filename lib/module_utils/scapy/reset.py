@@ -0,0 +1,262 @@
+import time
+import importlib
+import collections
+
+import ansible.module_utils.scapy.core as c
+import ansible.module_utils.scapy.metrics as metrics
+
+#the session every ECU starts in and that is reachable from every session
+DEFAULT_SESSION = 0x01
+
+#wait in seconds after a reset if the handler options do not set one
+DEFAULT_WAITS = {
+    'uds': 0.5,
+    'command': 5,
+    'callable': 0
+}
+
+
+class ResetHandler(object):
+    '''
+        Puts an ECU back into its default session.
+        Subclasses implement _reset(sock), reset() waits afterwards and counts the resets.
+    '''
+
+    def __init__(self, wait):
+        self.wait = wait
+        self.resets = 0
+
+    def _reset(self, sock):
+        '''Sends the reset to the ECU behind sock, without waiting for its restart.'''
+        raise TypeError("{} does not implement _reset()".format(type(self).__name__))
+
+    def reset(self, sock):
+        c.debug("resetting ECU, reset {}", self.resets + 1)
+        started = time.time()
+        self._reset(sock)
+        self.resets += 1
+        time.sleep(self.wait)
+        metrics.observe('uds.reset', time.time() - started)
+
+
+class UdsResetHandler(ResetHandler):
+    '''Resets the ECU with the UDS service ECUReset (0x11).'''
+
+    def __init__(self, wait, reset_type='hard_reset', timeout=1):
+        super(UdsResetHandler, self).__init__(wait)
+        self.reset_type = 'softReset' if reset_type == 'soft_reset' else 'hardReset'
+        self.timeout = timeout
+
+    def _reset(self, sock):
+        resp = sock.sr1(UDS()/UDS_ER(resetType=self.reset_type), timeout=self.timeout, verbose=False)
+        if resp is None or resp.service != 0x51:
+            c.warn("ECU did not confirm the reset")
+
+
+class CommandResetHandler(ResetHandler):
+    '''
+        Resets the ECU with shell commands on the managed host, e.g. to switch the power supply of the ECU off and on.
+        A failed command is only reported, some tools return non zero exit codes on success.
+    '''
+
+    def __init__(self, wait, commands):
+        super(CommandResetHandler, self).__init__(wait)
+        self.commands = [commands] if isinstance(commands, str) else list(commands)
+
+    def _reset(self, sock):
+        for command in self.commands:
+            rc, _, stderr = c.ANSIBLE_MODULE.run_command(command, use_unsafe_shell=True)
+            if rc != 0:
+                c.warn("reset command '{}' returned {}: {}", command, rc, stderr)
+
+
+class CallableResetHandler(ResetHandler):
+    '''Resets the ECU with a python function 'package.module:function' that is called with the socket.'''
+
+    def __init__(self, wait, name):
+        super(CallableResetHandler, self).__init__(wait)
+
+        module_name, _, function_name = name.partition(':')
+        if not module_name or not function_name:
+            raise ValueError("callable must have the format 'module:function', got '{}'".format(name))
+
+        self.function = getattr(importlib.import_module(module_name), function_name)
+
+    def _reset(self, sock):
+        self.function(sock)
+
+
+def make_reset_handler(options):
+    '''
+        Creates a reset handler from the reset_handler option of a module.
+
+        options: dict with the key type (uds, command or callable) and the options of the type:
+                 uds: reset_type (hard_reset or soft_reset)
+                 command: command (a shell command or a list of them)
+                 callable: callable ('module:function')
+                 wait: seconds to wait after the reset, defaults to DEFAULT_WAITS
+
+        throws ValueError on invalid options.
+    '''
+    handler_type = options.get('type', 'uds')
+
+    if handler_type not in DEFAULT_WAITS:
+        raise ValueError("unknown reset handler type '{}'".format(handler_type))
+
+    wait = options.get('wait')
+    if wait is None:
+        wait = DEFAULT_WAITS[handler_type]
+
+    if handler_type == 'uds':
+        return UdsResetHandler(wait, reset_type=options.get('reset_type', 'hard_reset'))
+
+    if handler_type == 'command':
+        if not options.get('command'):
+            raise ValueError("reset handler type 'command' needs the option 'command'")
+        return CommandResetHandler(wait, options['command'])
+
+    if not options.get('callable'):
+        raise ValueError("reset handler type 'callable' needs the option 'callable'")
+    return CallableResetHandler(wait, options['callable'])
+
+
+class SessionExplorer(object):
+    '''
+        Finds the diagnostic sessions of an ECU and the transitions between them with DiagnosticSessionControl (0x10).
+
+        Every reached session is explored once: all sessions of the range are requested from it.
+        A successful request changes the session, so the explorer has to go back before the next request.
+        It goes back as cheap as possible:
+            1. over known transitions from the current session,
+            2. with a request of the default session, which every ECU must accept, and known transitions from there,
+            3. with a reset, which is the most expensive step and only used if the ECU does not leave the session.
+        The way back is only taken if another request follows, so a session without further requests costs nothing.
+
+        An interrupted exploration can be continued with the transitions and the tried [source, target] pairs
+        that were reported to progress(source, target, reached) before the interruption.
+    '''
+
+    def __init__(self, sock, reset_handler, session_range, timeout=1, transitions=(), tried=(), progress=None):
+        self.sock = sock
+        self.reset_handler = reset_handler
+        self.session_range = session_range
+        self.timeout = timeout
+        self.progress = progress
+
+        self.current = DEFAULT_SESSION
+        #session -> set of sessions that were reached from it
+        self.edges = collections.defaultdict(set)
+        for source, target in transitions:
+            self.edges[source].add(target)
+        self.tried = set((source, target) for source, target in tried)
+        self.requests = 0
+
+    def request(self, session):
+        '''Request session from the current session and return True on a positive response.'''
+        self.requests += 1
+        started = time.time()
+        resp = self.sock.sr1(UDS()/UDS_DSC(diagnosticSessionType=session), timeout=self.timeout, verbose=False)
+        if resp is None:
+            metrics.count('uds.timeouts')
+        else:
+            metrics.observe('uds.session', time.time() - started)
+
+        if resp is None or resp.service != 0x50:
+            return False
+
+        self.edges[self.current].add(session)
+        self.current = session
+        return True
+
+    def path(self, source, target):
+        '''Returns the shortest list of known transitions from source to target or None.'''
+        previous = {source: None}
+        queue = collections.deque([source])
+
+        while queue:
+            session = queue.popleft()
+            if session == target:
+                result = []
+                while previous[session] is not None:
+                    result.append(session)
+                    session = previous[session]
+                return result[::-1]
+            for following in sorted(self.edges[session]):
+                if following not in previous:
+                    previous[following] = session
+                    queue.append(following)
+
+        return None
+
+    def follow(self, path):
+        for session in path:
+            if not self.request(session):
+                return False
+        return True
+
+    def goto(self, target):
+        '''Go to target with as few resets as possible, returns False if target is not reachable anymore.'''
+        if self.current == target:
+            return True
+
+        path = self.path(self.current, target)
+        if path is not None and self.follow(path):
+            return True
+
+        if self.current != DEFAULT_SESSION and not self.request(DEFAULT_SESSION):
+            self.reset_handler.reset(self.sock)
+            self.current = DEFAULT_SESSION
+
+        path = self.path(DEFAULT_SESSION, target)
+        if path is not None and self.follow(path):
+            return True
+
+        c.warn("session {:#x} is not reachable anymore", target)
+        return False
+
+    def explore(self):
+        '''
+            Explore all sessions that are reachable from the default session.
+            Returns a dict with the found sessions, the transitions and the amount of requests and resets.
+        '''
+        explored = set()
+        pending = collections.deque([DEFAULT_SESSION])
+
+        if self.tried and not self.request(DEFAULT_SESSION):
+            #the ECU may have been left in any session by the interrupted exploration
+            self.reset_handler.reset(self.sock)
+            self.current = DEFAULT_SESSION
+
+        while pending:
+            source = pending.popleft()
+            explored.add(source)
+
+            for session in self.session_range:
+                if session in self.edges[source] or (source, session) in self.tried:
+                    reached = session in self.edges[source]
+                else:
+                    if not self.goto(source):
+                        break
+                    reached = self.request(session)
+                    self.tried.add((source, session))
+                    if self.progress:
+                        self.progress(source, session, reached)
+
+                if reached:
+                    c.debug("session transition {:#x} -> {:#x}", source, session)
+                    if session not in explored and session not in pending:
+                        pending.append(session)
+
+        #back to the default session, so the ECU is left in a defined state
+        self.goto(DEFAULT_SESSION)
+
+        sessions = set()
+        for targets in self.edges.values():
+            sessions.update(targets)
+
+        return {
+            'sessions': sorted(sessions),
+            'transitions': sorted([source, target] for source, targets in self.edges.items() for target in targets),
+            'requests': self.requests,
+            'resets': self.reset_handler.resets
+        }
@@ -0,0 +1,187 @@
+import os
+import time
+import sqlite3
+import threading
+
+import ansible.module_utils.scapy.core as c
+
+#rows are written in transactions of this size
+BATCH_SIZE = 500
+
+#response_code of a positive response, negative responses store their negative response code
+POSITIVE_RESPONSE = 0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    module TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    ecu TEXT NOT NULL,
+    session TEXT NOT NULL,
+    service INTEGER NOT NULL,
+    subfunction INTEGER,
+    response_code INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id, ecu);
+CREATE INDEX IF NOT EXISTS results_ecu ON results (ecu, service, session);
+CREATE INDEX IF NOT EXISTS runs_module ON runs (module, id);
+'''
+
+COLUMNS = ('ecu', 'session', 'service', 'subfunction', 'response_code')
+
+#session names of scapy's enumerators, the session column stores the id of the session instead
+SESSION_IDS = {
+    'DefaultSession': 0x1,
+    'ProgrammingSession': 0x2,
+    'ExtendedDiagnosticSession': 0x3,
+    'SafetySystemDiagnosticSession': 0x4,
+}
+DEFAULT_SESSION = 0x1
+
+
+def ecu_key(sock):
+    '''Returns a stable name of the ECU behind a serialized socket, e.g. 'vcan0:0x601:0x701'.'''
+    iface = sock.get('iface') or sock.get('can_socket')
+    key = "{}:{:#x}:{:#x}".format(iface, sock['sid'], sock['did'])
+
+    if sock.get('extended_addr') is not None or sock.get('extended_rx_addr') is not None:
+        key += ":{}:{}".format(sock.get('extended_addr'), sock.get('extended_rx_addr'))
+
+    return key
+
+
+def session_key(session):
+    '''Returns the value of the session column for a session id or name, e.g. '0x1' for 1 and 'DefaultSession'.'''
+    session = SESSION_IDS.get(session, session)
+    if isinstance(session, int):
+        return "{:#x}".format(session)
+
+    return str(session)
+
+
+def service_rows(ecu, found_services):
+    '''Converts the (session, response) tuples of UDS_ServiceEnumerator() into result rows.'''
+    rows = []
+
+    for session, resp in found_services:
+        if resp.service == 0x7f:
+            rows.append((ecu, session_key(session), resp.requestServiceId, None, resp.negativeResponseCode))
+        else:
+            rows.append((ecu, session_key(session), resp.service & ~0x40, None, POSITIVE_RESPONSE))
+
+    return rows
+
+
+def session_rows(ecu, transitions, session=DEFAULT_SESSION):
+    '''
+        Converts found sessions into DiagnosticSessionControl (0x10) result rows.
+        transitions: list of [source, target] pairs or of target sessions that were requested from session.
+    '''
+    rows = []
+
+    for transition in transitions:
+        if isinstance(transition, (list, tuple)):
+            source, target = transition
+            rows.append((ecu, session_key(source), 0x10, target, POSITIVE_RESPONSE))
+        else:
+            rows.append((ecu, session_key(session), 0x10, transition, POSITIVE_RESPONSE))
+
+    return rows
+
+
+class ResultDb(object):
+    '''
+        Stores scan results in a SQLite database with one row per ECU, session, service and response code.
+
+        Every instance records a run, the rows are buffered and written in transactions of batch_size rows
+        or when flush() is called, e.g. after the scan of an ECU is done.
+        add() and flush() are thread safe, so concurrent workers can write their results as soon as they are done.
+    '''
+
+    def __init__(self, path, module, batch_size=BATCH_SIZE):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.path = path
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = []
+        self.rows = 0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+        with self.conn:
+            self.run_id = self.conn.execute("INSERT INTO runs (module, started) VALUES (?, ?)",
+                                            (module, time.time())).lastrowid
+            self.previous_run_id = self.conn.execute(
+                "SELECT max(id) FROM runs WHERE module = ? AND id < ? AND finished IS NOT NULL",
+                (module, self.run_id)).fetchone()[0]
+
+        c.debug("result db '{}': run {}, previous run {}", path, self.run_id, self.previous_run_id)
+
+    def add(self, rows):
+        '''Add rows (ecu, session, service, subfunction, response_code) of this run.'''
+        with self.lock:
+            self.pending.extend(rows)
+            if len(self.pending) >= self.batch_size:
+                self.__flush()
+
+    def flush(self):
+        '''Write the pending rows, so they are kept if the run is interrupted.'''
+        with self.lock:
+            self.__flush()
+
+    def __flush(self):
+        if not self.pending:
+            return
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO results (run_id, ecu, session, service, subfunction, response_code) "
+                "VALUES (?, ?, ?, ?, ?, ?)", [(self.run_id,) + tuple(row) for row in self.pending])
+
+        self.rows += len(self.pending)
+        self.pending = []
+
+    def diff_previous(self):
+        '''
+            Compares this run with the previous finished run of the same module.
+            Only ECUs of this run are compared, so a run on a subset of the ECUs does not report the others as removed.
+
+            Returns a dict with the previous run id and the added and removed rows as dicts.
+        '''
+        self.flush()
+
+        result = {'previous_run': self.previous_run_id, 'added': [], 'removed': []}
+        if self.previous_run_id is None:
+            return result
+
+        query = '''
+            SELECT ecu, session, service, subfunction, response_code FROM results WHERE run_id = ?
+                AND ecu IN (SELECT DISTINCT ecu FROM results WHERE run_id = ?)
+            EXCEPT
+            SELECT ecu, session, service, subfunction, response_code FROM results WHERE run_id = ?
+            ORDER BY ecu, session, service, subfunction
+        '''
+        for key, newer, older in (('added', self.run_id, self.previous_run_id),
+                                  ('removed', self.previous_run_id, self.run_id)):
+            rows = self.conn.execute(query, (newer, self.run_id, older)).fetchall()
+            result[key] = [dict(zip(COLUMNS, row)) for row in rows]
+
+        return result
+
+    def close(self):
+        '''Write the pending rows and mark the run as finished.'''
+        with self.lock:
+            self.__flush()
+            with self.conn:
+                self.conn.execute("UPDATE runs SET finished = ? WHERE id = ?", (time.time(), self.run_id))
+            self.conn.close()
+
+        c.debug("result db '{}': {} rows in run {}", self.path, self.rows, self.run_id)
@@ -0,0 +1,100 @@
+import math
+import time
+import threading
+import collections
+
+#default bounds of adaptive timeouts in seconds
+RTT_FLOOR = 0.05
+RTT_CEILING = 3.0
+
+#an adaptive timeout is p99 * RTT_FACTOR + RTT_MARGIN
+RTT_FACTOR = 2.0
+RTT_MARGIN = 0.02
+
+
+class RttEstimator(object):
+    '''
+        Measures round trip times of request/response exchanges and derives timeouts from them.
+
+        Fixed timeouts must be chosen for the slowest ECU, but most ECUs answer within milliseconds.
+        The adaptive timeout is the 99th percentile of the measured round trip times multiplied by factor plus margin,
+        clamped to [floor, ceiling]. Until min_samples round trip times are known, the fixed default is used.
+
+        Only the newest max_samples round trip times are kept. The estimator is thread safe,
+        so a single estimator can be shared by workers on the same bus.
+    '''
+
+    def __init__(self, floor=RTT_FLOOR, ceiling=RTT_CEILING, factor=RTT_FACTOR, margin=RTT_MARGIN,
+                 min_samples=3, max_samples=1000):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.factor = factor
+        self.margin = margin
+        self.min_samples = min_samples
+        self.samples = collections.deque(maxlen=max_samples)
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def add(self, rtt):
+        with self.lock:
+            self.samples.append(rtt)
+
+    def percentile(self, p):
+        '''Returns the p-th percentile (nearest rank) of the measured round trip times or None.'''
+        with self.lock:
+            samples = sorted(self.samples)
+
+        if not samples:
+            return None
+
+        rank = int(math.ceil(p / 100.0 * len(samples)))
+        return samples[min(max(rank - 1, 0), len(samples) - 1)]
+
+    def timeout(self, default):
+        '''
+            Returns the adaptive timeout in seconds.
+            default is returned as long as too few round trip times are known and is never exceeded.
+        '''
+        with self.lock:
+            known = len(self.samples)
+
+        if known < self.min_samples:
+            return default
+
+        value = self.percentile(99) * self.factor + self.margin
+        return min(max(value, self.floor), self.ceiling, default)
+
+    def sr1(self, sock, pkt, timeout, **kwargs):
+        '''
+            Sends pkt on sock and returns the answer like sock.sr1().
+            The round trip time is recorded if an answer was received.
+        '''
+        start = time.time()
+        resp = sock.sr1(pkt, timeout=timeout, **kwargs)
+
+        if resp is None:
+            with self.lock:
+                self.timeouts += 1
+        else:
+            self.add(time.time() - start)
+
+        return resp
+
+    def stats(self):
+        '''Returns a json serializable summary of the measured round trip times in seconds.'''
+        with self.lock:
+            samples = list(self.samples)
+            timeouts = self.timeouts
+
+        if not samples:
+            return {'samples': 0, 'timeouts': timeouts}
+
+        return {
+            'samples': len(samples),
+            'timeouts': timeouts,
+            'min': round(min(samples), 6),
+            'mean': round(sum(samples) / len(samples), 6),
+            'p50': round(self.percentile(50), 6),
+            'p99': round(self.percentile(99), 6),
+            'max': round(max(samples), 6)
+        }
@@ -0,0 +1,523 @@
+import time
+import itertools
+
+import ansible.module_utils.scapy.core as c
+import ansible.module_utils.scapy.isotp as isotp
+import ansible.module_utils.scapy.parallel as parallel
+import ansible.module_utils.scapy.store as store
+import ansible.module_utils.scapy.checkpoint as checkpoint
+import ansible.module_utils.scapy.metrics as metrics
+from ansible.module_utils.scapy.idset import IdSet
+
+#same dummy frame that scapy's ISOTPScan sends to trigger activity on the bus
+DUMMY_ID = 0x123
+DUMMY_DATA = b'\xaa\xbb\xcc\xdd\xee\xff\xaa\xbb'
+
+#ISOTP first frame with a message size of 100 bytes
+#every ISOTP receiver listening on the probed id answers with a flow control frame
+PROBE_DATA = b'\x10\x64' + b'\x00' * 6
+
+#ISOTP protocol control information of a flow control frame
+PCI_FLOW_CONTROL = 0x3
+
+#highest 29 bit CAN identifier
+MAX_EXTENDED_ID = 0x1fffffff
+
+#prioritized sub-ranges of the 29 bit CAN identifier space
+#normal fixed addressing (ISO 15765-2) and J1939 use 0x18DA<target><source> / 0x1CDA<target><source> for
+#physical requests, the *_tester presets only contain the ids with the usual tester source address 0xF1
+EXTENDED_RANGES = {
+    'normal_fixed_tester': [range(0x18da00f1, 0x18db0000, 0x100)],
+    'normal_fixed': [range(0x18da0000, 0x18db0000)],
+    'j1939_tester': [range(0x1cda00f1, 0x1cdb0000, 0x100)],
+    'j1939': [range(0x1cda0000, 0x1cdb0000)],
+    'all': [range(0, MAX_EXTENDED_ID + 1)],
+}
+
+
+def recv_frames(sock, timeout):
+    '''
+        Generator that yields all CAN frames received on sock until the timeout expires.
+    '''
+    deadline = time.time() + timeout
+
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+
+        if not c.wait_readable(sock, remaining):
+            continue
+
+        pkt = sock.recv()
+        if pkt is not None:
+            metrics.count('can.received')
+            yield pkt
+
+
+def drain(sock):
+    '''Discards all frames that are already queued on sock.'''
+    while c.wait_readable(sock, 0):
+        if sock.recv() is None:
+            break
+
+
+def is_flow_control(pkt):
+    '''Checks if a CAN frame is an ISOTP flow control frame (flow status 0-2).'''
+    data = bytes(pkt.data)
+
+    return len(data) >= 3 and data[0] >> 4 == PCI_FLOW_CONTROL and data[0] & 0x0f <= 2
+
+
+def listen(sock, listen_time, adaptive=False, idle_time=1.0):
+    '''
+        Listens for background traffic on the bus.
+
+        sock: CANSocket to listen on.
+        listen_time: Maximum time in seconds to listen.
+        adaptive: Stop listening as soon as no new id has been seen for idle_time seconds.
+
+        Returns a noise profile dict with the seen ids and their periods, the frame rate and the time it was captured.
+    '''
+    timestamps = {}
+    frames = 0
+    start = time.time()
+
+    if listen_time > 0:
+        #in most cases this triggers activity on the bus
+        sock.send(CAN(identifier=DUMMY_ID, length=8, data=DUMMY_DATA))
+        metrics.count('can.sent')
+
+        last_new = start
+        deadline = start + listen_time
+
+        while time.time() < deadline:
+            timeout = deadline - time.time()
+            if adaptive:
+                timeout = min(timeout, last_new + idle_time - time.time())
+                if timeout <= 0:
+                    c.debug("no new noise ids for {}s, stop listening", idle_time)
+                    break
+
+            for pkt in recv_frames(sock, timeout):
+                frames += 1
+                if pkt.identifier not in timestamps:
+                    timestamps[pkt.identifier] = []
+                    last_new = time.time()
+                    if adaptive:
+                        break
+                timestamps[pkt.identifier].append(pkt.time)
+
+    duration = time.time() - start
+    c.debug("noise: {} frames from {} ids in {:.2f}s", frames, len(timestamps), duration)
+
+    return {
+        'captured': start,
+        'frame_rate': frames / duration if duration > 0 else 0,
+        'ids': {i: __period(ts) for i, ts in timestamps.items()}
+    }
+
+
+def __period(timestamps):
+    '''Returns the mean period of the timestamps of a periodic id or None if it was seen only once.'''
+    if len(timestamps) < 2:
+        return None
+
+    return (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1)
+
+
+def noise_profile(sock, interface, listen_time, adaptive=False, cache_ttl=0, cache_dir=None, check_time=0.5):
+    '''
+        Returns the noise profile of interface, see listen().
+
+        If cache_ttl is set, the profile is cached on disk per interface.
+        A cached profile that is younger than cache_ttl seconds is reused, instead of a full listen
+        only a short check of check_time seconds is done to add ids that are new since the capture.
+    '''
+    if cache_ttl <= 0:
+        return listen(sock, listen_time, adaptive)
+
+    path = store.cache_path(cache_dir, "noise_{}.json".format(interface))
+    cached = store.load_json(path)
+
+    if cached and time.time() - cached.get('captured', 0) < cache_ttl:
+        c.debug("reusing noise profile '{}' from {:.0f}s ago", path, time.time() - cached['captured'])
+        metrics.count('cache.noise_hits')
+
+        profile = listen(sock, check_time)
+        new_ids = set(profile['ids']) - set(int(i) for i in cached['ids'])
+        if new_ids:
+            c.debug("new noise ids since capture: {}", [hex(i) for i in new_ids])
+
+        #json stores the keys as strings
+        profile['ids'].update((int(i), period) for i, period in cached['ids'].items())
+        profile['captured'] = cached['captured']
+        profile['frame_rate'] = cached['frame_rate']
+    else:
+        profile = listen(sock, listen_time, adaptive)
+
+    store.save_json(path, profile)
+
+    return profile
+
+
+def pending_ids(segments, noise_ids, skip=None, earlier=()):
+    '''
+        Generator over the ids of segments in order, without noise ids and ids in skip.
+        segments is a list of ranges. Overlapping ranges are allowed, an id is only yielded by the first range
+        that contains it, also ids contained in one of the ranges of earlier are not yielded.
+    '''
+    earlier = list(earlier)
+
+    for segment in segments:
+        for i in segment:
+            if i in noise_ids or (skip is not None and i in skip) or any(i in r for r in earlier):
+                continue
+            yield i
+        earlier.append(segment)
+
+
+def probe(sock, ids, noise_ids, sniff_time, progress=None, window=1, extended_can_id=False):
+    '''
+        Sends an ISOTP first frame to every id and waits sniff_time for flow control answers.
+
+        ids: Iterable of ids to probe, noise ids are skipped.
+        progress: Optional callback progress(probe_id, answers) that is called after each probed id.
+        window: Amount of ids that are probed with a single burst, see probe_burst(). 1 probes id by id.
+        extended_can_id: Send the probes with 29 bit CAN identifiers.
+
+        Returns a dict {answer_id: (probe_id, padding)}.
+        The probe_id is used as sid and the answer_id as did of the found ISOTPSocket.
+    '''
+    ids = iter(i for i in ids if i not in noise_ids)
+    window = max(window, 1)
+    found = {}
+
+    while True:
+        window_ids = list(itertools.islice(ids, window))
+        if not window_ids:
+            break
+
+        answers = probe_burst(sock, window_ids, noise_ids, sniff_time, extended_can_id)
+        found.update(answers)
+
+        if progress:
+            for probe_id in window_ids:
+                progress(probe_id, {a: v for a, v in answers.items() if v[0] == probe_id})
+
+    return found
+
+
+def probe_burst(sock, ids, noise_ids, sniff_time, extended_can_id=False):
+    '''
+        Sends ISOTP first frames to all ids back to back and collects the flow control answers with one receive loop.
+        A window without answers costs a single sniff_time instead of one per id.
+
+        A flow control frame does not tell which probe it answers.
+        If a burst of more than one id gets answers, the ids are split in halves that are probed again,
+        until every answer is matched to a single probe id.
+
+        Returns a dict {answer_id: (probe_id, padding)}.
+    '''
+    flags = 'extended' if extended_can_id else 0
+
+    for probe_id in ids:
+        sock.send(CAN(identifier=probe_id, flags=flags, length=8, data=PROBE_DATA))
+    metrics.count('can.sent', len(ids))
+    sent = time.time()
+
+    answers = {}
+    for pkt in recv_frames(sock, sniff_time):
+        if pkt.identifier in noise_ids or pkt.identifier in ids:
+            continue
+        if is_flow_control(pkt):
+            answers[pkt.identifier] = len(pkt.data) == 8
+            #latency of the flow control after the last probe of the burst
+            metrics.observe('isotp.probe', time.time() - sent)
+
+    if not answers:
+        return {}
+
+    if len(ids) == 1:
+        return {answer_id: (ids[0], padding) for answer_id, padding in answers.items()}
+
+    c.debug("{} answers to a burst of {} probes, splitting", len(answers), len(ids))
+    middle = len(ids) // 2
+    found = probe_burst(sock, ids[:middle], noise_ids, sniff_time, extended_can_id)
+    found.update(probe_burst(sock, ids[middle:], noise_ids, sniff_time, extended_can_id))
+
+    return found
+
+
+def shard(segments, shard_size):
+    '''
+        Generator that splits every range of segments into chunks of shard_size.
+        Yields tuples (chunk, earlier) with the preceding segments, see pending_ids().
+
+        The segments are processed in order, so their priority is kept.
+        The chunks of a segment are ordered so that consecutively dispatched chunks are spread over the whole segment
+        (bit-reversed order), which interleaves the ids that are probed concurrently.
+        Range slices are used for the chunks, so even the 29 bit id space is split without allocating the ids.
+    '''
+    for n, segment in enumerate(segments):
+        count = (len(segment) + shard_size - 1) // shard_size
+        bits = max(1, (count - 1).bit_length())
+
+        for i in range(1 << bits):
+            k = int(format(i, '0{}b'.format(bits))[::-1], 2)
+            if k < count:
+                yield segment[k * shard_size:(k + 1) * shard_size], segments[:n]
+
+
+def allowed_workers(max_workers, background_rate, probe_interval, max_frame_rate):
+    '''
+        Derive the amount of concurrent probe workers from the measured bus load.
+        Every worker adds about one probe frame per probe_interval seconds to the bus.
+        The background traffic plus the probes must stay below max_frame_rate frames per second.
+    '''
+    budget = (max_frame_rate - background_rate) * probe_interval
+    workers = max(1, min(max_workers, int(budget)))
+
+    c.debug("bus load {:.1f} frames/s -> {} of {} workers", background_rate, workers, max_workers)
+
+    return workers
+
+
+def parse_ranges(specs):
+    '''
+        Convert a list of range specifications into a list of ranges in the same order.
+        A specification is the name of a preset in EXTENDED_RANGES or a string 'start-end' with an inclusive end,
+        e.g. '0x18da00f1-0x18daffff'.
+
+        throws ValueError on an invalid specification.
+    '''
+    result = []
+
+    for spec in specs:
+        if spec in EXTENDED_RANGES:
+            result.extend(EXTENDED_RANGES[spec])
+            continue
+
+        try:
+            start, end = (int(value, 0) for value in spec.split('-'))
+        except ValueError:
+            raise ValueError("invalid range '{}', expected a preset {} or 'start-end'".format(
+                spec, sorted(EXTENDED_RANGES)))
+
+        if not 0 <= start <= end <= MAX_EXTENDED_ID:
+            raise ValueError("invalid range '{}'".format(spec))
+
+        result.append(range(start, end + 1))
+
+    return result
+
+
+def scan(interface, ids, noise_listen_time=5, noise_adaptive=False, noise_cache_ttl=0, cache_dir=None,
+         sniff_time=0.1, probe_window=1, shard_size=0, max_workers=1, max_frame_rate=1000, checkpoint_file=None,
+         result_cache_ttl=0, result_cache_validate=True, extended_can_id=False, on_found=None):
+    '''
+        Scan ids on interface for ISOTP endpoints.
+        Works like scapy's ISOTPScan(), but supports sharding of the id range.
+
+        interface: CAN interface to be scanned.
+        ids: List of ranges of CAN identifiers to be probed in this order, see parse_ranges().
+        noise_listen_time: Time in seconds to listen for background traffic before probing.
+        noise_adaptive: Stop listening for background traffic once no new ids appear.
+        noise_cache_ttl: Reuse a noise profile of interface that is younger than this many seconds. 0 disables the cache.
+        cache_dir: Directory of the cached noise profiles and scan results.
+        sniff_time: Time in seconds to wait for a flow control answer after each probe.
+        probe_window: Amount of ids that are probed with a single burst, see probe_burst().
+        shard_size: Split ids into chunks of this size that are probed by a pool of workers. 0 disables sharding.
+        max_workers: Maximum amount of concurrent workers in sharded mode.
+        max_frame_rate: Bus load in frames per second that the sharded scan should not exceed.
+        checkpoint_file: Record the progress in this file and resume from it, see checkpoint.ScanCheckpoint.
+        result_cache_ttl: Reuse the result of a scan with the same parameters that is younger than this many seconds.
+                          0 disables the cache.
+        result_cache_validate: Probe the cached endpoints again and only reuse the result if all of them still answer.
+        extended_can_id: Probe with 29 bit CAN identifiers.
+        on_found: Optional callback on_found(sock) that is called with each serialized socket as soon as it is confirmed.
+                  In sharded mode the sockets are confirmed after the shards are merged.
+
+        Returns a list of serialized ISOTPSockets in the format of isotp.dump_socks().
+    '''
+    params = {
+        'interface': interface,
+        'ids': [[r.start, r.stop, r.step] for r in ids],
+        'sniff_time': sniff_time,
+        'extended_can_id': extended_can_id
+    }
+
+    cache_file = None
+    found = None
+    reported = set()
+
+    def report(answers):
+        if not on_found:
+            return
+        for answer_id, (probe_id, padding) in sorted(answers.items()):
+            if answer_id not in reported:
+                reported.add(answer_id)
+                on_found(isotp.make_sock(interface, sid=probe_id, did=answer_id, padding=padding,
+                                         extended_can_id=extended_can_id))
+
+    if result_cache_ttl > 0:
+        cache_file = store.cache_path(cache_dir, "result_{}_{}.json".format(interface, store.digest(params)))
+        with metrics.phase('result_cache'):
+            found = cached_result(cache_file, result_cache_ttl, result_cache_validate, interface, sniff_time,
+                                  extended_can_id)
+
+    if found is None:
+        found = __scan(interface, ids, params, noise_listen_time, noise_adaptive, noise_cache_ttl, cache_dir,
+                       sniff_time, probe_window, shard_size, max_workers, max_frame_rate, checkpoint_file,
+                       extended_can_id, report)
+
+        if cache_file:
+            store.save_json(cache_file, {'params': params, 'captured': time.time(), 'found': found})
+
+    with metrics.phase('serialize'):
+        #everything that was not confirmed while probing, e.g. cached or sharded results
+        report(found)
+
+        return [
+            isotp.make_sock(interface, sid=probe_id, did=answer_id, padding=padding,
+                            extended_can_id=extended_can_id)
+            for answer_id, (probe_id, padding) in sorted(found.items(), key=lambda item: item[1][0])
+        ]
+
+
+def cached_result(path, ttl, validate, interface, sniff_time, extended_can_id=False):
+    '''
+        Returns the answers of a cached scan in the format of probe().
+        Returns None if there is no cached scan younger than ttl seconds
+        or if validate is set and one of the cached endpoints does not answer anymore.
+    '''
+    cached = store.load_json(path)
+
+    if not cached or time.time() - cached['captured'] >= ttl:
+        return None
+
+    #json stores the keys as strings
+    found = {int(answer_id): tuple(value) for answer_id, value in cached['found'].items()}
+
+    if validate and found:
+        sock = CANSocket(interface)
+        try:
+            answers = probe(sock, sorted(set(probe_id for probe_id, _ in found.values())), IdSet(), sniff_time,
+                            extended_can_id=extended_can_id)
+        finally:
+            sock.close()
+
+        for answer_id, (probe_id, _) in found.items():
+            if answers.get(answer_id, (None,))[0] != probe_id:
+                c.debug("cached endpoint {}->{} does not answer anymore", hex(probe_id), hex(answer_id))
+                return None
+
+    c.debug("reusing cached scan result '{}' with {} endpoints", path, len(found))
+    metrics.count('cache.result_hits')
+
+    return found
+
+
+def __scan(interface, ids, params, noise_listen_time, noise_adaptive, noise_cache_ttl, cache_dir,
+           sniff_time, probe_window, shard_size, max_workers, max_frame_rate, checkpoint_file, extended_can_id,
+           report):
+    '''
+        Listens for noise and probes ids, see scan(). Returns the answers in the format of probe().
+        report(answers) is called with the answers that are confirmed while probing.
+    '''
+    cp = None
+    done = None
+
+    if checkpoint_file:
+        cp = checkpoint.ScanCheckpoint(checkpoint_file, params)
+
+    def progress(probe_id, answers):
+        if cp:
+            cp.update(probe_id, answers)
+        report(answers)
+
+    sock = CANSocket(interface)
+
+    try:
+        if cp and cp.noise is not None:
+            noise = cp.noise
+        else:
+            with metrics.phase('noise'):
+                noise = noise_profile(sock, interface, noise_listen_time, adaptive=noise_adaptive,
+                                      cache_ttl=noise_cache_ttl, cache_dir=cache_dir)
+            if cp:
+                cp.set_noise(noise)
+        noise_ids = IdSet.from_ids(noise['ids'])
+
+        found = {}
+        if cp and cp.resumed:
+            #the endpoints found before the interruption may be gone (e.g. ECU power-cycled), so probe them again
+            previous = sorted(set(probe_id for probe_id, _ in cp.found.values()))
+            with metrics.phase('verify'):
+                found = probe(sock, previous, noise_ids, sniff_time, extended_can_id=extended_can_id)
+            report(found)
+            #copy, the checkpoint is updated while probing
+            done = IdSet(cp.done.intervals())
+
+        if shard_size <= 0 or sum(len(segment) for segment in ids) <= shard_size:
+            with metrics.phase('probe'):
+                found.update(probe(sock, pending_ids(ids, noise_ids, done), noise_ids, sniff_time, progress,
+                                   probe_window, extended_can_id))
+        else:
+            workers = allowed_workers(max_workers, noise['frame_rate'], sniff_time / probe_window, max_frame_rate)
+            #the answers of the workers are not confirmed before the shards are merged
+            with metrics.phase('probe'):
+                found.update(scan_sharded(sock, interface, ids, noise_ids, done, sniff_time, shard_size, workers,
+                                          cp.update if cp else None, probe_window, extended_can_id))
+    finally:
+        sock.close()
+
+    if cp:
+        cp.remove()
+
+    return found
+
+
+def scan_sharded(sock, interface, ids, noise_ids, done, sniff_time, shard_size, workers, progress=None, window=1,
+                 extended_can_id=False):
+    '''
+        Probe the chunks of ids with a pool of workers, each with its own CANSocket on interface.
+        Returns the merged and deduplicated answers in the format of probe().
+
+        All workers see the answers to the probes of the other workers.
+        An answer that is claimed by more than one probe id is verified by probing the candidates again on sock.
+    '''
+    c.debug("probing {} ranges in shards of {} ids with {} workers", len(ids), shard_size, workers)
+
+    def probe_chunk(job):
+        chunk, earlier = job
+        worker_sock = CANSocket(interface)
+        try:
+            return probe(worker_sock, pending_ids([chunk], noise_ids, done, earlier), noise_ids, sniff_time,
+                         progress, window, extended_can_id)
+        finally:
+            worker_sock.close()
+
+    claims = {}
+    for found in parallel.imap_threads(probe_chunk, shard(ids, shard_size), max_threads=workers):
+        for answer_id, (probe_id, padding) in found.items():
+            claims.setdefault(answer_id, {})[probe_id] = padding
+
+    #the answers to the probes of the workers are still queued on sock
+    drain(sock)
+
+    result = {}
+    for answer_id, candidates in claims.items():
+        if len(candidates) == 1:
+            probe_id, padding = next(iter(candidates.items()))
+            result[answer_id] = (probe_id, padding)
+            continue
+
+        c.debug("answer id {} claimed by {} probes, verifying", hex(answer_id), len(candidates))
+        for probe_id in sorted(candidates):
+            verified = probe(sock, [probe_id], noise_ids, sniff_time, extended_can_id=extended_can_id)
+            if answer_id in verified:
+                result[answer_id] = verified[answer_id]
+                break
+
+    return result
@@ -0,0 +1,59 @@
+import os
+import json
+import hashlib
+import tempfile
+
+import ansible.module_utils.scapy.core as c
+
+#default directory for cached scan data, e.g. noise profiles
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'scable')
+
+
+def cache_path(cache_dir, name):
+    '''
+        Returns the path of a file in cache_dir, which defaults to DEFAULT_CACHE_DIR.
+        The file name is sanitized, so interface names etc. can be used directly.
+    '''
+    name = "".join(ch if ch.isalnum() or ch in '-_.' else '_' for ch in name)
+
+    return os.path.join(os.path.expanduser(cache_dir or DEFAULT_CACHE_DIR), name)
+
+
+def digest(params):
+    '''Returns a short stable hash of a json serializable dict, e.g. to use scan parameters as a cache key.'''
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_json(path, default=None):
+    '''
+        Load a json file.
+        Returns default if the file does not exist or can not be parsed.
+    '''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError):
+        return default
+    except ValueError:
+        c.warn("ignoring corrupt file '{}'", path)
+        return default
+
+
+def save_json(path, data):
+    '''
+        Save data as json file.
+        The file is written to a temporary file first and then renamed,
+        so readers never see a partially written file, even if the module is killed.
+    '''
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    fd, tmp_path = tempfile.mkstemp(dir=dirname or '.', prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
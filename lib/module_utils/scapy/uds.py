@@ -0,0 +1,342 @@
+import time
+import collections
+
+import ansible.module_utils.scapy.core as c
+import ansible.module_utils.scapy.metrics as metrics
+import ansible.module_utils.scapy.rtt as rtt
+
+#the request service ids that scapy's UDS_ServiceEnumerator probes, the bit 0x40 marks positive responses
+SERVICE_IDS = sorted(set(sid & ~0x40 for sid in range(0x100)))
+
+#negative response codes of services that are not available, they are filtered like in UDS_ServiceEnumerator
+NOT_AVAILABLE = (0x10, 0x11)
+
+#timeout in seconds for a single service request
+SERVICE_TIMEOUT = 0.5
+
+#negative response codes that are no final answer to a request
+BUSY_REPEAT_REQUEST = 0x21
+RESPONSE_PENDING = 0x78
+
+#P2*server max in seconds, the time an ECU may take for the final response after a responsePending
+PENDING_TIMEOUT = 5
+
+#requests that are answered with busyRepeatRequest are repeated up to this many times
+BUSY_RETRIES = 3
+
+#amount of TesterPresent requests that are sent to measure the round trip time of an ECU
+RTT_PROBES = 5
+
+#fixed waits of detect() in seconds, for a sleeping ECU to wake up and for an ECU to restart after the ecu_reset probe
+WAKE_UP_WAIT = 3
+RESTART_WAIT = 1
+
+
+class Response(object):
+    '''
+        The fields of a raw UDS response that the scan results need, e.g. for is_available() and the result rows.
+        Clients of the daemon evaluate its responses with it, so they do not have to load scapy.
+        Missing fields are 0 like in the scapy layers.
+    '''
+
+    def __init__(self, raw):
+        self.raw = bytes(raw)
+        self.service = self.raw[0]
+
+        fields = self.raw[1:] + bytes(2)
+        if self.service == 0x7f:
+            self.requestServiceId = fields[0]
+            self.negativeResponseCode = fields[1]
+        elif self.service == 0x50:
+            self.diagnosticSessionType = fields[0]
+
+    def __bytes__(self):
+        return self.raw
+
+
+def is_available(resp, filter_responses=True):
+    '''Checks whether a response shows that the requested service is available.'''
+    if resp.service != 0x7f or not filter_responses:
+        return True
+
+    return resp.negativeResponseCode not in NOT_AVAILABLE
+
+
+def request_service_id(resp):
+    '''Returns the service id of the request a response belongs to.'''
+    if resp.service == 0x7f:
+        return resp.requestServiceId
+
+    return resp.service & ~0x40
+
+
+def enumerate_services(sock, session="DefaultSession", service_ids=SERVICE_IDS, timeout=SERVICE_TIMEOUT,
+                       filter_responses=True, skip=(), progress=None, window=1, pending_timeout=PENDING_TIMEOUT):
+    '''
+        Requests every service id on sock, like scapy's UDS_ServiceEnumerator.
+
+        Up to window requests are in flight at a time, the responses are matched to them by their service id.
+        A request is done as soon as its response arrives, only unanswered requests wait for the whole timeout.
+        The ECU answers queued requests one after another, so every response extends the timeout of the requests
+        in flight and a large window does not time out while the ECU is still answering.
+        A responsePending (0x78) extends the timeout of its request to pending_timeout, the request leaves the window,
+        so the scan continues while the ECU is working. Requests answered with busyRepeatRequest (0x21) are repeated.
+
+        session: Name of the current session, stored in the result.
+        service_ids: Service ids to request.
+        timeout: Timeout in seconds for a single request.
+        filter_responses: Drop negative responses that mean the service is not available.
+        skip: Service ids that are not requested, e.g. because they were requested before an interruption.
+        progress: Optional callback progress(service_id, resp) that is called when a request is done, resp may be None.
+        window: Maximum amount of requests in flight, 1 sends the next request after the previous one is done,
+                None sends all requests at once.
+        pending_timeout: Timeout in seconds after a responsePending.
+
+        Returns a list of (session, response) tuples of the available services, the format of getTableEntry().
+    '''
+    found = []
+    queue = collections.deque(sid for sid in service_ids if sid not in skip)
+    window = window or len(queue)
+    #service id -> deadline, requests in the window and requests with a responsePending
+    in_flight = collections.OrderedDict()
+    pending = {}
+    retries = collections.Counter()
+    #service id -> time the request was sent, for the latency histogram
+    sent = {}
+
+    def done(sid, resp):
+        if resp is None:
+            metrics.count('uds.timeouts')
+        else:
+            metrics.observe('uds.service', time.time() - sent[sid])
+
+        if progress:
+            progress(sid, resp)
+
+        if resp is not None and is_available(resp, filter_responses):
+            found.append((session, resp))
+
+    while queue or in_flight or pending:
+        while queue and len(in_flight) < window:
+            sid = queue.popleft()
+            sock.send(UDS(service=sid))
+            metrics.count('uds.sent')
+            sent[sid] = time.time()
+            in_flight[sid] = sent[sid] + timeout
+
+        now = time.time()
+        for requests in (in_flight, pending):
+            for sid, deadline in list(requests.items()):
+                if deadline <= now:
+                    del requests[sid]
+                    done(sid, None)
+
+        if not in_flight and not pending:
+            continue
+
+        deadline = min(list(in_flight.values()) + list(pending.values()))
+        if not c.wait_readable(sock, deadline - now):
+            continue
+
+        resp = sock.recv()
+        if resp is None:
+            continue
+        metrics.count('uds.received')
+
+        sid = request_service_id(resp)
+        if sid not in in_flight and sid not in pending:
+            c.debug("dropping response to service {:#x}, no request in flight", sid)
+            continue
+
+        #the ECU is still working through the requests
+        extended = time.time() + timeout
+        for other in in_flight:
+            in_flight[other] = max(in_flight[other], extended)
+
+        nrc = resp.negativeResponseCode if resp.service == 0x7f else None
+
+        if nrc == RESPONSE_PENDING:
+            in_flight.pop(sid, None)
+            pending[sid] = time.time() + pending_timeout
+            c.debug("service {:#x}: response pending", sid)
+            continue
+
+        in_flight.pop(sid, None)
+        pending.pop(sid, None)
+
+        if nrc == BUSY_REPEAT_REQUEST and retries[sid] < BUSY_RETRIES:
+            retries[sid] += 1
+            queue.append(sid)
+            continue
+
+        done(sid, resp)
+
+    c.debug("{} of {} services available", len(found), len(service_ids))
+
+    return found
+
+
+def measure_rtt(sock, estimator, probes=RTT_PROBES):
+    '''
+        Sends up to probes TesterPresent requests on sock and records the round trip times in estimator.
+        Returns True if the ECU answered all of them.
+    '''
+    for _ in range(probes):
+        #TesterPresent does not change the state of the ECU and is answered with 0x7e
+        if estimator.sr1(sock, UDS()/UDS_TP(subFunction=0), timeout=1, verbose=False) is None:
+            #do not wait for every probe of a silent ECU, the fixed timeouts are used then
+            c.debug("no answer to TesterPresent")
+            return False
+
+    return True
+
+
+def __request_session(sock, session, reset_wait, timeout):
+    '''
+        The requests of scapy's UDS_SessionEnumerator for a single session, with timeout for the requests.
+        Returns a list with the positive response if the ECU switched to session.
+    '''
+    resp = sock.sr1(UDS()/UDS_DSC(diagnosticSessionType=session), timeout=timeout, verbose=False)
+    if resp is None:
+        return []
+
+    #the ECU is reset after every answer, so the next session is requested from the default session
+    sock.sr1(UDS()/UDS_ER(resetType='hardReset'), timeout=timeout, verbose=False)
+    time.sleep(reset_wait)
+
+    return [resp] if resp.service == 0x50 else []
+
+
+def enumerate_sessions(sock, session_range, reset_wait, skip=(), progress=None, timeout=None):
+    '''
+        Requests every session of session_range with scapy's UDS_SessionEnumerator, one session at a time.
+
+        skip: Sessions that are not requested, e.g. because they were requested before an interruption.
+        progress: Optional callback progress(session, found) that is called after each session.
+        timeout: Timeout in seconds of the requests, e.g. an adaptive timeout. The enumerator has fixed timeouts,
+                 so the same requests are sent without it then and the positive responses are returned.
+
+        Returns the list of found sessions in the format of UDS_SessionEnumerator().
+    '''
+    found = []
+
+    for session in session_range:
+        if session in skip:
+            continue
+
+        started = time.time()
+        if timeout is None:
+            result = UDS_SessionEnumerator(sock, session_range=range(session, session + 1), reset_wait=reset_wait)
+        else:
+            result = __request_session(sock, session, reset_wait, timeout)
+        #the enumerator switches to the session, checks it and resets the ECU
+        metrics.observe('uds.session', time.time() - started)
+
+        if progress:
+            progress(session, result)
+
+        found.extend(result)
+
+    return found
+
+
+def make_probe(service, reset_type='hard_reset'):
+    '''Returns the UDS request of a probe service of detect().'''
+    if service == 'ecu_reset':
+        return UDS()/UDS_ER(resetType='softReset' if reset_type == 'soft_reset' else 'hardReset')
+    if service == 'tester_present':
+        #the suppressPosRspMsgIndicationBit (0x80) must not be set, a supporting ECU would not answer at all
+        return UDS()/UDS_TP(subFunction=0)
+    if service == 'diagnostic_session_control':
+        #the ECU is usually in the default session already, so requesting it does not change anything
+        return UDS()/UDS_DSC(diagnosticSessionType=0x01)
+
+    raise ValueError("unknown probe service '{}'".format(service))
+
+
+def is_uds_response(resp, request_sid):
+    '''
+        Checks whether resp answers a request with request_sid.
+        Either a positive response (request SID + 0x40) or a negative response (SID 0x7f) that refers to the request SID.
+    '''
+    if resp.service == request_sid + 0x40:
+        return True
+
+    return resp.service == 0x7f and resp.requestServiceId == request_sid
+
+
+def __sr1(sock, pkt, timeout, estimator):
+    '''Sends pkt and waits for the answer, with an estimator the timeout is adapted to the measured round trip times.'''
+    started = time.time()
+    if estimator is None:
+        resp = sock.sr1(pkt, timeout=timeout, verbose=False)
+    else:
+        resp = estimator.sr1(sock, pkt, timeout=estimator.timeout(timeout), verbose=False)
+
+    metrics.count('uds.sent')
+    if resp is None:
+        metrics.count('uds.timeouts')
+    else:
+        metrics.count('uds.received')
+        metrics.observe('uds.probe', time.time() - started)
+
+    return resp
+
+
+def detect(sock, probes, reset_type='hard_reset', adaptive_timeout=False):
+    '''
+        Sends the probes of the chain, e.g. ['ecu_reset'], on sock until the ECU answers one of them.
+
+        reset_type: hard_reset or soft_reset for the ecu_reset probe.
+        adaptive_timeout: Measure the round trip time of the ECU with TesterPresent requests first
+                          and adapt the timeouts of the probes to it. An ECU that answered is awake,
+                          so the wait for a sleeping ECU to wake up is skipped.
+
+        Returns a tuple (is_uds, rtt) with True if the ECU answered with a UDS response
+        and the round trip time statistics of the ECU with the timeout of the probes if adaptive_timeout is set,
+        None otherwise.
+    '''
+    c.debug("Socket: {}", vars(sock))
+
+    sock.basecls = UDS
+
+    #every ECU gets its own estimator, a slow ECU must not get the timeouts of faster ones
+    estimator = None
+    awake = False
+    if adaptive_timeout:
+        estimator = rtt.RttEstimator()
+        with metrics.phase('rtt'):
+            awake = measure_rtt(sock, estimator)
+
+    is_uds = False
+
+    for i, service in enumerate(probes):
+        p = make_probe(service, reset_type)
+        c.debug("Sending packet {!r}", p)
+        resp = __sr1(sock, p, 1, estimator)
+
+        #try second time, in case ECU was waken up by first message
+        #the following probes of the chain are sent to an ECU that is awake already
+        if resp is None and i == 0 and not awake:
+            time.sleep(WAKE_UP_WAIT)
+            resp = __sr1(sock, p, 3, estimator)
+
+        if resp is None:
+            c.debug("No response to {}", service)
+            continue
+        c.debug("Got response, service {}", resp.service)
+
+        if is_uds_response(resp, p.service):
+            c.debug("Found UDS Socket")
+            if service == 'ecu_reset':
+                #give the ECU time to restart before the socket is used again, a restart is no round trip
+                time.sleep(RESTART_WAIT)
+            is_uds = True
+            break
+
+    if estimator is None:
+        return is_uds, None
+
+    stats = estimator.stats()
+    stats['timeout'] = estimator.timeout(1)
+    return is_uds, stats
@@ -14,7 +14,11 @@ module: isotp_scanner
 short_description: Scan for ISOTP Sockets on a bus and return findings.
 
 description:
-    - Uses scapy's ISOTPScan() to scan the connected CAN bus on a provided interface.
+    - Scans the connected CAN bus on the provided interfaces the same way as scapy's ISOTPScan().
+    - Every CAN-Identifier of the scan range is probed with an ISOTP first frame, ISOTP endpoints answer with a flow control frame.
+    - Alternatively a passive mode infers ISOTP endpoints from the traffic on the bus without sending any frame.
+    - Multiple interfaces are scanned concurrently in separate worker processes.
+    - The scan range of an interface can be split into shards that are probed by a pool of workers.
     - May take a lot of time depending on the scan range.
 
 seealso:
@@ -25,8 +29,38 @@ seealso:
 options:
     interface:
         description:
-            - This is the interface that is used for scanning.
+            - These are the interfaces that are used for scanning.
+            - Accepts a single interface or a list of interfaces.
+            - The special value C(all) scans all CAN interfaces of the host.
+            - Each interface is scanned in its own worker process, or in its own thread of the daemon with I(daemon), the results are merged into I(sockets).
         required: true
+        type: list
+        elements: str
+    mode:
+        description:
+            - C(active) probes the scan range.
+            - C(passive) only sniffs the bus and infers request/response CAN-Identifier pairs from ISOTP single, first, consecutive and flow control frames, e.g. of a tester that is connected to the vehicle.
+            - In passive mode only I(passive_time) and I(passive_frames) are used from the scan options.
+        type: str
+        choices: [ active, passive ]
+        default: active
+    passive_time:
+        description:
+            - Maximum time in seconds to sniff in passive mode.
+        type: float
+        default: 10
+    passive_frames:
+        description:
+            - Stop sniffing in passive mode after this many frames.
+            - C(0) means no limit.
+        type: int
+        default: 0
+    max_processes:
+        description:
+            - Maximum amount of interfaces that are scanned concurrently.
+            - C(0) scans all interfaces at once.
+        type: int
+        default: 0
     scan_range_start: 
         description:
             - A range of CAN-Identifiers is scanned.
@@ -39,8 +73,108 @@ options:
             - This option sets the ending ID.
         type: int
         default: 0x7ff
+    extended_can_id:
+        description:
+            - Scan 29 bit CAN-Identifiers instead of the 11 bit range set by I(scan_range_start) and I(scan_range_end).
+            - The 29 bit space can not be scanned completely, the sub-ranges in I(extended_ranges) are scanned in the given order.
+            - Probed and background CAN-Identifiers are tracked as intervals, so the memory usage stays bounded.
+        type: bool
+        default: no
+    extended_ranges:
+        description:
+            - Prioritized list of 29 bit sub-ranges that are scanned if I(extended_can_id) is set.
+            - Either a preset or a range C(start-end) with an inclusive end, e.g. C(0x18da00f1-0x18da10f1).
+            - C(normal_fixed_tester) and C(j1939_tester) are the physical request CAN-Identifiers 0x18DAxxF1 and 0x1CDAxxF1 of normal fixed addressing and J1939 with the usual tester address 0xF1.
+            - C(normal_fixed) and C(j1939) are the complete 0x18DAxxxx and 0x1CDAxxxx ranges, C(all) is the whole 29 bit space.
+            - CAN-Identifiers contained in an earlier range are not probed again.
+        type: list
+        elements: str
+        default: [ normal_fixed_tester, j1939_tester, normal_fixed, j1939 ]
+    probe_window:
+        description:
+            - Amount of CAN-Identifiers that are probed with a single burst of first frames.
+            - The flow control answers of a burst are collected with one receive loop, so a window without answers costs a single timeout instead of one timeout per CAN-Identifier.
+            - Answered bursts are split and probed again until every answer is matched to its CAN-Identifier.
+            - C(1) probes one CAN-Identifier after another and waits for each timeout.
+        type: int
+        default: 1
+    shard_size:
+        description:
+            - Splits the scan range of each interface into shards of this many CAN-Identifiers.
+            - The shards are probed concurrently by a pool of workers on the same interface and the results are merged and deduplicated.
+            - Shards that run at the same time are spread over the scan range.
+            - C(0) disables sharding.
+        type: int
+        default: 0
+    max_workers:
+        description:
+            - Maximum amount of concurrent workers per interface if I(shard_size) is set.
+            - The amount is reduced automatically if the background traffic on the bus is high, see I(max_frame_rate).
+        type: int
+        default: 4
+    max_frame_rate:
+        description:
+            - Bus load in frames per second that a sharded scan should not exceed.
+            - The background traffic is measured before probing, every worker adds about 10 frames per second and I(probe_window).
+        type: int
+        default: 1000
+    noise_listen_time:
+        description:
+            - Time in seconds to listen for background traffic before probing.
+            - CAN-Identifiers of the background traffic are not probed.
+        type: float
+        default: 5
+    noise_adaptive:
+        description:
+            - Stop listening for background traffic as soon as no new CAN-Identifiers appear for one second.
+            - I(noise_listen_time) is the upper limit.
+        type: bool
+        default: no
+    noise_cache_ttl:
+        description:
+            - Cache the background traffic profile (seen CAN-Identifiers, their periods and the capture time) per interface on disk.
+            - A cached profile younger than this many seconds is reused, only a short check for new CAN-Identifiers is done instead of listening.
+            - C(0) disables the cache.
+        type: int
+        default: 0
+    result_cache_ttl:
+        description:
+            - Cache the found sockets per interface, scan range and addressing options on disk.
+            - A cached result younger than this many seconds is returned instead of scanning again.
+            - C(0) disables the cache.
+        type: int
+        default: 0
+    result_cache_validate:
+        description:
+            - Probe the CAN-Identifiers of the cached sockets again and only return the cached result if all of them still answer.
+            - Otherwise the full range is scanned again.
+        type: bool
+        default: yes
+    cache_dir:
+        description:
+            - Directory of the cached background traffic profiles and scan results.
+            - Defaults to C(~/.cache/scable).
+        type: path
+        aliases: [ noise_cache_dir ]
+    checkpoint_file:
+        description:
+            - Records the progress of the scan (background traffic, probed CAN-Identifiers, found sockets) in this file.
+            - If the scan is interrupted, a rerun with the same parameters continues where it stopped.
+            - Sockets found before the interruption are probed again, the file is removed after the scan is complete.
+            - If multiple interfaces are scanned, the interface name is appended to the file name.
+        type: path
+    out_format:
+        description:
+            - Format of I(out_file).
+            - C(text) writes all found sockets after the scan is complete.
+            - C(jsonl) appends every found socket as a single JSON line as soon as it is confirmed, followed by a summary record C({"summary": {...}}) after the scan.
+            - With C(jsonl) the sockets found so far are kept if the scan is killed and other tools can follow the file while the scan is running.
+            - Sharded scans confirm their sockets after the shards of an interface are merged.
+        type: str
+        choices: [ text, jsonl ]
+        default: text
 
-extends_documentation_fragment: [ debug, out_file ]
+extends_documentation_fragment: [ debug, out_file, daemon, metrics ]
 
 requirements:
     - scapy    
@@ -59,11 +193,76 @@ EXAMPLES = '''
     interface: can1
     scan_range_end: 0xf
     out_file: /tmp/log.txt
+
+- name: Scan multiple buses concurrently
+  isotp_scanner:
+    interface: [ can0, can1, can2, can3 ]
+
+- name: Scan all CAN interfaces of the host
+  isotp_scanner:
+    interface: all
+
+- name: Full sweep with 8 workers on 64 ids each
+  isotp_scanner:
+    interface: can0
+    shard_size: 64
+    max_workers: 8
+
+- name: Find the endpoints a connected tester talks to, without sending a frame
+  isotp_scanner:
+    interface: can0
+    mode: passive
+    passive_time: 30
+
+- name: Scan the usual 29 bit diagnostic CAN-Identifiers
+  isotp_scanner:
+    interface: can0
+    extended_can_id: yes
+    probe_window: 64
+
+- name: Probe 32 CAN-Identifiers per burst
+  isotp_scanner:
+    interface: can0
+    probe_window: 32
+
+- name: Reuse the background traffic profile for an hour
+  isotp_scanner:
+    interface: can0
+    noise_adaptive: yes
+    noise_cache_ttl: 3600
+
+- name: Only rescan if the topology changed or the last scan is older than a day
+  isotp_scanner:
+    interface: can0
+    result_cache_ttl: 86400
+
+- name: Resumable scan
+  isotp_scanner:
+    interface: can0
+    checkpoint_file: /tmp/isotp_scan.checkpoint
+
+- name: Scan in the scan daemon, it keeps scapy loaded for the following tasks
+  isotp_scanner:
+    interface: can0
+    daemon: yes
+
+- name: Stream the found sockets, e.g. to 'tail -f' the file during a long scan
+  isotp_scanner:
+    interface: can0
+    out_file: /tmp/sockets.jsonl
+    out_format: jsonl
 '''
 
 RETURN = '''
+interfaces:
+    description: The scanned interfaces
+    type: list
+    elements: str
+    returned: always
 sockets:
-    description: A list of found sockets
+    description: 
+      - A list of found sockets.
+      - Grouped by interface in the order of I(interfaces).
     type: list
     elements: dict
     returned: always
@@ -89,21 +288,45 @@ sockets:
             type: str
             returned: on scan success
         padding:
-            description: padding
+            description:
+              - Whether the socket pads its CAN frames to 8 bytes.
+              - An active scan sets it if the flow control frame of the ECU is padded to 8 bytes.
+              - A passive scan sets it if all observed frames of the tester are 8 bytes long.
             type: bool
             returned: on scan success
         listen_only:
             description: listen_only
             type: bool
             returned: on scan success
+        extended_can_id:
+            description:
+              - The socket uses 29 bit CAN identifiers.
+              - Sockets with 29 bit identifiers up to 0x7ff need the option I(multiplexed_transport) of the UDS modules.
+            type: bool
+            returned: if I(extended_can_id) is set
         basecls:
             description: base class
             type: str
             returned: on scan success
-        
+ansible_facts:
+    description:
+      - I(scable_can) with the CAN capabilities of the host, the rtnetlink link info is cached until the next boot, a change of the kernel modules or a restart of an interface.
+      - Contains the loaded CAN kernel I(modules), the CAN I(interfaces) with state, up, mtu, fd, txqueuelen, kind, bitrate and data_bitrate and the I(isotp_transport) (native or soft).
+    type: dict
+    returned: on Linux
+metrics:
+    description:
+      - I(phases) with the seconds and calls of daemon_start, load_scapy, result_cache, noise, verify, probe, passive, serialize and output, the phases of concurrent workers are summed up.
+      - I(counters) of the sent and received CAN frames (can.sent and can.received) and of the reused noise profiles and scan results (cache.noise_hits and cache.result_hits).
+      - I(histograms) with the latencies of the flow control answers to the probes (isotp.probe) in seconds, the buckets are in milliseconds.
+      - The I(duration) of the module, the I(threads) and I(peak_threads) and the I(peak_rss_kb) of the module process and I(children_peak_rss_kb) of its worker processes.
+    type: dict
+    returned: if I(metrics=yes)
 '''
 import traceback 
 import json
+import os
+import time
 
 from ansible.module_utils.basic import AnsibleModule, missing_required_lib
 
@@ -119,16 +342,81 @@ except:
 #make the ansible module object global so that all functions can reach it
 module = None
 
+def checkpoint_path(checkpoint_file, interface, interface_count):
+    '''Returns the checkpoint file of an interface, every scanned interface needs its own file.'''
+    if not checkpoint_file or interface_count == 1:
+        return checkpoint_file
+
+    return "{}.{}".format(checkpoint_file, interface)
+
+def scan_interface(job):
+    '''
+        Scans a single interface and returns the serialized sockets.
+        Called in a worker process if multiple interfaces are scanned, in a thread with a daemon.
+    '''
+    passive = job.pop('passive', False)
+    daemon = job.pop('daemon', None)
+
+    if daemon:
+        #the daemon reports every socket as soon as it is confirmed, so on_found is called while it scans
+        on_found = job.pop('on_found', None)
+        if passive:
+            scapy_utils.debug("starting passive discovery on '{}' in the daemon", job['interface'])
+            return scapy_utils.daemon.request(daemon, 'passive_discover', progress=on_found, **job)
+
+        scapy_utils.debug("starting isotpscan on '{}' in the daemon", job['interface'])
+        job['ids'] = [[r.start, r.stop, r.step] for r in job['ids']]
+        return scapy_utils.daemon.request(daemon, 'isotp_scan', progress=on_found, **job)
+
+    if passive:
+        scapy_utils.debug("starting passive discovery on '{}'", job['interface'])
+        return scapy_utils.passive.discover(**job)
+
+    scapy_utils.debug("starting isotpscan on '{}'", job['interface'])
+    return scapy_utils.scan.scan(**job)
+
+def scan_interface_with_metrics(job):
+    '''
+        Scans a single interface in a worker process and returns the serialized sockets and the metrics of the worker.
+        The forked worker starts with a copy of the metrics of the module, they are dropped so they are not merged twice.
+    '''
+    scapy_utils.metrics.enable()
+    return scan_interface(job), scapy_utils.metrics.report()
+
 def run_module():
     global module
 
     # define available arguments/parameters a user can pass to the module
     module_args = dict(
-        interface=dict(type='str', required=True),
+        interface=dict(type='list', elements='str', required=True),
+        mode=dict(type='str', required=False, choices=['active', 'passive'], default='active'),
+        passive_time=dict(type='float', required=False, default=10),
+        passive_frames=dict(type='int', required=False, default=0),
+        max_processes=dict(type='int', required=False, default=0),
         scan_range_start=dict(type='int', required=False, default=0x0),
         scan_range_end=dict(type='int', required=False, default=0x7ff),
+        extended_can_id=dict(type='bool', required=False, default=False),
+        extended_ranges=dict(type='list', elements='str', required=False,
+                             default=['normal_fixed_tester', 'j1939_tester', 'normal_fixed', 'j1939']),
+        probe_window=dict(type='int', required=False, default=1),
+        shard_size=dict(type='int', required=False, default=0),
+        max_workers=dict(type='int', required=False, default=4),
+        max_frame_rate=dict(type='int', required=False, default=1000),
+        noise_listen_time=dict(type='float', required=False, default=5),
+        noise_adaptive=dict(type='bool', required=False, default=False),
+        noise_cache_ttl=dict(type='int', required=False, default=0),
+        result_cache_ttl=dict(type='int', required=False, default=0),
+        result_cache_validate=dict(type='bool', required=False, default=True),
+        cache_dir=dict(type='path', required=False, aliases=['noise_cache_dir']),
+        checkpoint_file=dict(type='path', required=False),
+        daemon=dict(type='bool', required=False, default=False),
+        daemon_socket=dict(type='path', required=False),
+        daemon_idle_timeout=dict(type='int', required=False, default=600),
         debug=dict(type='bool', required=False, default=False),
-        out_file=dict(type='str')
+        log_file=dict(type='path', required=False),
+        metrics=dict(type='bool', required=False, default=False),
+        out_file=dict(type='str'),
+        out_format=dict(type='str', required=False, choices=['text', 'jsonl'], default='text')
     )
 
     # seed the result dict in the object
@@ -138,6 +426,7 @@ def run_module():
     # for consumption, for example, in a subsequent task
     result = dict(
         changed=True,
+        interfaces=list(),
         sockets=list()
     )
 
@@ -153,11 +442,34 @@ def run_module():
     if not HAS_SCAPY:
         module.fail_json(msg=missing_required_lib("scapy"), exception=SCAPY_IMP_ERR)
 
-    interface = module.params['interface']
+    interfaces = module.params['interface']
+    max_processes = module.params['max_processes']
+    mode = module.params['mode']
+    passive_time = module.params['passive_time']
+    passive_frames = module.params['passive_frames']
     scan_range_start = module.params['scan_range_start']
     scan_range_end = module.params['scan_range_end']
+    extended_can_id = module.params['extended_can_id']
+    extended_ranges = module.params['extended_ranges']
+    probe_window = module.params['probe_window']
+    shard_size = module.params['shard_size']
+    max_workers = module.params['max_workers']
+    max_frame_rate = module.params['max_frame_rate']
+    noise_listen_time = module.params['noise_listen_time']
+    noise_adaptive = module.params['noise_adaptive']
+    noise_cache_ttl = module.params['noise_cache_ttl']
+    result_cache_ttl = module.params['result_cache_ttl']
+    result_cache_validate = module.params['result_cache_validate']
+    cache_dir = module.params.get('cache_dir')
+    checkpoint_file = module.params.get('checkpoint_file')
+    daemon = module.params['daemon']
+    daemon_socket = module.params.get('daemon_socket')
+    daemon_idle_timeout = module.params['daemon_idle_timeout']
     debug = module.params['debug']
+    log_file = module.params.get('log_file')
+    metrics = module.params['metrics']
     out_file = module.params.get('out_file')
+    out_format = module.params['out_format']
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -165,36 +477,134 @@ def run_module():
     if module.check_mode:
         module.exit_json(**result)
 
-    scapy_utils.init(ansible_module=module, debug=debug)
-
-    scapy_utils.debug("loading scapy")
-    scapy_utils.load_scapy(isotp=True)
-
-    scapy_utils.debug("starting isotpscan")
-    socks = ISOTPScan(
-        CANSocket(interface), 
-        range(scan_range_start, scan_range_end),
-        False,
-        noise_listen_time=5,
-        verbose=False,
-        can_interface=interface,
-        output_format='sockets'
-    )
-
-    result['sockets'] = scapy_utils.isotp.dump_socks(socks)
-
-    if out_file:
+    scapy_utils.init(ansible_module=module, debug=debug, log_file=log_file)
+
+    if metrics:
+        scapy_utils.metrics.enable()
+
+    if daemon:
+        #the daemon has scapy loaded and scans with its own sockets, so scapy is not needed in this process
+        daemon_socket = daemon_socket or scapy_utils.daemon.default_socket()
+        try:
+            with scapy_utils.metrics.phase('daemon_start'):
+                scapy_utils.daemon.start(daemon_socket, idle_timeout=daemon_idle_timeout)
+        except scapy_utils.daemon.DaemonError as e:
+            module.fail_json(msg=str(e), **result)
+
+        #the daemon runs in /
+        cache_dir = cache_dir and os.path.abspath(cache_dir)
+        checkpoint_file = checkpoint_file and os.path.abspath(checkpoint_file)
+    else:
+        daemon_socket = None
+
+        scapy_utils.debug("loading scapy")
+        with scapy_utils.metrics.phase('load_scapy'):
+            scapy_utils.load_scapy(isotp=True)
+
+    if 'all' in interfaces:
+        interfaces = scapy_utils.can_interfaces()
+        if not interfaces:
+            module.fail_json(msg="no CAN interfaces found on this host", **result)
+
+    #remove duplicates, but keep the order
+    interfaces = list(dict.fromkeys(interfaces))
+    result['interfaces'] = interfaces
+
+    if extended_can_id:
+        try:
+            scan_range = scapy_utils.scan.parse_ranges(extended_ranges)
+        except ValueError as e:
+            module.fail_json(msg=str(e), **result)
+    else:
+        scan_range = [range(scan_range_start, scan_range_end)]
+    if mode == 'passive':
+        jobs = [
+            dict(passive=True, interface=interface, listen_time=passive_time, max_frames=passive_frames)
+            for interface in interfaces
+        ]
+    else:
+        jobs = [
+            dict(
+                interface=interface,
+                ids=scan_range,
+                extended_can_id=extended_can_id,
+                noise_listen_time=noise_listen_time,
+                noise_adaptive=noise_adaptive,
+                noise_cache_ttl=noise_cache_ttl,
+                cache_dir=cache_dir,
+                result_cache_ttl=result_cache_ttl,
+                result_cache_validate=result_cache_validate,
+                probe_window=probe_window,
+                shard_size=shard_size,
+                max_workers=max_workers,
+                max_frame_rate=max_frame_rate,
+                checkpoint_file=checkpoint_path(checkpoint_file, interface, len(interfaces))
+            )
+            for interface in interfaces
+        ]
+
+    if daemon:
+        for job in jobs:
+            job['daemon'] = daemon_socket
+
+    writer = None
+    if out_file and out_format == 'jsonl':
+        #the forked workers inherit the file descriptor and append their sockets directly
+        writer = scapy_utils.JsonlWriter(out_file)
+        for job in jobs:
+            job['on_found'] = writer.write
+
+    start = time.time()
+
+    if len(jobs) == 1:
+        #no need to fork a worker for a single bus
+        found = [scan_interface(jobs[0])]
+    elif daemon:
+        #the daemon scans every bus in its own thread, the module only waits for the results
+        scapy_utils.debug("scanning {} interfaces concurrently in the daemon", len(jobs))
+        found = scapy_utils.parallel.run_threads(scan_interface, jobs, max_threads=max_processes)
+    else:
+        #the buses are independent, so scan each of them in its own process
+        scapy_utils.debug("scanning {} interfaces concurrently", len(jobs))
+        if metrics:
+            found = []
+            for socks, worker_metrics in scapy_utils.parallel.run_processes(scan_interface_with_metrics, jobs,
+                                                                            max_processes=max_processes):
+                scapy_utils.metrics.merge(worker_metrics)
+                found.append(socks)
+        else:
+            found = scapy_utils.parallel.run_processes(scan_interface, jobs, max_processes=max_processes)
+
+    for socks in found:
+        result['sockets'].extend(socks)
+
+    if writer:
+        writer.write({'summary': {
+            'module': 'isotp_scanner',
+            'mode': mode,
+            'interfaces': interfaces,
+            'sockets': len(result['sockets']),
+            'duration': round(time.time() - start, 3)
+        }})
+        writer.close()
+    elif out_file:
         #recursively create all needed directories
         dirname = os.path.dirname(out_file)
         if not os.path.exists(dirname):
             os.makedirs(dirname)
     
-        with scapy_utils.std_redirected(out_file):
+        with scapy_utils.metrics.phase('output'), scapy_utils.std_redirected(out_file):
             print("===============================================")
             print("MODULE: isotp_scanner")
             print("found ISOTP sockets:")
             print("{}".format(json.dumps(result['sockets'], indent=4)))
 
+    #the CAN capabilities of the host, e.g. to check the transport in later tasks
+    result['ansible_facts'] = scapy_utils.can_facts()
+
+    if metrics:
+        result['metrics'] = scapy_utils.metrics.report()
+
     module.exit_json(**result)
 
 def main():
@@ -14,6 +14,8 @@ load_contrib('cansocket')
 can_iface = 'vcan0'
 
 sock1 = ISOTPSocket(can_iface, sid=0x701, did=0x601, basecls=UDS)
+#ECU with 29 bit CAN identifiers
+sock2 = ISOTPSocket(can_iface, sid=0x18daf500, did=0x18da00f5, basecls=UDS)
 
 responseList = [ECUResponse(session=range(255), security_level=range(255), responses=UDS() / UDS_ERPR(resetType='hardReset')),
                 ECUResponse(session=range(255), security_level=range(255), responses=UDS() / UDS_DSCPR(diagnosticSessionType=0x01)),
@@ -21,7 +23,10 @@ responseList = [ECUResponse(session=range(255), security_level=range(255), respo
                 ]
 
 answering_machine1 = ECU_am(supported_responses=responseList, main_socket=sock1, basecls=UDS, timeout=None)
+answering_machine2 = ECU_am(supported_responses=responseList, main_socket=sock2, basecls=UDS, timeout=None)
 
 sim1 = threading.Thread(target=answering_machine1)
+sim2 = threading.Thread(target=answering_machine2)
 
-sim1.start()
\ No newline at end of file
+sim1.start()
+sim2.start()
\ No newline at end of file
@@ -2,6 +2,7 @@
 trap "kill 0" EXIT
 
 sudo ip link set down vcan0
+sudo ip link set down vcan1
 
 if [[ ! $(lsmod | grep vcan) ]]; then 
     sudo modprobe vcan
@@ -13,6 +14,9 @@ fi
 
 sudo ip link add dev vcan0 type vcan
 sudo ip link set up vcan0
+#a silent second bus for the scans of several interfaces
+sudo ip link add dev vcan1 type vcan
+sudo ip link set up vcan1
 
 python3 ecu_am.py &
 ansible-playbook testmod.yml
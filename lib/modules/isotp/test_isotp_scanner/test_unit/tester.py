@@ -0,0 +1,28 @@
+from scapy.all import *
+from scapy.layers.can import *
+import sys
+import time
+
+conf.contribs['ISOTP'] = {'use-can-isotp-kernel-module': True}
+conf.contribs['CANSocket'] = {'use-python-can': False}
+
+load_contrib('isotp')
+load_contrib('automotive.uds')
+load_contrib('cansocket')
+
+can_iface = 'vcan0'
+
+#talks to the simulated ECU of ecu_am.py for the given amount of seconds, like a tester connected to the vehicle
+duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+sock = ISOTPSocket(can_iface, sid=0x601, did=0x701, basecls=UDS)
+
+end = time.time() + duration
+while time.time() < end:
+    #a single frame request
+    sock.sr1(UDS() / UDS_DSC(diagnosticSessionType=0x01), timeout=1, verbose=False)
+    #a request with first and consecutive frames, the ECU answers with a flow control frame
+    sock.sr1(UDS() / UDS_RDBI(identifiers=list(range(0xf180, 0xf188))), timeout=1, verbose=False)
+    time.sleep(0.1)
+
+sock.close()
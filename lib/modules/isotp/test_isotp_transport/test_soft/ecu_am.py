@@ -0,0 +1,57 @@
+from scapy.all import *
+from scapy.layers.can import *
+import threading
+
+conf.contribs['ISOTP'] = {'use-can-isotp-kernel-module': False}
+conf.contribs['CANSocket'] = {'use-python-can': False}
+
+load_contrib('isotp')
+load_contrib('automotive.uds')
+load_contrib('cansocket')
+
+can_iface = 'vcan0'
+
+#simulated memory of the ECU, ReadMemoryByAddress reads it from address 0
+MEMORY = bytes(range(256)) * 4
+
+sock1 = ISOTPSocket(can_iface, sid=0x701, did=0x601, basecls=UDS)
+
+def answer(req):
+    '''Answers ReadMemoryByAddress with any address and size format and TesterPresent like an ECU.'''
+    raw = bytes(req)
+
+    if raw[0] == 0x3e:
+        return UDS(b'\x7e\x00')
+
+    if raw[0] != 0x23:
+        return UDS(bytes([0x7f, raw[0], 0x11]))
+
+    address_length = raw[1] & 0xf
+    size_length = raw[1] >> 4
+    address = int.from_bytes(raw[2:2 + address_length], 'big')
+    size = int.from_bytes(raw[2 + address_length:2 + address_length + size_length], 'big')
+    if address + size > len(MEMORY):
+        return UDS(b'\x7f\x23\x31')
+
+    return UDS(b'\x63' + MEMORY[address:address + size])
+
+def simulate():
+    while True:
+        req = sock1.recv()
+        if req is not None:
+            sock1.send(answer(req))
+
+#an ECU with 29 bit CAN identifiers below 0x800 that only answers TesterPresent in single frames
+raw_sock = CANSocket(can_iface)
+
+def simulate_extended():
+    while True:
+        pkt = raw_sock.recv()
+        if pkt is not None and pkt.flags.extended and pkt.identifier == 0x602 and bytes(pkt.data)[:3] == b'\x02\x3e\x00':
+            raw_sock.send(CAN(identifier=0x702, flags='extended', data=b'\x02\x7e\x00'))
+
+sim1 = threading.Thread(target=simulate)
+sim2 = threading.Thread(target=simulate_extended)
+
+sim1.start()
+sim2.start()
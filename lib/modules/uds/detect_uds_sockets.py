@@ -16,7 +16,9 @@ short_description: Iterate over a list of ISOTPSockets and detect whether the so
 description:
     - Iterates over a provided list of ISOTPSockets and sends UDS messages to detect whether the device behind the socket supports the UDS protocoll.
     - The sent UDS messages request the ECU Reset Service by default, which should be implemented by most ECUs.
-    - Listens for a positive response (request SID + 0x40) or a negative response (SID 0x7f).
+    - TesterPresent and DiagnosticSessionControl probes detect UDS without resetting the ECU.
+    - Listens for a positive response (request SID + 0x40) or a negative response (SID 0x7f) to the requested service.
+    - The sockets are probed concurrently, so the runtime depends on the slowest ECU and not on the amount of sockets.
 
 options:
     isotp_sockets:
@@ -31,17 +33,44 @@ options:
         description:
             - The UDS service to be requested from the ECU.
             - Default is SID 0x11 -> ECU Reset
+            - C(tester_present) sends TesterPresent (SID 0x3E) without the suppressPosRspMsgIndicationBit, so the ECU answers.
+            - C(diagnostic_session_control) requests the default session (SID 0x10, session 0x01).
+            - Only C(ecu_reset) restarts the ECU, the other probes skip the wait for the ECU restart and no power cycle is needed before M(uds_scanner).
         type: str
-        choices: ['ecu_reset']
+        choices: ['ecu_reset', 'tester_present', 'diagnostic_session_control']
         default: ecu_reset
+    probe_chain:
+        description:
+            - List of services that are requested one after another until the ECU answers one of them.
+            - Overrides I(service).
+            - The second try for sleeping ECUs is only done for the first service of the chain.
+        type: list
+        elements: str
+        choices: ['ecu_reset', 'tester_present', 'diagnostic_session_control']
     reset_type:
         description:
             - Needed if I(service=ecu_reset).
             - Reset type to be requested from the ECU.
         choices:['hard_reset', 'soft_reset']
         default: hard_reset
+    max_workers:
+        description:
+            - Maximum amount of sockets that are probed concurrently.
+            - Every socket is probed in its own thread, an ECU that does not answer is asked a second time after 3 seconds.
+            - C(0) probes all sockets at once.
+        type: int
+        default: 16
+    adaptive_timeout:
+        description:
+            - Measure the round trip time of each ECU with up to 5 TesterPresent requests before the I(probe_chain) and derive the timeouts of the probes from it instead of using fixed timeouts.
+            - The timeout is the 99th percentile of the round trip times doubled plus a margin, at least 0.05 seconds and never more than the fixed timeouts (1 second, 3 seconds for the second try).
+            - An ECU that answered all TesterPresent requests is awake, so the wait of 3 seconds for a sleeping ECU to wake up and the second try are skipped.
+            - The fixed timeouts and the wait are used for an ECU that did not answer them. The wait of 1 second for an ECU to restart after the I(probe_chain) C(ecu_reset) stays fixed.
+            - The round trip time statistics and the timeout of the probes of each socket are returned in I(rtt).
+        type: bool
+        default: no
 
-extends_documentation_fragment: [ debug, out_file ]
+extends_documentation_fragment: [ debug, out_file, daemon, metrics ]
 
 requirements:
     - scapy    
@@ -59,6 +88,27 @@ EXAMPLES = '''
     detect_uds_sockets:
       isotp_sockets: "{{ isotpsocks.sockets }}"
     register: udssocks
+- name: do not talk to more than 4 ECUs at a time
+    detect_uds_sockets:
+      isotp_sockets: "{{ isotpsocks.sockets }}"
+      max_workers: 4
+    register: udssocks
+- name: detect UDS without resetting the ECUs
+    detect_uds_sockets:
+      isotp_sockets: "{{ isotpsocks.sockets }}"
+      probe_chain: [ tester_present, diagnostic_session_control ]
+    register: udssocks
+- name: shorten the timeouts once the first ECUs answered
+    detect_uds_sockets:
+      isotp_sockets: "{{ isotpsocks.sockets }}"
+      max_workers: 4
+      adaptive_timeout: yes
+    register: udssocks
+- name: probe in the scan daemon, the sockets stay open for the following scans
+    detect_uds_sockets:
+      isotp_sockets: "{{ isotpsocks.sockets }}"
+      daemon: yes
+    register: udssocks
 '''
 
 RETURN = '''
@@ -100,11 +150,54 @@ sockets:
             description: base class
             type: str
             returned: on scan success
+rtt:
+    description: Round trip time statistics in seconds of the answered requests for each socket in the order of I(isotp_sockets)
+    type: list
+    elements: dict
+    returned: if I(adaptive_timeout=yes)
+    contains:
+        samples:
+            description: amount of measured round trip times
+            type: int
+        timeouts:
+            description: amount of requests without answer
+            type: int
+        min:
+            description: minimum round trip time
+            type: float
+        mean:
+            description: mean round trip time
+            type: float
+        p50:
+            description: median round trip time
+            type: float
+        p99:
+            description: 99th percentile of the round trip times
+            type: float
+        max:
+            description: maximum round trip time
+            type: float
+        timeout:
+            description: timeout of the probes in seconds, the fixed timeout of 1 second if too few round trip times were measured
+            type: float
+ansible_facts:
+    description:
+      - I(scable_can) with the CAN capabilities of the host, the rtnetlink link info is cached until the next boot, a change of the kernel modules or a restart of an interface.
+      - Contains the loaded CAN kernel I(modules), the CAN I(interfaces) with state, up, mtu, fd, txqueuelen, kind, bitrate and data_bitrate and the I(isotp_transport) (native or soft).
+    type: dict
+    returned: on Linux
+metrics:
+    description:
+      - I(phases) with the seconds and calls of daemon_start, load_scapy, load_socks, detect, rtt, serialize and output, the phases of concurrent workers are summed up.
+      - I(counters) of the sent and received UDS messages (uds.sent, uds.received) and of the requests without response (uds.timeouts).
+      - I(histograms) with the latencies of the probes (uds.probe) in seconds, the buckets are in milliseconds.
+      - The I(duration) of the module, the I(threads) and I(peak_threads) and the I(peak_rss_kb) of the module process and I(children_peak_rss_kb) of its worker processes.
+    type: dict
+    returned: if I(metrics=yes)
 '''
 
 import traceback 
 import json
-import time
 import os
 
 from ansible.module_utils.basic import AnsibleModule, missing_required_lib
@@ -117,13 +210,27 @@ except:
     HAS_SCAPY = False
     SCAPY_IMP_ERR = traceback.format_exc()
 
-def get_scapy_reset_type(reset_type):
-    scapy_reset_type = 'hardReset'
+def detect_uds(job):
+    '''
+        Sends the probes of the chain on a single socket until the ECU answers one of them.
+        Called concurrently for all sockets, so only the socket of the job must be used here.
 
-    if reset_type == 'soft_reset':
-        scapy_reset_type = 'softReset'
-    
-    return scapy_reset_type
+        job: dict with the socket (None with a daemon), the serialized socket (socket_dict), the probes,
+             the module options reset_type and adaptive_timeout and the socket path of the daemon (or None)
+
+        Returns a tuple (is_uds, rtt, socket) with True if the ECU answered with a UDS response,
+        the round trip time statistics of the ECU if adaptive_timeout is set (None otherwise)
+        and with a daemon the serialized UDS socket (None otherwise).
+    '''
+    if job['daemon']:
+        detected = scapy_utils.daemon.request(job['daemon'], 'uds_detect', socket_dict=job['socket_dict'],
+                                              probes=job['probes'], reset_type=job['reset_type'],
+                                              adaptive_timeout=job['adaptive_timeout'])
+        return detected['is_uds'], detected['rtt'], detected['socket']
+
+    is_uds, rtt = scapy_utils.uds.detect(job['sock'], job['probes'], reset_type=job['reset_type'],
+                                         adaptive_timeout=job['adaptive_timeout'])
+    return is_uds, rtt, None
 
 def run_module():
 
@@ -137,19 +244,63 @@ def run_module():
         'service': {
             'type': 'str', 
             'required': False, 
-            'choices': ['ecu_reset'], 
+            'choices': ['ecu_reset', 'tester_present', 'diagnostic_session_control'], 
             'default': 'ecu_reset'
         },
+        'probe_chain': {
+            'type': 'list',
+            'elements': 'str',
+            'required': False,
+            'choices': ['ecu_reset', 'tester_present', 'diagnostic_session_control']
+        },
         'reset_type': {
             'type': 'str', 
             'default': 'hard_reset',
             'choices': ['hard_reset', 'soft_reset']
         },
+        'max_workers': {
+            'type': 'int',
+            'required': False,
+            'default': 16
+        },
+        'adaptive_timeout': {
+            'type': 'bool',
+            'required': False,
+            'default': False
+        },
+        'daemon': {
+            'type': 'bool',
+            'required': False,
+            'default': False
+        },
+        'daemon_socket': {
+            'type': 'path',
+            'required': False
+        },
+        'daemon_idle_timeout': {
+            'type': 'int',
+            'required': False,
+            'default': 600
+        },
         'debug': {
             'type': 'bool',
             'required': False,
             'default': False
         },
+        'log_file': {
+            'type': 'path',
+            'required': False
+        },
+        'metrics': {
+            'type': 'bool',
+            'required': False,
+            'default': False
+        },
+        'multiplexed_transport': {
+            'type': 'bool',
+            'required': False,
+            'default': False
+        },
         'out_file': {
             'type': 'str'
         }
@@ -185,48 +336,81 @@ def run_module():
         module.exit_json(**result)
 
     isotp_sockets = module.params['isotp_sockets']
+    multiplexed_transport = module.params['multiplexed_transport']
     service = module.params['service']
+    probe_chain = module.params.get('probe_chain')
     reset_type = module.params['reset_type']
+    max_workers = module.params['max_workers']
+    adaptive_timeout = module.params['adaptive_timeout']
+    daemon = module.params['daemon']
+    daemon_socket = module.params.get('daemon_socket')
+    daemon_idle_timeout = module.params['daemon_idle_timeout']
     debug = module.params['debug']
+    log_file = module.params.get('log_file')
+    metrics = module.params['metrics']
     out_file = module.params.get('out_file')
 
-    scapy_utils.init(ansible_module=module, debug=debug)
-
-    #load scapy with isotp + uds features
-    scapy_utils.load_scapy(isotp=True, uds=True)
-
-    #deserialize sockets into real scapy objects
-    isotp_socks = scapy_utils.isotp.load_socks(isotp_sockets)
-    result_socks = []
-
-    scapy_utils.debug("Scapy sockets created: {}".format(isotp_socks))
-
-    if(service == 'ecu_reset'):
-        scapy_utils.debug("All isotp_socks: {}".format(isotp_socks))
-        for s in isotp_socks:
-            scapy_utils.debug("Socket: {}".format(vars(s)))
-
-            s.basecls = UDS
-            p = UDS()/UDS_ER(resetType=get_scapy_reset_type(reset_type))
-            scapy_utils.debug("Sending packet {}".format(p.command()))
-            resp = s.sr1(p, timeout=1, verbose=False)
-
-            #try second time, in case ECU was waken up by first message
-            if resp is None:
-                time.sleep(3)
-                resp = s.sr1(p, timeout=3, verbose=False)
-
-            if resp is None:
-                scapy_utils.debug("No response")
-                continue
-            scapy_utils.debug("Got response, service {}".format(resp.service))
-            #SID of ECU_RESET is 0x11 -> answer is 0x51 or a negative response
-            if resp.service in [0x51, 0x7f]:
-                scapy_utils.debug("Found UDS Socket")
-                time.sleep(1)
-                result_socks.append(s)
-
-    result['sockets'] = scapy_utils.isotp.dump_socks(result_socks)
+    scapy_utils.init(ansible_module=module, debug=debug, log_file=log_file)
+
+    if metrics:
+        scapy_utils.metrics.enable()
+
+    if daemon:
+        #the daemon has scapy loaded, holds the sockets and returns the serialized UDS sockets
+        daemon_socket = daemon_socket or scapy_utils.daemon.default_socket()
+        try:
+            with scapy_utils.metrics.phase('daemon_start'):
+                scapy_utils.daemon.start(daemon_socket, idle_timeout=daemon_idle_timeout)
+        except scapy_utils.daemon.DaemonError as e:
+            module.fail_json(msg=str(e))
+        isotp_socks = [None] * len(isotp_sockets)
+    else:
+        daemon_socket = None
+
+        #load scapy with isotp + uds features
+        with scapy_utils.metrics.phase('load_scapy'):
+            scapy_utils.load_scapy(isotp=True, uds=True)
+
+        #deserialize sockets into real scapy objects
+        #load_socks() modifies the dicts, the originals are sent to the daemon
+        with scapy_utils.metrics.phase('load_socks'):
+            isotp_socks = scapy_utils.isotp.load_socks([dict(s) for s in isotp_sockets],
+                                                       multiplexed=multiplexed_transport)
+
+        scapy_utils.debug("Scapy sockets created: {}", isotp_socks)
+
+    probes = probe_chain or [service]
+    scapy_utils.debug("All isotp_socks: {}, probes: {}", isotp_socks, probes)
+
+    jobs = [
+        dict(
+            sock=sock,
+            socket_dict=isotp_sockets[i],
+            probes=probes,
+            reset_type=reset_type,
+            adaptive_timeout=adaptive_timeout,
+            daemon=daemon_socket
+        )
+        for i, sock in enumerate(isotp_socks)
+    ]
+    #every socket talks to another ECU, so the timeouts and retries of all sockets can overlap
+    with scapy_utils.metrics.phase('detect'):
+        detected = scapy_utils.parallel.run_threads(detect_uds, jobs, max_threads=max_workers)
+
+    if adaptive_timeout:
+        result['rtt'] = [rtt for _, rtt, _ in detected]
+        scapy_utils.debug("round trip times: {}", result['rtt'])
+
+    if daemon:
+        result['sockets'] = [sock for is_uds, _, sock in detected if is_uds]
+    else:
+        result_socks = [s for s, (is_uds, _, _) in zip(isotp_socks, detected) if is_uds]
+
+        with scapy_utils.metrics.phase('serialize'):
+            result['sockets'] = scapy_utils.isotp.dump_socks(result_socks)
+
+        #the receiver thread of the multiplexed transport stops with the last socket
+        scapy_utils.isotp.close_socks(isotp_socks)
 
     if out_file:
         #recursively create all needed directories
@@ -234,12 +418,18 @@ def run_module():
         if not os.path.exists(dirname):
             os.makedirs(dirname)
     
-        with scapy_utils.std_redirected(out_file):
+        with scapy_utils.metrics.phase('output'), scapy_utils.std_redirected(out_file):
             print("===============================================")
             print("MODULE: detect_uds_sockets")
             print("found UDS sockets:")
             print("{}".format(json.dumps(result['sockets'], indent=4)))
 
+    #the CAN capabilities of the host, e.g. to check the transport in later tasks
+    result['ansible_facts'] = scapy_utils.can_facts()
+
+    if metrics:
+        result['metrics'] = scapy_utils.metrics.report()
+
     module.exit_json(**result)
 
 def main():
@@ -0,0 +1,412 @@
+#!/usr/bin/python
+
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: did_scanner
+
+short_description: Scans for readable data identifiers (DIDs) of UDS ECUs.
+
+description:
+    - Uses the provided sockets for the underlying ISOTP communication, e.g. the output of detect_uds_sockets.
+    - Reads all data identifiers of a range with the UDS service ReadDataByIdentifier (0x22) in the default session.
+    - Several DIDs are requested at once, the batch size adapts to the ECU.
+    - The length of the data of a DID is learned from its first response, a response with several DIDs is parsed with the known lengths.
+    - If a response with several DIDs is ambiguous, the first DID with an unknown length is read on its own to learn its length.
+    - A batch is split if the response is too long (0x14), stays ambiguous or is another negative response.
+    - If the ECU does not accept several DIDs in one request (0x13 or no response), the DIDs are requested one at a time.
+
+options:
+    did_start:
+        description:
+            - First data identifier to read.
+        type: int
+        default: 0
+
+    did_end:
+        description:
+            - Last data identifier to read.
+        type: int
+        default: 0xffff
+
+    batch_size:
+        description:
+            - Amount of DIDs in the first request.
+            - The batch size is doubled after every complete response up to I(max_batch_size) and halved if a batch is split.
+        type: int
+        default: 8
+
+    max_batch_size:
+        description:
+            - Maximum amount of DIDs in one request.
+            - C(1) requests every DID on its own.
+        type: int
+        default: 32
+
+    split_out_of_range:
+        description:
+            - Split batches that are answered with requestOutOfRange (0x31).
+            - By default 0x31 means that none of the DIDs of a batch is supported.
+            - Some ECUs answer 0x31 if any of the DIDs is not supported, set this option for them.
+        type: bool
+        default: no
+
+    timeout:
+        description:
+            - Seconds to wait for the response to a request.
+            - A responsePending (0x78) extends the wait to 5 seconds.
+        type: float
+        default: 0.5
+
+    max_workers:
+        description:
+            - Maximum amount of ECUs that are scanned concurrently.
+            - C(0) scans all ECUs at once.
+        type: int
+        default: 8
+
+extends_documentation_fragment: [ isotp_sockets, debug, out_file, daemon, metrics ]
+
+seealso:
+    - name: Unified Diagnostic Services
+      description: Reference of the UDS protocol
+      link: https://en.wikipedia.org/wiki/Unified_Diagnostic_Services
+
+author:
+    - Johannes Stark (@Feromrk)
+'''
+
+EXAMPLES = '''
+- name: read all DIDs
+  did_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+
+- name: read the identification DIDs of ISO 14229 one at a time
+  did_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+    did_start: 0xf180
+    did_end: 0xf19f
+    max_batch_size: 1
+
+- name: read the DIDs in the scan daemon, following tasks reuse its sockets
+  did_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+    daemon: yes
+
+- name: ECU that answers requestOutOfRange if any DID of a request is not supported
+  did_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+    split_out_of_range: yes
+    out_file: /tmp/did_scan.txt
+'''
+
+RETURN = '''
+changed:
+    description:
+      - Indicates whether the target state was changed.
+      - Reading data identifiers does not change the ECU state, so this is always false.
+    type: bool
+    returned: always
+found_dids:
+    description:
+      - Amount of found DIDs of all ECUs.
+    type: int
+    returned: always
+ecus:
+    description:
+      - Scan result of each socket in the order of I(isotp_sockets).
+    type: list
+    elements: dict
+    returned: always
+    contains:
+        socket:
+            description: the serialized socket
+            type: dict
+        dids:
+            description: the found DIDs as dicts with the I(did) and its I(data) as hex string
+            type: list
+            elements: dict
+        negative:
+            description:
+              - DIDs that were answered with a negative response other than requestOutOfRange, e.g. securityAccessDenied (0x33).
+              - Dicts with the I(did) and the negative response code I(nrc).
+            type: list
+            elements: dict
+        requests:
+            description: amount of requests sent to this ECU
+            type: int
+ansible_facts:
+    description:
+      - I(scable_can) with the CAN capabilities of the host, the rtnetlink link info is cached until the next boot, a change of the kernel modules or a restart of an interface.
+      - Contains the loaded CAN kernel I(modules), the CAN I(interfaces) with state, up, mtu, fd, txqueuelen, kind, bitrate and data_bitrate and the I(isotp_transport) (native or soft).
+    type: dict
+    returned: on Linux
+metrics:
+    description:
+      - I(phases) with the seconds and calls of daemon_start, load_scapy, load_socks and one phase C(ecu <ecu key>) per ECU, the phases of concurrent workers are summed up.
+      - I(counters) of the sent and received UDS messages (uds.sent, uds.received) and of the requests without response (uds.timeouts).
+      - I(histograms) with the latencies of the ReadDataByIdentifier requests (uds.rdbi) in seconds, the buckets are in milliseconds.
+      - The I(duration) of the module, the I(threads) and I(peak_threads) and the I(peak_rss_kb) of the module process and I(children_peak_rss_kb) of its worker processes.
+    type: dict
+    returned: if I(metrics=yes)
+'''
+import traceback
+import os
+import json
+import contextlib
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+
+try:
+    import ansible.module_utils.scapy as scapy_utils
+    HAS_SCAPY = True
+except:
+    HAS_SCAPY = False
+    SCAPY_IMP_ERR = traceback.format_exc()
+
+#make the single ansible module object global so that all functions can reach it
+module = None
+
+def scan_ecu(job):
+    '''
+        Reads the DIDs of one ECU, runs in a worker thread.
+
+        job: dict with the socket (None with a daemon), the serialized socket (socket_dict), the first and last DID
+             (did_start, did_end), the options of the DidScanner, the socket path of the daemon (or None) and dump
+        Returns the result of the ECU and its output for out_file if dump is set.
+    '''
+    socket_dict = job['socket_dict']
+
+    scapy_utils.debug("Starting DID scan on {}", socket_dict)
+    #the ECUs are scanned concurrently, the time of every ECU is reported as its own phase
+    with scapy_utils.metrics.phase("ecu {}".format(scapy_utils.resultdb.ecu_key(socket_dict))):
+        if job['daemon']:
+            ecu = scapy_utils.daemon.request(job['daemon'], 'did_scan', socket_dict=socket_dict,
+                                             did_start=job['did_start'], did_end=job['did_end'], **job['options'])
+        else:
+            scanner = scapy_utils.did.DidScanner(job['sock'], **job['options'])
+            ecu = scanner.scan(range(job['did_start'], job['did_end'] + 1))
+    ecu['socket'] = socket_dict
+
+    text = []
+    if job['dump']:
+        text.append("------------------------------------------------------")
+        text.append("Scanning on ISOTP socket:\n {}".format(json.dumps(socket_dict, indent=4)))
+        text.append("DID_SCAN_RESULTS ({} requests)".format(ecu['requests']))
+        for entry in ecu['dids']:
+            text.append("{:#06x}: {}".format(entry['did'], entry['data']))
+        for entry in ecu['negative']:
+            text.append("{:#06x}: negative response {:#04x}".format(entry['did'], entry['nrc']))
+
+    return ecu, "".join(line + "\n" for line in text)
+
+def run_module():
+    global module
+
+    module_args = {
+        'did_start': {
+            'type': 'int',
+            'default': 0
+        },
+        'did_end': {
+            'type': 'int',
+            'default': 0xffff
+        },
+        'batch_size': {
+            'type': 'int',
+            'default': 8
+        },
+        'max_batch_size': {
+            'type': 'int',
+            'default': 32
+        },
+        'split_out_of_range': {
+            'type': 'bool',
+            'default': False
+        },
+        'timeout': {
+            'type': 'float',
+            'default': 0.5
+        },
+        'max_workers': {
+            'type': 'int',
+            'default': 8
+        },
+        'daemon': {
+            'type': 'bool',
+            'default': False
+        },
+        'daemon_socket': {
+            'type': 'path'
+        },
+        'daemon_idle_timeout': {
+            'type': 'int',
+            'default': 600
+        },
+        'isotp_sockets': {
+            'type': 'list',
+            'elements': 'dict',
+            'required': True
+        },
+        'debug': {
+            'type': 'bool',
+            'default': False
+        },
+        'log_file': {
+            'type': 'path'
+        },
+        'metrics': {
+            'type': 'bool',
+            'default': False
+        },
+        'multiplexed_transport': {
+            'type': 'bool',
+            'default': False
+        },
+        'out_file': {
+            'type': 'str'
+        }
+    }
+
+    result = {
+        'changed': False,
+        'found_dids': 0,
+        'ecus': []
+    }
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    did_start = module.params['did_start']
+    did_end = module.params['did_end']
+    batch_size = module.params['batch_size']
+    max_batch_size = module.params['max_batch_size']
+    split_out_of_range = module.params['split_out_of_range']
+    timeout = module.params['timeout']
+    max_workers = module.params['max_workers']
+    daemon = module.params['daemon']
+    daemon_socket = module.params.get('daemon_socket')
+    daemon_idle_timeout = module.params['daemon_idle_timeout']
+    isotp_sockets = module.params['isotp_sockets']
+    multiplexed_transport = module.params['multiplexed_transport']
+    debug = module.params['debug']
+    log_file = module.params.get('log_file')
+    metrics = module.params['metrics']
+    out_file = module.params.get('out_file')
+
+    #check if all dependencies are there
+    if not HAS_SCAPY:
+        module.fail_json(msg=missing_required_lib("scapy"), exception=SCAPY_IMP_ERR)
+
+    if not 0 <= did_start <= did_end <= 0xffff:
+        module.fail_json(msg="the DIDs must be in the range 0 <= did_start <= did_end <= 0xffff")
+
+    if not 1 <= batch_size <= max_batch_size:
+        module.fail_json(msg="the batch sizes must be in the range 1 <= batch_size <= max_batch_size")
+
+    if module.check_mode:
+        module.exit_json(**result)
+
+    scapy_utils.init(ansible_module=module, debug=debug, log_file=log_file)
+
+    if metrics:
+        scapy_utils.metrics.enable()
+
+    if daemon:
+        #the daemon has scapy loaded and holds the sockets, so neither is needed in this process
+        daemon_socket = daemon_socket or scapy_utils.daemon.default_socket()
+        try:
+            with scapy_utils.metrics.phase('daemon_start'):
+                scapy_utils.daemon.start(daemon_socket, idle_timeout=daemon_idle_timeout)
+        except scapy_utils.daemon.DaemonError as e:
+            module.fail_json(msg=str(e))
+        isotp_sockets_objects = [None] * len(isotp_sockets)
+    else:
+        daemon_socket = None
+
+        #load scapy with isotp + uds features
+        with scapy_utils.metrics.phase('load_scapy'):
+            scapy_utils.load_scapy(isotp=True, uds=True)
+
+        #deserialize sockets into real scapy objects
+        #load_socks() modifies the dicts, the originals are returned in the ecus section
+        with scapy_utils.metrics.phase('load_socks'):
+            isotp_sockets_objects = scapy_utils.isotp.load_socks([dict(s) for s in isotp_sockets],
+                                                                 multiplexed=multiplexed_transport)
+
+    if out_file:
+        #recursively create all needed directories
+        dirname = os.path.dirname(out_file)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+    try:
+        #redirect stdout/stderr if we are going to write to it
+        with scapy_utils.std_redirected(out_file) if out_file else contextlib.nullcontext():
+
+            if out_file:
+                print("===============================================")
+                print("MODULE: did_scanner\n")
+
+            jobs = [
+                dict(
+                    sock=sock,
+                    socket_dict=isotp_sockets[i],
+                    did_start=did_start,
+                    did_end=did_end,
+                    options=dict(
+                        batch_size=batch_size,
+                        max_batch_size=max_batch_size,
+                        timeout=timeout,
+                        split_out_of_range=split_out_of_range
+                    ),
+                    daemon=daemon_socket,
+                    dump=bool(out_file)
+                )
+                for i, sock in enumerate(isotp_sockets_objects)
+            ]
+            #the ECUs are independent targets, so they are scanned concurrently
+            ecus = scapy_utils.parallel.run_threads(scan_ecu, jobs, max_threads=max_workers)
+
+            for ecu, text in ecus:
+                result['found_dids'] += len(ecu['dids'])
+                result['ecus'].append(ecu)
+
+                #the output of each ECU is buffered, so the sections are not interleaved
+                if out_file:
+                    print(text, end='')
+    except IOError:
+        module.fail_json(msg="could not write to out_file", exception=traceback.format_exc())
+
+    #the receiver thread of the multiplexed transport stops with the last socket
+    scapy_utils.isotp.close_socks(isotp_sockets_objects)
+
+    #the CAN capabilities of the host, e.g. to check the transport in later tasks
+    result['ansible_facts'] = scapy_utils.can_facts()
+
+    if metrics:
+        result['metrics'] = scapy_utils.metrics.report()
+
+    module.exit_json(**result)
+
+def main():
+    try:
+        run_module()
+    #do not catch normal SystemExit from module.exit_json()
+    except SystemExit as e:
+        if e.code == 0:
+            raise e
+    except:
+        module.fail_json(msg="unhandled exception", exception=traceback.format_exc())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+#!/usr/bin/python
+
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: memory_dump
+
+short_description: Reads a memory range of an ECU into a file.
+
+description:
+    - Uses the provided socket for the underlying ISOTP communication, e.g. one of the sockets of detect_uds_sockets.
+    - Reads the memory with ReadMemoryByAddress (0x23) or with RequestUpload (0x35), TransferData (0x36) and RequestTransferExit (0x37).
+    - Only use it on ECUs you are allowed to read, e.g. bench ECUs.
+    - The ECU must already be in a session that allows the service, e.g. after a DiagnosticSessionControl and a SecurityAccess.
+    - Every block is written to I(dump_file) as soon as it is received, so the memory is never held as a whole.
+    - A failed dump can be resumed at the first address that is not in I(dump_file) yet.
+
+options:
+    address:
+        description:
+            - Start address of the memory range.
+        type: int
+        required: true
+
+    size:
+        description:
+            - Amount of bytes to read.
+        type: int
+        required: true
+
+    method:
+        description:
+            - C(rmba) reads with ReadMemoryByAddress, the block size is negotiated with the ECU.
+            - C(upload) reads with RequestUpload and TransferData, the ECU chooses the block size (maxNumberOfBlockLength).
+        type: str
+        choices: [ rmba, upload ]
+        default: rmba
+
+    block_size:
+        description:
+            - Maximum bytes per ReadMemoryByAddress request, at most 4094.
+            - The first block is requested with this size and halved until the ECU answers, the answered size is used for all blocks.
+            - Ignored for I(method=upload).
+        type: int
+        default: 4094
+
+    address_length:
+        description:
+            - Bytes of the memory address in the requests.
+        type: int
+        default: 4
+
+    size_length:
+        description:
+            - Bytes of the memory size in the requests.
+        type: int
+        default: 4
+
+    data_format:
+        description:
+            - dataFormatIdentifier of RequestUpload, C(0) requests the memory without compression and encryption.
+        type: int
+        default: 0
+
+    timeout:
+        description:
+            - Seconds to wait for the response to a request.
+            - A responsePending (0x78) extends the wait to 5 seconds.
+        type: float
+        default: 1
+
+    dump_file:
+        description:
+            - File the memory is written to.
+            - The address and size of an unfinished dump are stored next to it in I(dump_file).progress.
+        type: path
+        required: true
+
+    resume:
+        description:
+            - Continue an unfinished dump of the same range in I(dump_file) at the first missing address.
+            - C(no) or a dump of another range overwrites I(dump_file).
+        type: bool
+        default: yes
+
+extends_documentation_fragment: [ isotp_socket, debug, metrics ]
+
+seealso:
+    - name: Unified Diagnostic Services
+      description: Reference of the UDS protocol
+      link: https://en.wikipedia.org/wiki/Unified_Diagnostic_Services
+
+author:
+    - Johannes Stark (@Feromrk)
+'''
+
+EXAMPLES = '''
+- name: read 1 MiB of flash with ReadMemoryByAddress
+  memory_dump:
+    isotp_socket: {{ udssocks.sockets[0] }}
+    address: 0x80000000
+    size: 0x100000
+    dump_file: /tmp/ecu_flash.bin
+
+- name: read with RequestUpload and 3 byte addresses, rerun to resume
+  memory_dump:
+    isotp_socket: {{ udssocks.sockets[0] }}
+    method: upload
+    address: 0x010000
+    size: 0x40000
+    address_length: 3
+    size_length: 3
+    dump_file: /tmp/ecu_upload.bin
+  register: dump
+  until: dump is succeeded
+  retries: 3
+'''
+
+RETURN = '''
+changed:
+    description:
+      - Indicates whether I(dump_file) was changed.
+    type: bool
+    returned: always
+dump_file:
+    description: Path of the dump
+    type: str
+    returned: always
+block_size:
+    description: Bytes per block that were negotiated with the ECU
+    type: int
+    returned: if a block was read
+requests:
+    description: Amount of requests sent to the ECU
+    type: int
+    returned: always
+resumed_at:
+    description: Address the dump was resumed at, null if it started at I(address)
+    type: int
+    returned: always
+bytes_read:
+    description: Bytes read in this run
+    type: int
+    returned: always
+duration:
+    description: Duration of the dump in seconds
+    type: float
+    returned: always
+rate:
+    description: Bytes read per second
+    type: float
+    returned: always
+ansible_facts:
+    description:
+      - I(scable_can) with the CAN capabilities of the host, the rtnetlink link info is cached until the next boot, a change of the kernel modules or a restart of an interface.
+      - Contains the loaded CAN kernel I(modules), the CAN I(interfaces) with state, up, mtu, fd, txqueuelen, kind, bitrate and data_bitrate and the I(isotp_transport) (native or soft).
+    type: dict
+    returned: on Linux
+metrics:
+    description:
+      - I(phases) with the seconds and calls of load_scapy, load_socks and dump, the phases of concurrent workers are summed up.
+      - I(counters) of the sent and received UDS messages (uds.sent, uds.received) and of the requests without response (uds.timeouts).
+      - I(histograms) with the latencies of the memory requests (uds.memory) in seconds, the buckets are in milliseconds.
+      - The I(duration) of the module, the I(threads) and I(peak_threads) and the I(peak_rss_kb) of the module process and I(children_peak_rss_kb) of its worker processes.
+    type: dict
+    returned: if I(metrics=yes)
+'''
+import traceback
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+
+try:
+    import ansible.module_utils.scapy as scapy_utils
+    from ansible.module_utils.scapy.errors import TransmissionError, NegativeResponseError
+    HAS_SCAPY = True
+except:
+    HAS_SCAPY = False
+    SCAPY_IMP_ERR = traceback.format_exc()
+
+#make the single ansible module object global so that all functions can reach it
+module = None
+
+def run_module():
+    global module
+
+    module_args = {
+        'address': {
+            'type': 'int',
+            'required': True
+        },
+        'size': {
+            'type': 'int',
+            'required': True
+        },
+        'method': {
+            'type': 'str',
+            'choices': ['rmba', 'upload'],
+            'default': 'rmba'
+        },
+        'block_size': {
+            'type': 'int',
+            'default': 4094
+        },
+        'address_length': {
+            'type': 'int',
+            'default': 4
+        },
+        'size_length': {
+            'type': 'int',
+            'default': 4
+        },
+        'data_format': {
+            'type': 'int',
+            'default': 0
+        },
+        'timeout': {
+            'type': 'float',
+            'default': 1
+        },
+        'dump_file': {
+            'type': 'path',
+            'required': True
+        },
+        'resume': {
+            'type': 'bool',
+            'default': True
+        },
+        'isotp_socket': {
+            'type': 'dict',
+            'required': True
+        },
+        'debug': {
+            'type': 'bool',
+            'default': False
+        },
+        'log_file': {
+            'type': 'path'
+        },
+        'metrics': {
+            'type': 'bool',
+            'default': False
+        },
+        'multiplexed_transport': {
+            'type': 'bool',
+            'default': False
+        }
+    }
+
+    result = {
+        'changed': False,
+        'dump_file': None,
+        'requests': 0,
+        'resumed_at': None,
+        'bytes_read': 0,
+        'duration': 0,
+        'rate': 0
+    }
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    address = module.params['address']
+    size = module.params['size']
+    method = module.params['method']
+    block_size = module.params['block_size']
+    address_length = module.params['address_length']
+    size_length = module.params['size_length']
+    data_format = module.params['data_format']
+    timeout = module.params['timeout']
+    dump_file = module.params['dump_file']
+    resume = module.params['resume']
+    isotp_socket = module.params['isotp_socket']
+    multiplexed_transport = module.params['multiplexed_transport']
+    debug = module.params['debug']
+    log_file = module.params.get('log_file')
+    metrics = module.params['metrics']
+
+    result['dump_file'] = dump_file
+
+    #check if all dependencies are there
+    if not HAS_SCAPY:
+        module.fail_json(msg=missing_required_lib("scapy"), exception=SCAPY_IMP_ERR)
+
+    if address < 0 or size < 1:
+        module.fail_json(msg="address must not be negative and size must be positive")
+
+    if not 1 <= block_size <= scapy_utils.memory.MAX_RMBA_BLOCK:
+        module.fail_json(msg="block_size must be in the range 1 to {}".format(scapy_utils.memory.MAX_RMBA_BLOCK))
+
+    if not (1 <= address_length <= 15 and 1 <= size_length <= 15):
+        module.fail_json(msg="address_length and size_length must be in the range 1 to 15")
+
+    if module.check_mode:
+        module.exit_json(**result)
+
+    scapy_utils.init(ansible_module=module, debug=debug, log_file=log_file)
+
+    if metrics:
+        scapy_utils.metrics.enable()
+
+    #load scapy with isotp + uds features
+    with scapy_utils.metrics.phase('load_scapy'):
+        scapy_utils.load_scapy(isotp=True, uds=True)
+
+    #deserialize the socket into a real scapy object
+    with scapy_utils.metrics.phase('load_socks'):
+        sock = scapy_utils.isotp.load_socks([dict(isotp_socket)], multiplexed=multiplexed_transport)[0]
+
+    if method == 'rmba':
+        reader = scapy_utils.memory.RmbaReader(sock, block_size=block_size, address_length=address_length,
+                                               size_length=size_length, timeout=timeout)
+    else:
+        reader = scapy_utils.memory.UploadReader(sock, data_format=data_format, address_length=address_length,
+                                                 size_length=size_length, timeout=timeout)
+
+    scapy_utils.debug("dumping {} bytes at {:#x} with {} on {}", size, address, method, isotp_socket)
+
+    try:
+        with scapy_utils.metrics.phase('dump'):
+            result.update(scapy_utils.memory.dump_memory(reader, dump_file, address, size, resume=resume))
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+    except (TransmissionError, NegativeResponseError) as e:
+        #the blocks read so far are in dump_file, a rerun resumes after them
+        module.fail_json(msg="dump failed: {}".format(e), requests=reader.requests, dump_file=dump_file)
+    except (IOError, OSError):
+        module.fail_json(msg="could not write to dump_file", exception=traceback.format_exc())
+    finally:
+        #the receiver thread of the multiplexed transport stops with the last socket
+        scapy_utils.isotp.close_socks([sock])
+
+    result['changed'] = result['bytes_read'] > 0
+    result['requests'] = reader.requests
+    if reader.block_size:
+        result['block_size'] = reader.block_size
+    if result['duration'] > 0:
+        result['rate'] = result['bytes_read'] / result['duration']
+
+    #the CAN capabilities of the host, e.g. to check the transport in later tasks
+    result['ansible_facts'] = scapy_utils.can_facts()
+
+    if metrics:
+        result['metrics'] = scapy_utils.metrics.report()
+
+    module.exit_json(**result)
+
+def main():
+    try:
+        run_module()
+    #do not catch normal SystemExit from module.exit_json()
+    except SystemExit as e:
+        if e.code == 0:
+            raise e
+    except:
+        module.fail_json(msg="unhandled exception", exception=traceback.format_exc())
+
+
+if __name__ == '__main__':
+    main()
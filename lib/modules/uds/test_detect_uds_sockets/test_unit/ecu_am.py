@@ -18,6 +18,7 @@ sock1 = ISOTPSocket(can_iface, sid=0x701, did=0x601, basecls=UDS)
 responseList = [ECUResponse(session=range(255), security_level=range(255), responses=UDS() / UDS_ERPR(resetType='hardReset')),
                 ECUResponse(session=range(255), security_level=range(255), responses=UDS() / UDS_DSCPR(diagnosticSessionType=0x01)),
                 ECUResponse(session=range(255), security_level=range(255), responses=UDS() / UDS_DSCPR(diagnosticSessionType=0x02)),
+                ECUResponse(session=range(255), security_level=range(255), responses=UDS() / UDS_TPPR()),
                 ]
 
 answering_machine1 = ECU_am(supported_responses=responseList, main_socket=sock1, basecls=UDS, timeout=None)
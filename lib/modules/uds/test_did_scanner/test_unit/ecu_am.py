@@ -0,0 +1,49 @@
+from scapy.all import *
+from scapy.layers.can import *
+import threading
+import struct
+
+conf.contribs['ISOTP'] = {'use-can-isotp-kernel-module': True}
+conf.contribs['CANSocket'] = {'use-python-can': False}
+
+load_contrib('isotp')
+load_contrib('automotive.uds')
+load_contrib('cansocket')
+
+can_iface = 'vcan0'
+
+#readable DIDs of the simulated ECU
+DIDS = {
+    0x0100: b'\x01',
+    0x0102: b'\x01\x02',
+    0xf190: b'WVWZZZ1JZXW000001',
+    0xf18c: b'0815'
+}
+
+sock1 = ISOTPSocket(can_iface, sid=0x701, did=0x601, basecls=UDS)
+
+def answer(req):
+    '''Answers ReadDataByIdentifier requests with one or several DIDs like an ECU.'''
+    if req.service != 0x22:
+        return UDS() / UDS_NR(requestServiceId=req.service, negativeResponseCode=0x11)
+
+    raw = bytes(req)[1:]
+    if not raw or len(raw) % 2:
+        return UDS() / UDS_NR(requestServiceId=0x22, negativeResponseCode=0x13)
+
+    dids = [struct.unpack('>H', raw[i:i + 2])[0] for i in range(0, len(raw), 2)]
+    supported = [did for did in dids if did in DIDS]
+    if not supported:
+        return UDS() / UDS_NR(requestServiceId=0x22, negativeResponseCode=0x31)
+
+    return UDS(b'\x62' + b''.join(struct.pack('>H', did) + DIDS[did] for did in supported))
+
+def simulate():
+    while True:
+        req = sock1.recv()
+        if req is not None:
+            sock1.send(answer(req))
+
+sim1 = threading.Thread(target=simulate)
+
+sim1.start()
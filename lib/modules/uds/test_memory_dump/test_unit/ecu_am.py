@@ -0,0 +1,76 @@
+from scapy.all import *
+from scapy.layers.can import *
+import threading
+
+conf.contribs['ISOTP'] = {'use-can-isotp-kernel-module': True}
+conf.contribs['CANSocket'] = {'use-python-can': False}
+
+load_contrib('isotp')
+load_contrib('automotive.uds')
+load_contrib('cansocket')
+
+can_iface = 'vcan0'
+
+#simulated memory of the ECU at MEMORY_START
+MEMORY_START = 0x1000
+MEMORY = bytes((i * 7) & 0xff for i in range(0x4000))
+
+#largest block the ECU returns
+MAX_BLOCK = 1024
+
+sock1 = ISOTPSocket(can_iface, sid=0x701, did=0x601, basecls=UDS)
+
+upload = {'address': None}
+
+def negative(service, nrc):
+    return UDS(bytes([0x7f, service, nrc]))
+
+def parse_address_and_size(raw):
+    address_length = raw[0] & 0xf
+    size_length = raw[0] >> 4
+    address = int.from_bytes(raw[1:1 + address_length], 'big') - MEMORY_START
+    size = int.from_bytes(raw[1 + address_length:1 + address_length + size_length], 'big')
+    return address, size
+
+def answer(req):
+    '''Answers ReadMemoryByAddress and RequestUpload/TransferData/RequestTransferExit like an ECU.'''
+    raw = bytes(req)
+
+    if raw[0] == 0x23:
+        address, size = parse_address_and_size(raw[1:])
+        if size > MAX_BLOCK:
+            return negative(0x23, 0x31)
+        if address < 0 or address + size > len(MEMORY):
+            return negative(0x23, 0x31)
+        return UDS(b'\x63' + MEMORY[address:address + size])
+
+    if raw[0] == 0x35:
+        address, size = parse_address_and_size(raw[2:])
+        if address < 0 or address + size > len(MEMORY):
+            return negative(0x35, 0x31)
+        upload['address'] = address
+        #maxNumberOfBlockLength with 2 bytes
+        return UDS(bytes([0x75, 0x20]) + (MAX_BLOCK + 2).to_bytes(2, 'big'))
+
+    if raw[0] == 0x36:
+        if upload['address'] is None:
+            return negative(0x36, 0x24)
+        address = upload['address']
+        upload['address'] += MAX_BLOCK
+        return UDS(bytes([0x76, raw[1]]) + MEMORY[address:address + MAX_BLOCK])
+
+    if raw[0] == 0x37:
+        upload['address'] = None
+        return UDS(b'\x77')
+
+    return negative(raw[0], 0x11)
+
+def simulate():
+    while True:
+        req = sock1.recv()
+        if req is not None:
+            sock1.send(answer(req))
+
+sim1 = threading.Thread(target=simulate)
+
+sim1.start()
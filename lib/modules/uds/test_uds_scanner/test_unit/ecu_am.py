@@ -23,4 +23,33 @@ answering_machine1 = ECU_am(supported_responses=responseList, main_socket=sock1,
 
 sim1 = threading.Thread(target=answering_machine1)
 
+#second ECU that is slow to answer: ReadDataByIdentifier is answered with responsePending first and
+#RoutineControl with busyRepeatRequest the first time it is requested
+sock2 = ISOTPSocket(can_iface, sid=0x702, did=0x602, basecls=UDS)
+busy = set()
+
+def answer2(req):
+    if req.service == 0x22:
+        #the final response comes after the service timeout of the scanner
+        threading.Timer(1, sock2.send, [UDS() / UDS_RDBIPR(dataIdentifier=0xf190)]).start()
+        return UDS() / UDS_NR(requestServiceId=0x22, negativeResponseCode=0x78)
+    if req.service == 0x31:
+        if 0x31 not in busy:
+            busy.add(0x31)
+            return UDS() / UDS_NR(requestServiceId=0x31, negativeResponseCode=0x21)
+        return UDS() / UDS_RCPR(routineControlType=1, routineIdentifier=0xff00)
+    if req.service == 0x3e:
+        return UDS() / UDS_TPPR()
+
+    return UDS() / UDS_NR(requestServiceId=req.service, negativeResponseCode=0x11)
+
+def simulate2():
+    while True:
+        req = sock2.recv()
+        if req is not None:
+            sock2.send(answer2(req))
+
+sim2 = threading.Thread(target=simulate2)
+
 sim1.start()
+sim2.start()
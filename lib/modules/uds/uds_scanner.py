@@ -23,10 +23,44 @@ description:
 options:
     reset_handler:
         description:
-            - Get this option from the output of module M(ecu_switch).
-            - Currently ignored.
+            - Resets the ECU back into the default session during the session scan.
+            - If set, the sessions are explored as a graph of session transitions with DiagnosticSessionControl requests.
+            - Every reached session is asked for all sessions of I(session_range), the transitions are returned in I(ecus).
+            - To go back before the next request, the explorer uses known transitions and a request of the default session first, the ECU is only reset if that fails.
+            - Without this option scapy's session enumerator is used, which resets the ECU after every found session.
+            - A I(command) usually resets all ECUs on the bus, set I(max_workers=1) then.
         type: dict
         required: no
+        suboptions:
+            type:
+                description:
+                    - C(uds) sends the UDS service ECUReset.
+                    - C(command) runs shell commands on the managed host, e.g. to power cycle the ECU.
+                    - C(callable) calls the python function I(callable) with the scapy socket of the ECU.
+                type: str
+                choices: [ uds, command, callable ]
+                default: uds
+            reset_type:
+                description:
+                    - Reset type of the ECUReset request if I(type=uds).
+                type: str
+                choices: [ hard_reset, soft_reset ]
+                default: hard_reset
+            command:
+                description:
+                    - Shell commands that are run one after another if I(type=command).
+                    - A non zero exit code is reported as warning only.
+                type: list
+                elements: str
+            callable:
+                description:
+                    - Python function in the format C(module:function) if I(type=callable).
+                type: str
+            wait:
+                description:
+                    - Seconds to wait after the reset until the ECU is ready.
+                    - Defaults to 0.5 for C(uds), 5 for C(command) and 0 for C(callable).
+                type: float
 
     session_range:
         description:
@@ -35,7 +69,68 @@ options:
         type: int
         default: 0x100      
 
-extends_documentation_fragment: [ isotp_sockets, debug, out_file ]
+    adaptive_timeout:
+        description:
+            - Measure the round trip time of each ECU with a few TesterPresent requests before scanning.
+            - The timeouts of the service requests (0.5 seconds) and of the session requests (1 second) are derived from it.
+            - The timeout is the 99th percentile of the round trip times doubled plus a margin, at least 0.05 seconds and never more than the fixed timeout.
+            - The waits for an ECU to restart after a reset stay fixed, a restart takes longer than a request.
+            - scapy's service and session enumerators have fixed timeouts, so the services are requested all at once and the sessions one by one with the adaptive timeouts instead.
+            - The round trip time statistics and the timeouts of each socket are returned in I(rtt).
+        type: bool
+        default: no
+
+    max_workers:
+        description:
+            - Maximum amount of ECUs that are scanned concurrently.
+            - Every ECU is scanned in its own thread, the output of each ECU is written to I(out_file) as a whole in the order of I(isotp_sockets).
+            - C(0) scans all ECUs at once.
+        type: int
+        default: 8
+
+    service_window:
+        description:
+            - Maximum amount of service requests in flight per ECU during the service scan.
+            - Responses are matched to the requests by their service id, a request is done as soon as its response arrives.
+            - Every response extends the timeout of the requests in flight, as the ECU answers queued requests one after another.
+            - Requests answered with responsePending (0x78) wait up to 5 seconds for the final response without blocking the scan, requests answered with busyRepeatRequest (0x21) are repeated.
+            - C(1) sends the next request after the previous one is done.
+            - If not set, all services are requested at once. Without I(checkpoint_file) this is done in a single burst with scapy's service enumerator, as the progress of single services is not recorded.
+        type: int
+
+    result_db:
+        description:
+            - Path of a SQLite database that stores the results of every run.
+            - The table C(results) has one row per run, ECU, session, service, subfunction and response code, C(runs) has one row per run.
+            - The ECU is named C(interface:sid:did), the response code is 0 for positive responses and the negative response code otherwise.
+            - The session is the hex id of the session the request was sent in, e.g. C(0x1) for the DefaultSession.
+            - Found sessions are stored as DiagnosticSessionControl (0x10) rows with the session as subfunction.
+            - The rows of an ECU are written as soon as its scan is done, so the results of finished ECUs are kept if the scan is interrupted.
+        type: path
+
+    diff_previous:
+        description:
+            - Return the rows that were added or removed compared to the previous complete run in I(result_db).
+            - Only the ECUs of this run are compared.
+        type: bool
+        default: no
+
+    checkpoint_file:
+        description:
+            - Records the progress of the scan per socket and phase (services, sessions) in this file.
+            - The requested services and sessions and the responses are stored, so a run that fails or hangs can be continued.
+            - The file is removed after all sockets were scanned.
+        type: path
+
+    resume:
+        description:
+            - Continue from I(checkpoint_file) if it belongs to a scan with the same I(session_range) and I(reset_handler) usage.
+            - Finished phases of a socket are skipped, started phases continue with the next service or session.
+            - C(no) starts over and overwrites the checkpoint.
+        type: bool
+        default: yes
+
+extends_documentation_fragment: [ isotp_sockets, debug, out_file, daemon, metrics ]
 
 seealso:
     - name: Unified Diagnostic Services
@@ -66,6 +161,51 @@ EXAMPLES = '''
     isotp_sockets: {{ udssocks.sockets }}
     session_range: 5
     out_file: /tmp/uds_scan_result.txt
+
+- name: uds scan with waits adapted to the ECU
+  uds_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+    adaptive_timeout: yes
+
+- name: explore the session transitions, power cycle the ECU if it gets stuck in a session
+  uds_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+    session_range: 0x10
+    max_workers: 1
+    reset_handler:
+      type: command
+      command:
+        - ssh pi@172.17.104.28 pixtendtool2l -do 7 0
+        - sleep 10
+        - ssh pi@172.17.104.28 pixtendtool2l -do 7 1
+      wait: 5
+
+- name: store the results and show what changed since the last run
+  uds_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+    result_db: /var/lib/scable/uds.db
+    diff_previous: yes
+
+- name: resumable scan, rerun the task after an interruption
+  uds_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+    session_range: 0x100
+    checkpoint_file: /tmp/uds_scan.checkpoint
+
+- name: keep at most 4 service requests in flight, e.g. for an ECU with a small receive queue
+  uds_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+    service_window: 4
+
+- name: scan in the scan daemon, the sockets stay open for the following tasks
+  uds_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+    daemon: yes
+
+- name: scan at most 4 ECUs at a time
+  uds_scanner:
+    isotp_sockets: {{ udssocks.sockets }}
+    max_workers: 4
 '''
 
 RETURN = '''
@@ -85,10 +225,76 @@ found_sessions:
       - Amount of found sessions.
     type: int
     returned: always
+ecus:
+    description:
+      - Scan result of each socket in the order of I(isotp_sockets).
+    type: list
+    elements: dict
+    returned: always
+    contains:
+        socket:
+            description: the serialized socket
+            type: dict
+        found_services:
+            description: amount of found services of this ECU
+            type: int
+        found_sessions:
+            description: amount of found sessions of this ECU
+            type: int
+        probed_services:
+            description: amount of service ids requested in this run, the services requested before a resumed interruption are not counted
+            type: int
+        probed_sessions:
+            description:
+              - Amount of sessions requested in this run, the sessions requested before a resumed interruption are not counted.
+              - Always 0 with I(reset_handler), see I(sessions) for the requests of the exploration.
+            type: int
+        sessions:
+            description:
+              - Result of the session graph exploration.
+              - Contains the found I(sessions), the I(transitions) as [source, target] pairs and the amount of I(requests) and I(resets).
+            type: dict
+            returned: if I(reset_handler) is set
+        rtt:
+            description: round trip time statistics of this ECU
+            type: dict
+            returned: if I(adaptive_timeout=yes)
+rtt:
+    description:
+      - Round trip time statistics in seconds for each socket in the order of I(isotp_sockets).
+      - Contains the amount of samples and timeouts, the min, mean, p50, p99 and max round trip times and the used I(service_timeout) and I(session_timeout) in seconds.
+    type: list
+    elements: dict
+    returned: if I(adaptive_timeout=yes)
+run_id:
+    description: Id of this run in I(result_db)
+    type: int
+    returned: if I(result_db) is set
+diff:
+    description:
+      - Difference to the previous complete run in I(result_db).
+      - Contains the id of the I(previous_run) and the I(added) and I(removed) rows with the keys ecu, session, service, subfunction and response_code.
+    type: dict
+    returned: if I(diff_previous=yes)
+ansible_facts:
+    description:
+      - I(scable_can) with the CAN capabilities of the host, the rtnetlink link info is cached until the next boot, a change of the kernel modules or a restart of an interface.
+      - Contains the loaded CAN kernel I(modules), the CAN I(interfaces) with state, up, mtu, fd, txqueuelen, kind, bitrate and data_bitrate and the I(isotp_transport) (native or soft).
+    type: dict
+    returned: on Linux
+metrics:
+    description:
+      - I(phases) with the seconds and calls of daemon_start, load_scapy, load_socks, rtt, services, sessions and one phase C(ecu <ecu key>) per ECU, the phases of concurrent workers are summed up.
+      - I(counters) of the sent and received UDS messages (uds.sent, uds.received) and of the requests without response (uds.timeouts).
+      - I(histograms) with the latencies of the service requests, session changes and resets (uds.service, uds.session, uds.reset) in seconds, the buckets are in milliseconds.
+      - The I(duration) of the module, the I(threads) and I(peak_threads) and the I(peak_rss_kb) of the module process and I(children_peak_rss_kb) of its worker processes.
+    type: dict
+    returned: if I(metrics=yes)
 '''
 import traceback 
 import os
 import json
+import time
 import contextlib
 
 from ansible.module_utils.basic import AnsibleModule, missing_required_lib
@@ -103,23 +309,288 @@ except:
 #make the single ansible module object global so that all functions can reach it
 module = None
 
+#fixed wait after an ECU reset in the session scan
+RESET_WAIT = 0.5
+
+#timeout of a DiagnosticSessionControl request of the session exploration
+SESSION_TIMEOUT = 1
+
 def fail_on_missing_option(**kwargs):
     for option_name, option_value in kwargs.items():
         if not option_value:
             module.fail_json(msg="missing option '{}'".format(option_name))
 
+def scan_ecu(job):
+    '''
+        Scans the services and sessions of a single ECU.
+        Called concurrently for all sockets, so only the socket of the job must be used here.
+
+        job: dict with the socket, the serialized socket (socket_dict), the module options session_range,
+             adaptive_timeout, reset_handler and service_window, the ResultDb db (or None), the UdsCheckpoint cp (or None),
+             the socket path of the daemon (or None, the socket is None with a daemon) and dump
+
+        Returns a tuple (ecu, text) with the result section of the ECU and its output for out_file if dump is set.
+    '''
+    sock = job['sock']
+    socket_dict = job['socket_dict']
+    session_range = job['session_range']
+    reset_handler = job['reset_handler']
+    db = job['db']
+    cp = job['cp']
+    daemon = job['daemon']
+    dump = job['dump']
+    ecu_key = scapy_utils.resultdb.ecu_key(socket_dict)
+    ecu = {
+        'socket': socket_dict,
+        'found_services': 0,
+        'found_sessions': 0,
+        'probed_services': 0,
+        'probed_sessions': 0
+    }
+    text = []
+    started = time.time()
+
+    #the round trip time only shortens the timeouts of requests, the ECU needs the fixed waits to restart after a reset
+    #without adaptive_timeout, the sessions are requested with the fixed timeouts of scapy's session enumerator
+    service_timeout = scapy_utils.uds.SERVICE_TIMEOUT
+    session_timeout = SESSION_TIMEOUT if job['reset_handler'] else None
+    if job['adaptive_timeout']:
+        estimator = scapy_utils.rtt.RttEstimator()
+        with scapy_utils.metrics.phase('rtt'):
+            if daemon:
+                measured = scapy_utils.daemon.request(daemon, 'uds_rtt', socket_dict=socket_dict)
+                for sample in measured['samples']:
+                    estimator.add(sample)
+                estimator.timeouts = measured['timeouts']
+            else:
+                scapy_utils.uds.measure_rtt(sock, estimator)
+        service_timeout = estimator.timeout(service_timeout)
+        session_timeout = estimator.timeout(SESSION_TIMEOUT)
+        ecu['rtt'] = estimator.stats()
+        ecu['rtt']['service_timeout'] = service_timeout
+        ecu['rtt']['session_timeout'] = session_timeout
+        scapy_utils.debug("round trip times {}, request timeouts {}s and {}s", ecu['rtt'], service_timeout,
+                          session_timeout)
+
+    #a client of the daemon only loads scapy for out_file, otherwise the raw responses are evaluated by their fields
+    parse = UDS if not daemon or dump else scapy_utils.uds.Response
+
+    phase_started = time.time()
+    state = cp.state(ecu_key, 'services') if cp else {'done': False}
+    #responses are stored as raw bytes in the checkpoint
+    found_services = [(session, parse(bytes.fromhex(resp))) for session, resp in state.get('found', [])]
+
+    if not state['done']:
+        scapy_utils.debug("Starting service scan on {}", socket_dict)
+        #the services requested before an interruption are skipped
+        skip = set(state.get('probed', []))
+        ecu['probed_services'] = len([sid for sid in scapy_utils.uds.SERVICE_IDS if sid not in skip])
+
+        def service_progress(sid, resp):
+            if resp is not None and scapy_utils.uds.is_available(resp):
+                cp.append(ecu_key, 'services', found=['DefaultSession', bytes(resp).hex()])
+            cp.append(ecu_key, 'services', probed=sid)
+
+        #without a checkpoint the progress of single services is not needed, so by default all services are requested
+        #in one burst with scapy's enumerator, a silent ECU costs a single timeout instead of one per service
+        #the enumerator has a fixed timeout, with adaptive_timeout all services are in flight in enumerate_services()
+        burst = cp is None and job['service_window'] is None and not job['adaptive_timeout']
+
+        if daemon:
+            #the daemon reports every request as soon as it is done, so the checkpoint is written while it scans
+            def daemon_service_progress(probed):
+                sid, resp = probed
+                resp = parse(bytes.fromhex(resp)) if resp is not None else None
+                if cp:
+                    service_progress(sid, resp)
+                if resp is not None and scapy_utils.uds.is_available(resp):
+                    found_services.append(('DefaultSession', resp))
+
+            scapy_utils.daemon.request(daemon, 'uds_services', progress=daemon_service_progress,
+                                       socket_dict=socket_dict, skip=sorted(skip), window=job['service_window'],
+                                       burst=burst, timeout=service_timeout)
+        elif burst:
+            found_services += UDS_ServiceEnumerator(sock)
+        else:
+            found_services += scapy_utils.uds.enumerate_services(sock, timeout=service_timeout, skip=skip,
+                                                                 progress=service_progress if cp else None,
+                                                                 window=job['service_window'])
+        if cp:
+            cp.finish(ecu_key, 'services')
+
+    ecu['found_services'] = len(found_services)
+    scapy_utils.metrics.add('services', time.time() - phase_started)
+
+    if db:
+        db.add(scapy_utils.resultdb.service_rows(ecu_key, found_services))
+
+    if dump:
+        text.append("------------------------------------------------------")
+        text.append("Scanning on ISOTP socket:\n {}".format(json.dumps(socket_dict, indent=4)))
+        text.append("UDS_SERVICE_SCAN_RESULTS")
+        text.append(make_lined_table(found_services, getTableEntry, dump=True))
+
+    phase_started = time.time()
+    state = cp.state(ecu_key, 'sessions') if cp else {'done': False}
+
+    if not state['done']:
+        scapy_utils.debug("Starting session scan on {}", socket_dict)
+
+    if reset_handler:
+        if state['done']:
+            ecu['sessions'] = state['result']
+        else:
+            def explorer_progress(source, target, reached):
+                if reached:
+                    cp.append(ecu_key, 'sessions', transitions=[source, target])
+                cp.append(ecu_key, 'sessions', tried=[source, target])
+
+            #every ECU gets its own handler, so the resets are counted per ECU
+            handler = scapy_utils.reset.make_reset_handler(reset_handler)
+            explorer = scapy_utils.reset.SessionExplorer(sock, handler, range(0, session_range),
+                                                         timeout=session_timeout,
+                                                         transitions=state.get('transitions', []),
+                                                         tried=state.get('tried', []),
+                                                         progress=explorer_progress if cp else None)
+            ecu['sessions'] = explorer.explore()
+
+            if cp:
+                cp.set(ecu_key, 'sessions', result=ecu['sessions'])
+                cp.finish(ecu_key, 'sessions')
+
+        ecu['found_sessions'] = len(ecu['sessions']['sessions'])
+
+        if db:
+            db.add(scapy_utils.resultdb.session_rows(ecu_key, ecu['sessions']['transitions']))
+
+        if dump:
+            text.append("UDS_SESSION_SCAN_RESULTS")
+            text.append("sessions: {}".format(", ".join(hex(s) for s in ecu['sessions']['sessions'])))
+            for source, target in ecu['sessions']['transitions']:
+                text.append("  {:#x} -> {:#x}".format(source, target))
+            text.append("{} requests, {} resets".format(ecu['sessions']['requests'], ecu['sessions']['resets']))
+    else:
+        found_sessions = [parse(bytes.fromhex(pkt)) for pkt in state.get('found', [])]
+
+        if not state['done']:
+            #the sessions requested before an interruption are skipped
+            skip = set(state.get('probed', []))
+            ecu['probed_sessions'] = len([session for session in range(0, session_range) if session not in skip])
+
+            def session_progress(session, found):
+                for pkt in found:
+                    cp.append(ecu_key, 'sessions', found=bytes(pkt).hex())
+                cp.append(ecu_key, 'sessions', probed=session)
+
+            if daemon:
+                def daemon_session_progress(probed):
+                    session, found = probed
+                    found = [parse(bytes.fromhex(pkt)) for pkt in found]
+                    if cp:
+                        session_progress(session, found)
+                    found_sessions.extend(found)
+
+                scapy_utils.daemon.request(daemon, 'uds_sessions', progress=daemon_session_progress,
+                                           socket_dict=socket_dict, session_range=session_range,
+                                           reset_wait=RESET_WAIT, skip=sorted(skip), timeout=session_timeout)
+            else:
+                found_sessions += scapy_utils.uds.enumerate_sessions(sock, range(0, session_range), RESET_WAIT,
+                                                                     skip=skip,
+                                                                     progress=session_progress if cp else None,
+                                                                     timeout=session_timeout)
+            if cp:
+                cp.finish(ecu_key, 'sessions')
+
+        ecu['found_sessions'] = len(found_sessions)
+
+        if db:
+            db.add(scapy_utils.resultdb.session_rows(ecu_key, [s.diagnosticSessionType for s in found_sessions]))
+
+        if dump:
+            text.append("UDS_SESSION_SCAN_RESULTS")
+            for s in found_sessions:
+                text.append(s.show(dump=True))
+
+    if db:
+        #the rows of a finished ECU are committed, the other ECUs may still be scanned for a long time
+        db.flush()
+
+    scapy_utils.metrics.add('sessions', time.time() - phase_started)
+    #the phases of the ECUs overlap, the time of every ECU is reported as its own phase
+    scapy_utils.metrics.add("ecu {}".format(ecu_key), time.time() - started)
+
+    return ecu, "".join(line if line.endswith("\n") else line + "\n" for line in text)
+
 def run_module():
     global module
 
     module_args = {
         'reset_handler': {
             'type': 'dict',
-            'required': False
+            'required': False,
+            'options': {
+                'type': {
+                    'type': 'str',
+                    'choices': ['uds', 'command', 'callable'],
+                    'default': 'uds'
+                },
+                'reset_type': {
+                    'type': 'str',
+                    'choices': ['hard_reset', 'soft_reset'],
+                    'default': 'hard_reset'
+                },
+                'command': {
+                    'type': 'list',
+                    'elements': 'str'
+                },
+                'callable': {
+                    'type': 'str'
+                },
+                'wait': {
+                    'type': 'float'
+                }
+            }
         }, 
         'session_range': {
             'type': int,
             'default': 0x100
         },
+        'adaptive_timeout': {
+            'type': 'bool',
+            'default': False
+        },
+        'service_window': {
+            'type': 'int'
+        },
+        'max_workers': {
+            'type': 'int',
+            'default': 8
+        },
+        'result_db': {
+            'type': 'path'
+        },
+        'diff_previous': {
+            'type': 'bool',
+            'default': False
+        },
+        'checkpoint_file': {
+            'type': 'path'
+        },
+        'resume': {
+            'type': 'bool',
+            'default': True
+        },
+        'daemon': {
+            'type': 'bool',
+            'default': False
+        },
+        'daemon_socket': {
+            'type': 'path'
+        },
+        'daemon_idle_timeout': {
+            'type': 'int',
+            'default': 600
+        },
         'isotp_sockets': {
             'type': 'list', 
             'elements': 'dict', 
@@ -129,6 +600,17 @@ def run_module():
             'type': 'bool',
             'default': False
         },
+        'log_file': {
+            'type': 'path'
+        },
+        'metrics': {
+            'type': 'bool',
+            'default': False
+        },
+        'multiplexed_transport': {
+            'type': 'bool',
+            'default': False
+        },
         'out_file': {
             'type': 'str'
         }
@@ -137,7 +619,8 @@ def run_module():
     result = {
         'changed': False,
         'found_sessions': 0,
-        'found_services': 0
+        'found_services': 0,
+        'ecus': []
     }
 
     module = AnsibleModule(
@@ -145,10 +628,23 @@ def run_module():
         supports_check_mode=True
     )
 
-    reset_handler = module.params.get('reset_handler') #not used yet
+    reset_handler = module.params.get('reset_handler')
     isotp_sockets = module.params['isotp_sockets']
+    multiplexed_transport = module.params['multiplexed_transport']
     session_range = module.params['session_range']
+    adaptive_timeout = module.params['adaptive_timeout']
+    max_workers = module.params['max_workers']
+    service_window = module.params.get('service_window')
+    result_db = module.params.get('result_db')
+    diff_previous = module.params['diff_previous']
+    checkpoint_file = module.params.get('checkpoint_file')
+    resume = module.params['resume']
+    daemon = module.params['daemon']
+    daemon_socket = module.params.get('daemon_socket')
+    daemon_idle_timeout = module.params['daemon_idle_timeout']
     debug = module.params['debug']
+    log_file = module.params.get('log_file')
+    metrics = module.params['metrics']
     out_file = module.params.get('out_file')
 
     #check if all dependencies are there
@@ -158,13 +654,51 @@ def run_module():
     if module.check_mode:
         module.exit_json(**result)
 
-    scapy_utils.init(ansible_module=module, debug=debug)
-
-    #load scapy with isotp + uds features
-    scapy_utils.load_scapy(isotp=True, uds=True)
-
-    #deserialize sockets into real scapy objects
-    isotp_sockets_objects = scapy_utils.isotp.load_socks(isotp_sockets)
+    scapy_utils.init(ansible_module=module, debug=debug, log_file=log_file)
+
+    if metrics:
+        scapy_utils.metrics.enable()
+
+    if diff_previous and not result_db:
+        module.fail_json(msg="diff_previous needs result_db")
+
+    if service_window is not None and service_window < 1:
+        module.fail_json(msg="service_window must be at least 1")
+
+    if reset_handler:
+        #check the options before the first ECU is scanned
+        try:
+            scapy_utils.reset.make_reset_handler(reset_handler)
+        except (ValueError, ImportError, AttributeError) as e:
+            module.fail_json(msg="invalid reset_handler: {}".format(e))
+
+    if daemon and reset_handler:
+        module.fail_json(msg="reset_handler is not supported with daemon")
+
+    if daemon:
+        #the daemon has scapy loaded and holds the sockets
+        daemon_socket = daemon_socket or scapy_utils.daemon.default_socket()
+        try:
+            with scapy_utils.metrics.phase('daemon_start'):
+                scapy_utils.daemon.start(daemon_socket, idle_timeout=daemon_idle_timeout)
+        except scapy_utils.daemon.DaemonError as e:
+            module.fail_json(msg=str(e))
+        isotp_sockets_objects = [None] * len(isotp_sockets)
+    else:
+        daemon_socket = None
+
+    #load scapy with isotp + uds features, the output for out_file needs make_lined_table of scapy.utils
+    #a client of the daemon only needs scapy to print the responses to out_file
+    if not daemon or out_file:
+        with scapy_utils.metrics.phase('load_scapy'):
+            scapy_utils.load_scapy(isotp=True, uds=True, utils=bool(out_file))
+
+    if not daemon:
+        #deserialize sockets into real scapy objects
+        #load_socks() modifies the dicts, the originals are returned in the ecus section
+        with scapy_utils.metrics.phase('load_socks'):
+            isotp_sockets_objects = scapy_utils.isotp.load_socks([dict(s) for s in isotp_sockets],
+                                                                 multiplexed=multiplexed_transport)
 
 
     if out_file:
@@ -185,35 +719,67 @@ def run_module():
 
             scapy_utils.debug("starting uds scans")
 
-            for i, sock in enumerate(isotp_sockets_objects):
-                scapy_utils.debug("socket {}/{}".format(i, len(isotp_sockets_objects)-1))
-
-                scapy_utils.debug("Starting service scan")
-                found_services = UDS_ServiceEnumerator(sock)
-
-                result['found_services'] += len(found_services)
-
+            db = scapy_utils.resultdb.ResultDb(result_db, 'uds_scanner') if result_db else None
+
+            cp = None
+            if checkpoint_file:
+                #the progress is stored per socket, so sockets can be added or removed between the runs
+                params = {'session_range': session_range, 'explore': bool(reset_handler)}
+                cp = scapy_utils.checkpoint.UdsCheckpoint(checkpoint_file, params, resume=resume)
+
+            jobs = [
+                dict(
+                    sock=sock,
+                    socket_dict=isotp_sockets[i],
+                    session_range=session_range,
+                    adaptive_timeout=adaptive_timeout,
+                    reset_handler=reset_handler,
+                    db=db,
+                    cp=cp,
+                    service_window=service_window,
+                    daemon=daemon_socket,
+                    dump=bool(out_file)
+                )
+                for i, sock in enumerate(isotp_sockets_objects)
+            ]
+            #the ECUs are independent targets, so they are scanned concurrently
+            ecus = scapy_utils.parallel.run_threads(scan_ecu, jobs, max_threads=max_workers)
+
+            for ecu, text in ecus:
+                result['found_services'] += ecu['found_services']
+                result['found_sessions'] += ecu['found_sessions']
+                result['ecus'].append(ecu)
+
+                #the output of each ECU is buffered, so the sections are not interleaved
                 if out_file:
-                    print("------------------------------------------------------")
-                    print("Scanning on ISOTP socket:\n {}".format(json.dumps(isotp_sockets[i], indent=4)))
-                    print("UDS_SERVICE_SCAN_RESULTS")
-                    make_lined_table(found_services, getTableEntry)
+                    print(text, end='')
 
-                scapy_utils.debug("Starting session scan")
-                found_sessions = UDS_SessionEnumerator(sock, session_range=range(0, session_range), reset_wait=0.5)
+            if adaptive_timeout:
+                result['rtt'] = [ecu['rtt'] for ecu, _ in ecus]
 
-                result['found_sessions'] += len(found_sessions)
+            if cp:
+                #all sockets are done
+                cp.remove()
 
-                if out_file:
-                    print("UDS_SESSION_SCAN_RESULTS")
-                    for s in found_sessions:
-                        s.show()
+            if db:
+                result['run_id'] = db.run_id
+                if diff_previous:
+                    result['diff'] = db.diff_previous()
+                db.close()
     except IOError:
         module.fail_json(msg="could not write to out_file", exception=traceback.format_exc())
 
+    #the receiver thread of the multiplexed transport stops with the last socket
+    scapy_utils.isotp.close_socks(isotp_sockets_objects)
 
     result['changed'] = True
 
+    #the CAN capabilities of the host, e.g. to check the transport in later tasks
+    result['ansible_facts'] = scapy_utils.can_facts()
+
+    if metrics:
+        result['metrics'] = scapy_utils.metrics.report()
+
     module.exit_json(**result)
 
 def main():